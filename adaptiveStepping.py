@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Paso de tension adaptativo para los sweeps I-V: pasos grandes donde la corriente apenas cambia y pasos pequeños
+donde cambia rapido o se acerca al umbral de overflow (maxCurrentDelta_inTimesOfPreviousCurrent de start_process).
+"""
+
+import math
+
+SWEEP_LINEAR = "linear"
+SWEEP_ADAPTIVE = "adaptive"
+
+
+class AdaptiveStepController:
+    """
+    Decide el siguiente setpoint a partir de la corriente medida en el punto actual.
+
+    El paso se escala para que cada punto cambie la corriente unas targetDecadesPerStep decadas (|log10(I2/I1)|),
+    con un cambio de como mucho x2 / x0.5 entre pasos consecutivos. Si el salto de corriente se acerca a la fraccion
+    overflowApproach del umbral de overflow el paso baja directamente a minStepVoltage. El paso se mantiene siempre
+    entre minStepVoltage y maxStepVoltage y lo bastante grande para llegar a finalVoltage con los puntos que quedan
+    de maxPoints.
+
+    Args:
+        initialVoltage (float): Primer setpoint del sweep. Volts
+        finalVoltage (float): Ultimo setpoint del sweep. Volts
+        minStepVoltage (float): Paso minimo. Volts
+        maxStepVoltage (float): Paso maximo. Volts
+        maxPoints (int): Numero maximo de puntos del sweep (incluido el primero)
+        initialStepVoltage (float): Paso con el que se empieza. Volts
+        overflowFactor (float): maxCurrentDelta_inTimesOfPreviousCurrent del sweep
+        targetDecadesPerStep (float): Cambio de corriente buscado en cada paso. Decadas
+        overflowApproach (float): Fraccion del umbral de overflow a partir de la cual se refina al paso minimo
+        currentFloor (float): Corrientes por debajo de este valor se consideran ruido. Amps
+    """
+
+    def __init__(self, initialVoltage, finalVoltage, minStepVoltage, maxStepVoltage, maxPoints,
+                 initialStepVoltage=None, overflowFactor=100, targetDecadesPerStep=0.1, overflowApproach=0.1,
+                 currentFloor=1e-13):
+        self.initialVoltage = initialVoltage
+        self.finalVoltage = finalVoltage
+        self.direction = 1 if finalVoltage >= initialVoltage else -1
+        self.minStepVoltage = abs(minStepVoltage)
+        self.maxStepVoltage = abs(maxStepVoltage)
+        self.maxPoints = int(maxPoints)
+        self.overflowFactor = overflowFactor
+        self.targetDecadesPerStep = targetDecadesPerStep
+        self.overflowApproach = overflowApproach
+        self.currentFloor = currentFloor
+
+        if initialStepVoltage is None:
+            initialStepVoltage = self.minStepVoltage
+        self.stepVoltage = min(max(abs(initialStepVoltage), self.minStepVoltage), self.maxStepVoltage)
+        self.points = 0
+        self.previousCurrent = None
+
+    def remainingVoltage(self, voltage):
+        return max(self.direction * (self.finalVoltage - voltage), 0.0)
+
+    def nextVoltage(self, voltage, current):
+        """
+        Registra la corriente medida en el setpoint voltage y devuelve el siguiente setpoint, o None si el sweep
+        ha terminado (finalVoltage alcanzado o presupuesto de puntos agotado).
+        """
+        self.points += 1
+
+        if self.previousCurrent is not None:
+            previous = max(abs(self.previousCurrent), self.currentFloor)
+            actual = max(abs(current), self.currentFloor)
+            decades = abs(math.log10(actual / previous))
+
+            # escala del paso: cambio pequeño --> paso mayor, cambio grande --> paso menor
+            scale = self.targetDecadesPerStep / max(decades, 1e-6)
+            self.stepVoltage *= min(max(scale, 0.5), 2.0)
+
+            # cerca del umbral de overflow refinamos al maximo
+            delta = current - self.previousCurrent
+            if delta > 0 and delta > self.overflowApproach * self.overflowFactor * previous:
+                self.stepVoltage = self.minStepVoltage
+
+        self.previousCurrent = current
+
+        remaining = self.remainingVoltage(voltage)
+        remainingPoints = self.maxPoints - self.points
+        if remaining <= 0 or remainingPoints <= 0:
+            return None
+
+        # limites de paso y presupuesto de puntos (el presupuesto manda sobre el paso maximo)
+        self.stepVoltage = min(max(self.stepVoltage, self.minStepVoltage), self.maxStepVoltage)
+        self.stepVoltage = max(self.stepVoltage, remaining / remainingPoints)
+
+        # el ultimo punto cae exactamente en finalVoltage
+        return voltage + self.direction * min(self.stepVoltage, remaining)
+
+    def getState(self):
+        """
+        Estado que cambia durante el sweep (para sweepCheckpoint).
+        """
+        return {"stepVoltage": self.stepVoltage, "points": self.points, "previousCurrent": self.previousCurrent}
+
+    def setState(self, state):
+        self.stepVoltage = state["stepVoltage"]
+        self.points = state["points"]
+        self.previousCurrent = state["previousCurrent"]
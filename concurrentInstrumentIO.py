@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Capa de concurrencia para hablar a la vez con la fuente HV y con el K2400 dentro de un punto del sweep.
+
+Cada instrumento tiene su propio hilo (InstrumentWorker): todas las operaciones sobre un instrumento se ejecutan en
+orden en su hilo, y las de instrumentos distintos se solapan (p.ej. la lectura STATUS,MU de la fuente mientras el
+K2400 integra). OutputInterlock mantiene las reglas de seguridad entre la pareja de instrumentos, sea cual sea el
+hilo que los mueve.
+
+Lo unico que se solapa dentro de un punto es la adquisicion: la lectura STATUS,MU de la fuente (~0.5 s, casi todo la
+espera entre la query y la respuesta) y la integracion del K2400 (NPLC / 50 Hz por conversion, por el numero de
+promedios). Cada punto ahorra la mas corta de las dos. El resto del punto son esperas deliberadas que hay que hacer en
+orden (estabilizacion de la fuente, measureDelay_ms) y cuestan lo mismo en los dos modos, asi que el ahorro total es
+pequeño frente a la duracion del sweep (ver los tiempos en sweepBenchmark.py --sequential).
+"""
+
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class InstrumentWorker:
+    """
+    Ejecuta las operaciones de un instrumento en un hilo propio (una cola, un hilo --> acceso serializado).
+    Con concurrent=False las operaciones se ejecutan en el hilo que llama y submit devuelve un Future ya resuelto,
+    de forma que el mismo codigo sirve para el modo secuencial.
+
+    Args:
+        instrument (pyvisa.resource.resource): Instrumento al que se accede desde este worker
+        concurrent (bool): Si False no se crea ningun hilo
+    """
+
+    def __init__(self, instrument, concurrent=True):
+        self.instrument = instrument
+        self.executor = None
+        if concurrent:
+            self.executor = ThreadPoolExecutor(max_workers=1,
+                                               thread_name_prefix="io-" + str(instrument.resource_name))
+
+    def submit(self, function, *args, **kwargs):
+        if self.executor is not None:
+            # la operacion se ejecuta con el contexto (contextvars) de quien la lanza, no con el del hilo del worker
+            return self.executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def call(self, function, *args, **kwargs):
+        return self.submit(function, *args, **kwargs).result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+class InterlockError(RuntimeError):
+    pass
+
+
+class OutputInterlock:
+    """
+    Reglas de seguridad entre el amperimetro (K2400) y la fuente HV que alimenta la muestra en serie con el:
+        - No se puede encender la HV ni pedir un setpoint > 0 con la salida del amperimetro apagada.
+        - No se puede apagar (ni resetear) el amperimetro mientras la fuente pueda tener tension: solo cuando se
+          ha confirmado que la salida de la fuente esta estable en 0V.
+    Al principio el estado de la fuente es desconocido y se considera que puede tener tension.
+    """
+
+    def __init__(self, k2400, hv_source):
+        self.k2400 = k2400
+        self.hv_source = hv_source
+        self.lock = threading.Lock()
+        self.ammeterOutputOn = False
+        self.hvSourceSafe = False
+
+    def checkHVCanBeApplied(self, action):
+        with self.lock:
+            if not self.ammeterOutputOn:
+                raise InterlockError(action + " on " + str(self.hv_source.resource_name) +
+                                     " refused: ammeter output is OFF")
+            self.hvSourceSafe = False
+
+    def checkAmmeterCanGoOff(self, action):
+        with self.lock:
+            if not self.hvSourceSafe:
+                raise InterlockError(action + " on " + str(self.k2400.resource_name) +
+                                     " refused: HV source output has not been confirmed at 0V")
+            self.ammeterOutputOn = False
+
+    def ammeterOutputTurnedOn(self):
+        with self.lock:
+            self.ammeterOutputOn = True
+
+    def hvSourceSettledAt(self, voltage):
+        with self.lock:
+            self.hvSourceSafe = voltage == 0
+
+
+# interlock de cada pareja de instrumentos, accesible desde cualquiera de los dos (clave: resource_name)
+_interlocks = {}
+_interlocksLock = threading.Lock()
+
+
+def registerOutputInterlock(k2400, hv_source):
+    interlock = OutputInterlock(k2400, hv_source)
+    with _interlocksLock:
+        _interlocks[k2400.resource_name] = interlock
+        _interlocks[hv_source.resource_name] = interlock
+    return interlock
+
+
+def getOutputInterlock(instrument):
+    """
+    Interlock registrado para el instrumento o None si el instrumento no forma parte de ninguna pareja.
+    """
+    with _interlocksLock:
+        return _interlocks.get(instrument.resource_name)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Modo monitor a tension constante para los ensayos de envejecimiento (miles de horas, p.ej. s11@225_3244h).
+
+start_monitor usa los mismos drivers que start_process (main.py): fija la fuente HV en una tension y mide la
+corriente con el K2400 cada samplePeriod segundos hasta que se acaba duration, se interrumpe (Ctrl+C) o salta la
+deteccion de ruptura / compliance (currentStatistics.BreakdownDetector). Una lectura de la fuente fallida (respuesta
+mal formada despues de los reintentos del driver) solo se salta esa muestra: el monitor para si fallan
+maxConsecutiveErrors muestras seguidas. Al terminar la fuente siempre se baja a 0V.
+
+La memoria y el disco estan acotados por muy largo que sea el ensayo:
+    - las muestras a resolucion completa de las ultimas fullResolutionHours horas estan en un buffer circular de
+      tamaño fijo (RingBuffer), respaldado por <monitor>.samples.npy (memmap: se puede consultar desde otro proceso
+      mientras el monitor sigue midiendo);
+    - cada nivel de diezmado (por defecto ventanas de 1 min, 10 min y 1 h) guarda min / media / max de la corriente
+      de cada ventana en su propio buffer circular en disco (<monitor>.<ventana>s.npy), con su numero maximo de
+      ventanas (30 dias, 1 año y 10 años por defecto).
+Si el monitor se reinicia con el mismo monitorFilePath sigue llenando los mismos buffers. --query abre los ficheros
+solo para lectura.
+
+Uso:
+    python constantVoltageMonitor.py <monitor> --voltage 1000 [--config process_config_file.json] [--simulate]
+                                     [--period 1] [--duration-hours 24] [--full-resolution-hours 24]
+    python constantVoltageMonitor.py <monitor> --query 6 [--window 600]   --> ultimas 6h (completas o diezmadas)
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from numpy.lib.recfunctions import repack_fields
+from termcolor import colored
+
+from concurrentInstrumentIO import getOutputInterlock
+from currentStatistics import BreakdownDetector
+from hvSourceDriver import hvSourceDriver, HVSourceResponseError
+from voltageSettling import RampSettlingPredictor
+import main
+
+SAMPLE_DTYPE = np.dtype([("timestamp", "f8"), ("voltage", "f8"), ("current", "f8")])
+AGGREGATE_DTYPE = np.dtype([("timestamp", "f8"), ("samples", "i8"), ("voltage", "f8"), ("currentMin", "f8"),
+                            ("currentMean", "f8"), ("currentMax", "f8")])
+
+# (ventana en segundos, ventanas que se guardan)
+DEFAULT_LEVELS = ((60, 30 * 24 * 60), (600, 365 * 24 * 6), (3600, 10 * 365 * 24))
+
+
+class RingBuffer:
+    """
+    Buffer circular de registros numpy de tamaño fijo, en memoria o respaldado por un fichero .npy (memmap).
+
+    Cada registro lleva ademas un numero de secuencia creciente (campo "sequence", -1 en los huecos sin usar): el
+    orden y la posicion de escritura se reconstruyen con el al reabrir el fichero. No dependen de los timestamps,
+    que pueden ir hacia atras si el reloj del PC se corrige (NTP, cambio de hora).
+
+    Args:
+        dtype (numpy.dtype): Tipo de los registros (con campo "timestamp")
+        capacity (int): Numero de registros
+        filePath (str): Fichero .npy (None --> solo en memoria)
+        readOnly (bool): Abre un fichero existente solo para lectura (p.ej. para consultarlo desde otro proceso)
+    """
+
+    def __init__(self, dtype, capacity, filePath=None, readOnly=False):
+        self.filePath = filePath
+        self.dtype = dtype
+        storedDtype = np.dtype(dtype.descr + [("sequence", "i8")])
+        if filePath is None:
+            self.records = np.zeros(capacity, storedDtype)
+            self.records["sequence"] = -1
+        elif os.path.exists(filePath) or readOnly:
+            self.records = open_memmap(filePath, mode="r" if readOnly else "r+")
+            if self.records.dtype != storedDtype or self.records.shape != (capacity,):
+                raise ValueError(filePath + " has " + str(self.records.shape[0]) + " records of " +
+                                 str(self.records.dtype) + ", expected " + str(capacity) + " of " + str(storedDtype))
+        else:
+            self.records = open_memmap(filePath, mode="w+", dtype=storedDtype, shape=(capacity,))
+            self.records["sequence"] = -1
+
+        sequences = self.records["sequence"]
+        self.count = int(np.count_nonzero(sequences >= 0))
+        last = int(np.argmax(sequences)) if self.count else None
+        self.sequence = int(sequences[last]) + 1 if self.count else 0
+        self.index = (last + 1) % capacity if self.count else 0
+
+    @property
+    def capacity(self):
+        return len(self.records)
+
+    def append(self, record):
+        self.records[self.index] = tuple(record) + (self.sequence,)
+        self.sequence += 1
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self):
+        """
+        :return: numpy.ndarray (copia, con dtype) con los registros en orden de llegada
+        """
+        records = np.concatenate((self.records[self.index:], self.records[:self.index]))
+        records = records[records["sequence"] >= 0]
+        return repack_fields(records[list(self.dtype.names)])
+
+    def since(self, timestamp):
+        records = self.ordered()
+        return records[records["timestamp"] >= timestamp]
+
+    def flush(self):
+        if self.filePath is not None:
+            self.records.flush()
+
+
+class DecimationLevel:
+    """
+    Un nivel de diezmado: min / media / max de la corriente (y media de la tension) de cada ventana de window
+    segundos, alineadas con el reloj (p.ej. cada minuto en punto).
+
+    Args:
+        window (float): Duracion de la ventana. Seconds
+        capacity (int): Ventanas que se guardan
+        filePath (str): Fichero .npy del buffer circular (None --> solo en memoria)
+        readOnly (bool): Ver RingBuffer
+    """
+
+    def __init__(self, window, capacity, filePath=None, readOnly=False):
+        self.window = window
+        self.buffer = RingBuffer(AGGREGATE_DTYPE, capacity, filePath, readOnly)
+        self.windowStart = None
+        self.resetWindow()
+
+    def resetWindow(self):
+        self.samples = 0
+        self.voltageSum = 0.0
+        self.currentSum = 0.0
+        self.currentMin = math.inf
+        self.currentMax = -math.inf
+
+    def add(self, timestamp, voltage, current):
+        windowStart = math.floor(timestamp / self.window) * self.window
+        if self.windowStart is not None and windowStart != self.windowStart:
+            self.closeWindow()
+        self.windowStart = windowStart
+        self.samples += 1
+        self.voltageSum += voltage
+        self.currentSum += current
+        self.currentMin = min(self.currentMin, current)
+        self.currentMax = max(self.currentMax, current)
+
+    def closeWindow(self):
+        if self.samples:
+            self.buffer.append((self.windowStart, self.samples, self.voltageSum / self.samples, self.currentMin,
+                                self.currentSum / self.samples, self.currentMax))
+        self.resetWindow()
+
+
+def levelFilePath(monitorFilePath, window):
+    return monitorFilePath + "." + "%g" % window + "s.npy"
+
+
+def samplesFilePath(monitorFilePath):
+    return monitorFilePath + ".samples.npy"
+
+
+class ConstantVoltageMonitor:
+    """
+    Almacenamiento acotado de un monitor: muestras recientes a resolucion completa y niveles de diezmado.
+
+    Args:
+        monitorFilePath (str): Prefijo de los ficheros del monitor (None --> solo en memoria)
+        samplePeriod (float): Periodo de muestreo previsto (para dimensionar el buffer). Seconds
+        fullResolutionHours (float): Horas que se guardan a resolucion completa
+        levels (tuple): (ventana en segundos, ventanas que se guardan) de cada nivel de diezmado
+        readOnly (bool): Abre los ficheros de un monitor existente solo para consultarlos
+    """
+
+    def __init__(self, monitorFilePath=None, samplePeriod=1.0, fullResolutionHours=24.0, levels=DEFAULT_LEVELS,
+                 readOnly=False):
+        capacity = int(math.ceil(fullResolutionHours * 3600 / samplePeriod))
+        self.samples = RingBuffer(SAMPLE_DTYPE, capacity,
+                                  None if monitorFilePath is None else samplesFilePath(monitorFilePath), readOnly)
+        self.levels = [DecimationLevel(window, levelCapacity,
+                                       None if monitorFilePath is None else levelFilePath(monitorFilePath, window),
+                                       readOnly)
+                       for window, levelCapacity in levels]
+
+    def add(self, timestamp, voltage, current):
+        self.samples.append((timestamp, voltage, current))
+        for level in self.levels:
+            level.add(timestamp, voltage, current)
+
+    def level(self, window):
+        for level in self.levels:
+            if level.window == window:
+                return level
+        raise ValueError("No decimation level of " + str(window) + "s")
+
+    def recent(self, hours):
+        """
+        :return: numpy.ndarray (SAMPLE_DTYPE) con las muestras de las ultimas hours horas a resolucion completa
+        (como mucho las del buffer)
+        """
+        return self.samples.since(time.time() - hours * 3600)
+
+    def aggregates(self, window, hours):
+        """
+        :return: numpy.ndarray (AGGREGATE_DTYPE) con las ventanas cerradas del nivel window de las ultimas hours
+        horas
+        """
+        return self.level(window).buffer.since(time.time() - hours * 3600)
+
+    def flush(self):
+        self.samples.flush()
+        for level in self.levels:
+            level.buffer.flush()
+
+    def close(self):
+        """
+        Cierra las ventanas a medias (se guardan con las muestras que tienen) y vuelca los ficheros.
+        """
+        for level in self.levels:
+            level.closeWindow()
+        self.flush()
+
+
+def start_monitor(K2400_gpibAddress,
+                  HVSource_gpibAddress,
+                  voltage,
+                  rampVoltage,
+                  outputCurrentLimit,
+                  enableKill,
+                  ammeterRange,
+                  ammeterCompliance,
+                  ammeterNPLCs,
+                  monitorFilePath,
+                  samplePeriod=1.0,
+                  duration=None,
+                  fullResolutionHours=24.0,
+                  levels=DEFAULT_LEVELS,
+                  resourceManager=None,
+                  readingsPerPoint=1,
+                  gpibBoard=0,
+                  statusPeriod=60.0,
+                  maxConsecutiveErrors=10,
+                  breakdownCurrentFloor=None):
+    # voltage: tension que se mantiene (V). duration: Seconds (None --> hasta Ctrl+C o hasta que salte la deteccion
+    #   de ruptura / compliance). statusPeriod: cada cuanto se informa por consola. Seconds
+    # maxConsecutiveErrors: muestras seguidas con lectura fallida a partir de las que el monitor para (el error se
+    #   propaga)
+    # breakdownCurrentFloor: ver main.start_process
+    # Devuelve el motivo de parada de currentStatistics (None si ha terminado por duration o Ctrl+C)
+    term = ""
+    delay = 0.5
+    k2400Delay = delay if main.synchronizationMode == main.SYNC_DELAY else 0
+
+    k2400, hv_source = main.getInstruments(K2400_gpibAddress, HVSource_gpibAddress, resourceManager, gpibBoard)
+
+    # mismo orden que start_process: SIEMPRE AMMETER ON ANTES DE APLICAR VOLTAJE O INICIALIZAR LA FUENTE
+    main.sendCommandToInstrument(k2400, ":OUTP:STAT ON", term, 0, k2400Delay)
+    main.waitForOperationComplete(k2400)
+    getOutputInterlock(k2400).ammeterOutputTurnedOn()
+    main.initializeHVSource(hv_source, rampVoltage, outputCurrentLimit, enableKill)
+    main.initializeK2400(k2400, ammeterCompliance, ammeterNPLCs, ammeterRange, readingsPerPoint=readingsPerPoint)
+
+    monitor = ConstantVoltageMonitor(monitorFilePath, samplePeriod, fullResolutionHours, levels)
+    with open(monitorFilePath + ".json", "w") as f:
+        json.dump({"startTime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "instruments": {"k2400": main.instrumentIdentification.get(k2400.resource_name),
+                                   "hvSource": main.instrumentIdentification.get(hv_source.resource_name)},
+                   "voltage": voltage,
+                   "samplePeriod": samplePeriod,
+                   "fullResolutionHours": fullResolutionHours,
+                   "levels": levels}, f, indent=1)
+
+    # a tension constante no hay pasos: solo actuan la compliance y el salto de x100 entre dos muestras
+    breakdownDetector = BreakdownDetector(complianceCurrent=ammeterCompliance, currentFloor=breakdownCurrentFloor,
+                                          currentRange=ammeterRange)
+    settlingPredictor = RampSettlingPredictor(rampVoltage)
+    settlingPredictor.lastSetpoint = 0.0
+
+    try:
+        getOutputInterlock(hv_source).checkHVCanBeApplied("HV,ON")
+        hvSourceDriver(hv_source).write("HV,ON", delay)
+        main.setHVOutputVoltage(hv_source, voltage / 1000, main.voltageStabilizationTimeout, settlingPredictor)
+
+        startTime = time.time()
+        nextSample = startTime
+        nextStatus = startTime + statusPeriod
+        errors = 0
+        consecutiveErrors = 0
+        while duration is None or time.time() - startTime < duration:
+            timestamp = time.time()
+            try:
+                hvSourceVoltage = main.readVoltageFromHVSource(hv_source, maxAge=0)
+                current, currents = main.measureK2400Current(k2400, readingsPerPoint, k2400Delay)
+            except HVSourceResponseError as e:
+                # una lectura fallida no para un ensayo de dias: se salta la muestra
+                errors += 1
+                consecutiveErrors += 1
+                print(colored("Sample skipped (" + str(consecutiveErrors) + " in a row): " + str(e), "yellow"))
+                if consecutiveErrors >= maxConsecutiveErrors:
+                    raise
+                nextSample = max(nextSample + samplePeriod, time.time())
+                time.sleep(max(nextSample - time.time(), 0.0))
+                continue
+            consecutiveErrors = 0
+            monitor.add(timestamp, hvSourceVoltage, current)
+
+            if breakdownDetector.update(voltage, current) is not None:
+                print(colored("Monitor stopped (" + breakdownDetector.stopReason + "): " + str(current) + "A", "red"))
+                break
+
+            if timestamp >= nextStatus:
+                monitor.flush()
+                statistics = breakdownDetector.currents
+                print(colored("Monitor at " + str(hvSourceVoltage) + "V for %.2fh: " % ((timestamp - startTime) / 3600) +
+                              str(current) + "A (mean " + str(statistics.mean) + "A, max " + str(statistics.maximum) +
+                              "A, " + str(errors) + " samples skipped)", "cyan"))
+                nextStatus = timestamp + statusPeriod
+
+            # si una medida se retrasa no se intentan recuperar las muestras perdidas
+            nextSample = max(nextSample + samplePeriod, time.time())
+            time.sleep(max(nextSample - time.time(), 0.0))
+    except KeyboardInterrupt:
+        print(colored("Monitor interrupted", "yellow"))
+    finally:
+        monitor.close()
+        message = "Powering off instruments!!!"
+        main.printMessage(message, "*", "*")
+        main.shutdownHVSource(hv_source, settlingPredictor)
+        message = "Now HV Source is safe!!!!"
+        main.printMessage(message, "*", "*")
+
+    return breakdownDetector.stopReason
+
+
+def printRecords(records):
+    for name in records.dtype.names:
+        print("%14s" % name, end=" ")
+    print()
+    for record in records:
+        print(" ".join("%14s" % (time.strftime("%m-%d %H:%M:%S", time.localtime(value)) if name == "timestamp"
+                                 else "%.6g" % value)
+                       for name, value in zip(records.dtype.names, record.tolist())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Constant voltage monitor with bounded memory and decimated files")
+    parser.add_argument("monitor", help="prefix of the monitor files")
+    parser.add_argument("--voltage", type=float, help="voltage to hold (V)")
+    parser.add_argument("--config", default="process_config_file.json", help="instrument configuration")
+    parser.add_argument("--simulate", action="store_true", help="monitor a simulated bench")
+    parser.add_argument("--period", type=float, default=1.0, help="sample period (s)")
+    parser.add_argument("--duration-hours", type=float, default=None)
+    parser.add_argument("--full-resolution-hours", type=float, default=24.0)
+    parser.add_argument("--query", type=float, default=None, metavar="HOURS",
+                        help="print the last HOURS of an existing monitor instead of running it")
+    parser.add_argument("--window", type=float, default=None,
+                        help="with --query: decimation window (s) instead of the full resolution samples")
+    args = parser.parse_args()
+
+    if args.query is not None:
+        # los buffers se abren con la capacidad con la que se crearon
+        metadataFile = args.monitor + ".json"
+        with open(metadataFile) as f:
+            metadata = json.load(f)
+        monitor = ConstantVoltageMonitor(args.monitor, metadata["samplePeriod"], metadata["fullResolutionHours"],
+                                         [tuple(level) for level in metadata["levels"]], readOnly=True)
+        printRecords(monitor.recent(args.query) if args.window is None else monitor.aggregates(args.window, args.query))
+    else:
+        from sweepConfig import SweepConfig
+
+        if args.voltage is None:
+            parser.error("--voltage is required to run the monitor")
+        config = SweepConfig.fromConfigFile(args.config)
+        resourceManager = None
+        if args.simulate:
+            from instrumentSimulator import SimulatedBench
+            resourceManager = SimulatedBench(config.K2400_gpibAddress, config.HVSource_gpibAddress,
+                                             config.gpibBoard).resourceManager()
+        start_monitor(config.K2400_gpibAddress, config.HVSource_gpibAddress, args.voltage, config.rampVoltage,
+                      config.outputCurrentLimit, config.enableKill, config.ammeterRange, config.ammeterCompliance,
+                      config.ammeterNPLCs, args.monitor, samplePeriod=args.period,
+                      duration=None if args.duration_hours is None else args.duration_hours * 3600,
+                      fullResolutionHours=args.full_resolution_hours, resourceManager=resourceManager,
+                      readingsPerPoint=config.readingsPerPoint, gpibBoard=config.gpibBoard,
+                      breakdownCurrentFloor=config.breakdownCurrentFloor)
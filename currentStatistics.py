@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Estadistica en linea de las corrientes de un sweep y deteccion temprana de ruptura (breakdown) o de fuga que se
+dispara (leakage runaway).
+
+RunningStatistics: media, varianza, minimo y maximo acumulados (Welford, sin guardar las lecturas).
+RunningSlope: pendiente por minimos cuadrados de los ultimos puntos (ventana deslizante, O(1) por punto).
+CusumDetector: CUSUM de un solo lado sobre una magnitud estandarizada.
+
+BreakdownDetector junta las tres sobre log10|I| para decidir, punto a punto, si hay que parar el sweep:
+    - "overflow": el salto de corriente entre dos puntos supera overflowFactor veces la corriente anterior (la
+      comprobacion original de start_process, maxCurrentDelta_inTimesOfPreviousCurrent);
+    - "compliance": la corriente llega a complianceFraction de la compliance del K2400 (el K2400 recorta la lectura
+      y los saltos dejan de verse);
+    - "runaway": el crecimiento de la corriente por paso (decadas, normalizado al paso de referencia) se sale de lo
+      que ha sido hasta ahora en el sweep de forma sostenida: el CUSUM de su desviacion estandarizada respecto a la
+      media y desviacion tipica acumuladas pasa de cusumThreshold. Cada punto aporta como mucho maxPointScore, asi
+      un solo punto anomalo (una lectura con ruido) nunca para el sweep y una ruptura real lo para en dos puntos.
+
+Por debajo de currentFloor la corriente se toma como ruido: no cuenta para el salto de overflow ni para el
+crecimiento. Tiene que estar por encima del ruido de la medida, y por eso por defecto es la resolucion del rango del
+K2400 (RANGE_RESOLUTION del rango: 10 pA en el de 1 uA, 1 pA en el de 100 nA). Para seguir una fuga de 1e-11 a
+1e-9 A hay que medir en un rango bajo o dar currentFloor (breakdownCurrentFloor en la configuracion del sweep, p.ej.
+unas 5 veces el ruido medido a 0V).
+"""
+
+import math
+from collections import deque
+
+STOP_OVERFLOW = "overflow"
+STOP_COMPLIANCE = "compliance"
+STOP_RUNAWAY = "runaway"
+
+RANGE_RESOLUTION = 1e-5  # resolucion de la medida de corriente del K2400, en fraccion del rango
+DEFAULT_CURRENT_FLOOR = 1e-11  # in A, sin rango ni currentFloor (resolucion del rango de 1 uA)
+
+
+def rangeCurrentFloor(currentRange):
+    """
+    :param currentRange: rango de corriente del K2400 (None --> desconocido). Amps
+    :return: currentFloor por defecto para ese rango (su resolucion). Amps
+    """
+    if currentRange is None:
+        return DEFAULT_CURRENT_FLOOR
+    return abs(currentRange) * RANGE_RESOLUTION
+
+
+class RunningStatistics:
+    """
+    Media y varianza acumuladas con el algoritmo de Welford (estable numericamente).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def getState(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "minimum": self.minimum,
+                "maximum": self.maximum}
+
+    def setState(self, state):
+        self.count = state["count"]
+        self.mean = state["mean"]
+        self.m2 = state["m2"]
+        self.minimum = state["minimum"]
+        self.maximum = state["maximum"]
+
+
+class RunningSlope:
+    """
+    Pendiente dy/dx por minimos cuadrados de los ultimos window puntos.
+
+    Args:
+        window (int): Numero de puntos de la ventana
+    """
+
+    def __init__(self, window=5):
+        self.window = window
+        self.points = deque()
+        self.sums = [0.0, 0.0, 0.0, 0.0]  # x, y, x*x, x*y
+
+    def _accumulate(self, x, y, sign):
+        self.sums[0] += sign * x
+        self.sums[1] += sign * y
+        self.sums[2] += sign * x * x
+        self.sums[3] += sign * x * y
+
+    def add(self, x, y):
+        self.points.append((x, y))
+        self._accumulate(x, y, 1)
+        if len(self.points) > self.window:
+            self._accumulate(*self.points.popleft(), -1)
+
+    @property
+    def slope(self):
+        """
+        None si aun no hay dos puntos con x distinta.
+        """
+        n = len(self.points)
+        sumX, sumY, sumXX, sumXY = self.sums
+        denominator = n * sumXX - sumX * sumX
+        if n < 2 or abs(denominator) <= 1e-12 * max(sumXX, 1.0) * n:
+            return None
+        return (n * sumXY - sumX * sumY) / denominator
+
+    def getState(self):
+        return {"points": list(self.points)}
+
+    def setState(self, state):
+        self.points.clear()
+        self.sums = [0.0, 0.0, 0.0, 0.0]
+        for x, y in state["points"]:
+            self.add(x, y)
+
+
+class CusumDetector:
+    """
+    CUSUM de un solo lado (detecta aumentos): S = max(0, S + min(z, maxPointScore) - drift), alarma si S > threshold.
+
+    Args:
+        drift (float): Desviacion (en sigmas) que se tolera en cada punto sin acumular
+        threshold (float): Valor de S que dispara la alarma
+        maxPointScore (float): Aportacion maxima de un punto (en sigmas)
+    """
+
+    def __init__(self, drift=0.5, threshold=5.0, maxPointScore=4.0):
+        self.drift = drift
+        self.threshold = threshold
+        self.maxPointScore = maxPointScore
+        self.value = 0.0
+
+    def add(self, score):
+        """
+        :param score: desviacion estandarizada del punto (z)
+        :return: True si hay alarma
+        """
+        self.value = max(0.0, self.value + min(score, self.maxPointScore) - self.drift)
+        return self.value > self.threshold
+
+    def getState(self):
+        return {"value": self.value}
+
+    def setState(self, state):
+        self.value = state["value"]
+
+
+class BreakdownDetector:
+    """
+    Decide punto a punto si el sweep tiene que parar por ruptura, fuga que se dispara o compliance del K2400.
+
+    Args:
+        overflowFactor (float): maxCurrentDelta_inTimesOfPreviousCurrent del sweep
+        complianceCurrent (float): Compliance del K2400 (None --> sin comprobacion). Amps
+        complianceFraction (float): Fraccion de la compliance a partir de la cual se para
+        currentFloor (float): Corrientes por debajo de este valor se consideran ruido (no cuentan como crecimiento).
+            None --> rangeCurrentFloor(currentRange). Amps
+        currentRange (float): Rango de corriente del K2400 (solo para el currentFloor por defecto). Amps
+        warmupSteps (int): Pasos que se acumulan antes de activar el CUSUM
+        minGrowthSigma (float): Desviacion tipica minima del crecimiento por paso (ruido de la medida). Decadas
+        cusumDrift (float): Ver CusumDetector
+        cusumThreshold (float): Ver CusumDetector
+        maxPointScore (float): Ver CusumDetector
+        slopeWindow (int): Puntos de la pendiente de log10|I| que se informa
+    """
+
+    def __init__(self, overflowFactor=100, complianceCurrent=None, complianceFraction=0.95, currentFloor=None,
+                 currentRange=None, warmupSteps=5, minGrowthSigma=0.02, cusumDrift=0.5, cusumThreshold=5.0,
+                 maxPointScore=4.0, slopeWindow=5):
+        self.overflowFactor = overflowFactor
+        self.complianceCurrent = complianceCurrent
+        self.complianceFraction = complianceFraction
+        self.currentFloor = currentFloor if currentFloor is not None else rangeCurrentFloor(currentRange)
+        self.warmupSteps = warmupSteps
+        self.minGrowthSigma = minGrowthSigma
+
+        self.currents = RunningStatistics()
+        self.growth = RunningStatistics()
+        self.logSlope = RunningSlope(slopeWindow)
+        self.cusum = CusumDetector(cusumDrift, cusumThreshold, maxPointScore)
+        self.referenceStep = None
+        self.previousVoltage = None
+        self.previousCurrent = None
+        self.stopReason = None
+
+    def logCurrent(self, current):
+        return math.log10(max(abs(current), self.currentFloor))
+
+    def update(self, voltage, current):
+        """
+        Registra la corriente medida en el setpoint voltage.\n
+        :return: None si el sweep puede seguir, o el motivo para pararlo (STOP_OVERFLOW, STOP_COMPLIANCE,
+        STOP_RUNAWAY)
+        """
+        self.currents.add(current)
+        self.logSlope.add(voltage, self.logCurrent(current))
+
+        if self.complianceCurrent is not None and abs(current) >= self.complianceFraction * self.complianceCurrent:
+            self.stopReason = STOP_COMPLIANCE
+
+        if self.previousCurrent is not None:
+            delta = current - self.previousCurrent
+            # con la corriente anterior en el ruido cualquier lectura es un salto de x100: la salida del ruido la
+            # vigilan la compliance y el CUSUM
+            if abs(self.previousCurrent) >= self.currentFloor and delta > self.overflowFactor * abs(self.previousCurrent):
+                self.stopReason = self.stopReason or STOP_OVERFLOW
+
+            # por debajo de currentFloor solo hay ruido: el crecimiento se empieza a medir cuando hay señal
+            step = abs(voltage - self.previousVoltage)
+            if step > 0 and min(abs(current), abs(self.previousCurrent)) >= self.currentFloor:
+                if self.referenceStep is None:
+                    self.referenceStep = step
+                # crecimiento en decadas por paso de referencia (los pasos del modo adaptativo cambian)
+                growth = (self.logCurrent(current) - self.logCurrent(self.previousCurrent)) * self.referenceStep / step
+                if self.growth.count >= self.warmupSteps:
+                    score = (growth - self.growth.mean) / max(self.growth.std, self.minGrowthSigma)
+                    if self.cusum.add(score):
+                        self.stopReason = self.stopReason or STOP_RUNAWAY
+                # los puntos anomalos no entran en la referencia: una fuga que se dispara no se "aprende"
+                if self.cusum.value == 0.0 or self.growth.count < self.warmupSteps:
+                    self.growth.add(growth)
+
+        self.previousVoltage = voltage
+        self.previousCurrent = current
+        return self.stopReason
+
+    @property
+    def slope(self):
+        """
+        Pendiente de log10|I| en los ultimos puntos (None si aun no se conoce). Decadas / Volt
+        """
+        return self.logSlope.slope
+
+    def summary(self):
+        """
+        :return: dict con la estadistica actual (para los consumidores de los puntos)
+        """
+        return {"meanCurrent": self.currents.mean,
+                "currentStd": self.currents.std,
+                "logSlope": self.slope,
+                "cusum": self.cusum.value,
+                "stopReason": self.stopReason}
+
+    def getState(self):
+        return {"currents": self.currents.getState(),
+                "growth": self.growth.getState(),
+                "logSlope": self.logSlope.getState(),
+                "cusum": self.cusum.getState(),
+                "referenceStep": self.referenceStep,
+                "previousVoltage": self.previousVoltage,
+                "previousCurrent": self.previousCurrent,
+                "stopReason": self.stopReason}
+
+    def setState(self, state):
+        self.currents.setState(state["currents"])
+        self.growth.setState(state["growth"])
+        self.logSlope.setState(state["logSlope"])
+        self.cusum.setState(state["cusum"])
+        self.referenceStep = state["referenceStep"]
+        self.previousVoltage = state["previousVoltage"]
+        self.previousCurrent = state["previousCurrent"]
+        self.stopReason = state["stopReason"]
@@ -1,25 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+# Lectura del fichero de configuracion del sweep con la interfaz de siempre. Los valores pasan por
+# sweepConfig.SweepConfig: vienen ya convertidos y validados (ConfigError si el fichero no es valido).
+
 import json
 
+from sweepConfig import SweepConfig
+
+
 def readConfigFile(configFilePath):
-    # Opening JSON file
-    f = open(configFilePath)
-
-    jsonContent = json.load(f)
-
-    return (jsonContent["K2400_gpibAddress"],
-            jsonContent["HVSource_gpibAddress"],
-            jsonContent["initialVoltage"],
-            jsonContent["finalVoltage"],
-            jsonContent["pointsVoltage"],
-            jsonContent["measureDelay_ms"],
-            jsonContent["rampVoltage"],
-            jsonContent["outputCurrentLimit"],
-            jsonContent["enableKill"],
-            jsonContent["ammeterRange"],
-            jsonContent["ammeterCompliance"],
-            jsonContent["ammeterNPLCs"],
-            jsonContent["resultsFileName"],
-            jsonContent["resultsFileExtension"])
\ No newline at end of file
+    config = SweepConfig.fromConfigFile(configFilePath)
+
+    return (config.K2400_gpibAddress,
+            config.HVSource_gpibAddress,
+            config.initialVoltage,
+            config.finalVoltage,
+            config.pointsVoltage,
+            config.measureDelay_ms,
+            config.rampVoltage,
+            config.outputCurrentLimit,
+            config.enableKill,
+            config.ammeterRange,
+            config.ammeterCompliance,
+            config.ammeterNPLCs,
+            config.resultsFileName,
+            config.resultsFileExtension)
+
+
+def readOptionalConfigValue(configFilePath, key, defaultValue):
+    # defaultValue si la clave no esta en el fichero, si no su valor validado
+    with open(configFilePath) as f:
+        if key not in json.load(f):
+            return defaultValue
+
+    return getattr(SweepConfig.fromConfigFile(configFilePath), key)
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Traza de la E/S GPIB de un sweep: en que se va el tiempo.
+
+main.getInstruments envuelve cada instrumento en un TracedInstrument, que mide cada write_raw, read_raw y read_stb
+(instrumento, comando, bytes, latencia). main usa el sleep de este modulo, que cuenta las esperas deliberadas, y
+marca los reintentos con recordRetry. Cada evento se asocia a la fase del sweep en la que ocurre (init, settle,
+acquire, log, shutdown), que se marca con tracePhase / tracedPhase.
+
+Solo se registra mientras hay un Tracer activo (startTracing) en el contexto que hace la E/S. El Tracer activo se
+guarda en una ContextVar: cada estacion de multiStationRunner tiene el suyo y los hilos de InstrumentWorker usan el
+del sweep que les envia el trabajo. Registrar un evento es una tupla añadida a un buffer circular (~1 us), muy por
+debajo de una transaccion GPIB (ms), asi que se puede dejar activado en produccion.
+
+La memoria esta acotada: el Tracer guarda los ultimos maxEvents eventos (~200 bytes cada uno, 40 MB con el valor
+por defecto, unos miles de puntos de sweep) y cuenta los que descarta. En una ejecucion mas larga la traza y el
+informe son solo de su ultima parte (el informe lo indica).
+
+Exportacion:
+    saveTrace --> fichero compacto .npz (tiempos en arrays, textos en tablas)
+    saveChromeTrace --> JSON "Trace Event Format" (chrome://tracing, Perfetto, speedscope)
+
+Uso:
+    python gpibTrace.py sweep.trace.npz [--chrome sweep.trace.json]
+"""
+
+import argparse
+import contextvars
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+EVENT_WRITE = "write"
+EVENT_READ = "read"
+EVENT_STB = "stb"
+EVENT_SLEEP = "sleep"
+EVENT_RETRY = "retry"
+EVENT_PHASE = "phase"
+EVENT_KINDS = (EVENT_WRITE, EVENT_READ, EVENT_STB, EVENT_SLEEP, EVENT_RETRY, EVENT_PHASE)
+
+PHASE_INIT = "init"
+PHASE_SETTLE = "settle"
+PHASE_ACQUIRE = "acquire"
+PHASE_LOG = "log"
+PHASE_SHUTDOWN = "shutdown"
+PHASE_OTHER = "other"  # en el informe: E/S fuera de cualquier fase marcada
+
+# bytes de cada mensaje que se guardan en la traza (las rafagas SREAL pueden ser de varios kB)
+MAX_PAYLOAD = 64
+
+# eventos que guarda un Tracer (los mas antiguos se descartan)
+DEFAULT_MAX_EVENTS = 200000
+
+PERCENTILES = (50, 90, 99)
+
+activeTracer = contextvars.ContextVar("activeTracer", default=None)
+currentPhase = contextvars.ContextVar("currentPhase", default=None)
+
+
+class Tracer:
+    """
+    Ultimos maxEvents eventos de una ejecucion. Cada evento es una tupla
+    (inicio, duracion, tipo, instrumento, payload, bytes, fase, hilo); tiempos en segundos de time.perf_counter.
+
+    Args:
+        maxEvents (int): Tamaño del buffer circular de eventos
+    """
+
+    def __init__(self, maxEvents=DEFAULT_MAX_EVENTS):
+        self.events = deque(maxlen=maxEvents)
+        self.recorded = 0
+        self.lock = threading.Lock()  # registran los hilos de la estacion y los de InstrumentWorker
+        self.startTime = time.perf_counter()
+        self.startWallTime = time.time()
+
+    def record(self, start, duration, kind, resource, payload, nbytes):
+        event = (start, duration, kind, resource, payload, nbytes, currentPhase.get(), threading.current_thread().name)
+        with self.lock:
+            self.events.append(event)
+            self.recorded += 1
+
+    @property
+    def dropped(self):
+        """
+        Eventos descartados por el buffer circular (los mas antiguos).
+        """
+        with self.lock:
+            return self.recorded - len(self.events)
+
+
+def startTracing(tracer=None):
+    """
+    Activa la traza en el contexto actual (y en los hilos que lo copien).\n
+    :return: (Tracer, token para stopTracing)
+    """
+    tracer = Tracer() if tracer is None else tracer
+    return tracer, activeTracer.set(tracer)
+
+
+def stopTracing(token):
+    activeTracer.reset(token)
+
+
+def sleep(seconds):
+    """
+    time.sleep que ademas registra la espera deliberada en la traza activa.
+    """
+    tracer = activeTracer.get()
+    if tracer is None or seconds <= 0:
+        time.sleep(seconds)
+        return
+    start = time.perf_counter()
+    time.sleep(seconds)
+    tracer.record(start, time.perf_counter() - start, EVENT_SLEEP, None, None, 0)
+
+
+def recordRetry(instrument, command):
+    tracer = activeTracer.get()
+    if tracer is not None:
+        tracer.record(time.perf_counter(), 0.0, EVENT_RETRY, str(instrument.resource_name), command, 0)
+
+
+class tracePhase:
+    """
+    Context manager que marca la fase del sweep de la E/S que se hace dentro. Si ya hay una fase marcada se
+    mantiene la de fuera (p.ej. el setHVOutputVoltage a 0V de initializeHVSource cuenta como init).
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.token = None
+        self.start = None
+
+    def __enter__(self):
+        if currentPhase.get() is None:
+            self.token = currentPhase.set(self.phase)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.token is not None:
+            tracer = activeTracer.get()
+            if tracer is not None:
+                tracer.record(self.start, time.perf_counter() - self.start, EVENT_PHASE, None, self.phase, 0)
+            currentPhase.reset(self.token)
+            self.token = None
+        return False
+
+
+def tracedPhase(phase):
+    """
+    Decorador: la funcion se ejecuta dentro de tracePhase(phase).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracePhase(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedInstrument:
+    """
+    Envuelve un pyvisa.resource.resource: write_raw, read_raw y read_stb se miden y registran en la traza activa;
+    el resto de atributos (resource_name, timeout...) van directamente al instrumento.
+    """
+
+    def __init__(self, instrument):
+        object.__setattr__(self, "instrument", instrument)
+
+    def __getattr__(self, name):
+        return getattr(self.instrument, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.instrument, name, value)
+
+    def write_raw(self, message):
+        tracer = activeTracer.get()
+        if tracer is None:
+            return self.instrument.write_raw(message)
+        start = time.perf_counter()
+        result = self.instrument.write_raw(message)
+        tracer.record(start, time.perf_counter() - start, EVENT_WRITE, str(self.instrument.resource_name),
+                      message[:MAX_PAYLOAD], len(message))
+        return result
+
+    def read_raw(self, *args, **kwargs):
+        tracer = activeTracer.get()
+        if tracer is None:
+            return self.instrument.read_raw(*args, **kwargs)
+        start = time.perf_counter()
+        response = self.instrument.read_raw(*args, **kwargs)
+        tracer.record(start, time.perf_counter() - start, EVENT_READ, str(self.instrument.resource_name),
+                      response[:MAX_PAYLOAD], len(response))
+        return response
+
+    def read_stb(self):
+        tracer = activeTracer.get()
+        if tracer is None:
+            return self.instrument.read_stb()
+        start = time.perf_counter()
+        status = self.instrument.read_stb()
+        tracer.record(start, time.perf_counter() - start, EVENT_STB, str(self.instrument.resource_name), None, 1)
+        return status
+
+
+def traceInstrument(instrument):
+    if isinstance(instrument, TracedInstrument):
+        return instrument
+    return TracedInstrument(instrument)
+
+
+def _payloadText(payload):
+    if payload is None:
+        return ""
+    if isinstance(payload, bytes):
+        return payload.decode("ascii", errors="backslashreplace")
+    return str(payload)
+
+
+def traceArrays(tracer):
+    """
+    Traza en forma de arrays: tiempos y bytes en arrays numpy, textos como indices a tablas de strings.
+    Es el contenido del fichero compacto (saveTrace) y la entrada del informe (traceReport).
+    """
+    tables = {"kind": list(EVENT_KINDS), "resource": [], "payload": [], "phase": [], "thread": []}
+    lookups = {name: {value: i for i, value in enumerate(table)} for name, table in tables.items()}
+
+    def index(name, value):
+        if value is None:
+            return -1
+        lookup = lookups[name]
+        if value not in lookup:
+            lookup[value] = len(tables[name])
+            tables[name].append(value)
+        return lookup[value]
+
+    with tracer.lock:
+        events = list(tracer.events)
+        dropped = tracer.recorded - len(events)
+    arrays = {"start": np.array([event[0] - tracer.startTime for event in events], dtype=np.float64),
+              "duration": np.array([event[1] for event in events], dtype=np.float64),
+              "kind": np.array([index("kind", event[2]) for event in events], dtype=np.int8),
+              "resource": np.array([index("resource", event[3]) for event in events], dtype=np.int16),
+              "payload": np.array([index("payload", _payloadText(event[4]) if event[4] is not None else None)
+                                   for event in events], dtype=np.int32),
+              "nbytes": np.array([event[5] for event in events], dtype=np.int64),
+              "phase": np.array([index("phase", event[6]) for event in events], dtype=np.int8),
+              "thread": np.array([index("thread", event[7]) for event in events], dtype=np.int16)}
+    arrays["tables"] = tables
+    arrays["startWallTime"] = tracer.startWallTime
+    arrays["dropped"] = dropped
+    return arrays
+
+
+def saveTrace(arrays, traceFilePath):
+    arrays = dict(arrays)
+    tables = arrays.pop("tables")
+    startWallTime = arrays.pop("startWallTime")
+    dropped = arrays.pop("dropped", 0)
+    with open(traceFilePath, "wb") as f:
+        np.savez_compressed(f, tables=np.array(json.dumps(tables)), startWallTime=np.array(startWallTime),
+                            dropped=np.array(dropped), **arrays)
+    return traceFilePath
+
+
+def loadTrace(traceFilePath):
+    with np.load(traceFilePath) as f:
+        arrays = {key: f[key] for key in f.files}
+    arrays["tables"] = json.loads(str(arrays["tables"]))
+    arrays["startWallTime"] = float(arrays["startWallTime"])
+    arrays["dropped"] = int(arrays["dropped"]) if "dropped" in arrays else 0  # trazas sin buffer circular
+    return arrays
+
+
+def saveChromeTrace(arrays, traceFilePath):
+    """
+    Trace Event Format: un proceso por instrumento (mas uno para las fases y esperas de cada hilo), eventos
+    completos ("X") con la duracion y los reintentos como eventos instantaneos ("i"). El tid de cada evento es el
+    indice del hilo en la tabla de hilos; su nombre va en un evento de metadatos "thread_name" por proceso.
+    """
+    tables = arrays["tables"]
+    processes = ["phases"] + tables["resource"]
+    traceEvents = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}
+                   for pid, name in enumerate(processes)]
+    threads = set()  # (pid, tid) con eventos
+
+    for i in range(len(arrays["start"])):
+        kind = tables["kind"][arrays["kind"][i]]
+        resource = arrays["resource"][i]
+        payload = tables["payload"][arrays["payload"][i]] if arrays["payload"][i] >= 0 else ""
+        phase = tables["phase"][arrays["phase"][i]] if arrays["phase"][i] >= 0 else None
+        event = {"name": payload if kind in (EVENT_WRITE, EVENT_PHASE, EVENT_RETRY) and payload else kind,
+                 "cat": kind,
+                 "ph": "i" if kind == EVENT_RETRY else "X",
+                 "ts": arrays["start"][i] * 1e6,
+                 "pid": 0 if resource < 0 else int(resource) + 1,
+                 "tid": int(arrays["thread"][i]),
+                 "args": {"phase": phase, "bytes": int(arrays["nbytes"][i])}}
+        if kind == EVENT_RETRY:
+            event["s"] = "t"
+        else:
+            event["dur"] = arrays["duration"][i] * 1e6
+        if kind == EVENT_READ:
+            event["args"]["response"] = payload
+        traceEvents.append(event)
+        threads.add((event["pid"], event["tid"]))
+
+    traceEvents[len(processes):len(processes)] = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                                   "args": {"name": tables["thread"][tid]}}
+                                                  for pid, tid in sorted(threads)]
+
+    with open(traceFilePath, "w") as f:
+        json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms",
+                   "otherData": {"startWallTime": arrays["startWallTime"],
+                                 "droppedEvents": arrays.get("dropped", 0)}}, f)
+    return traceFilePath
+
+
+class traceRun:
+    """
+    Context manager para trazar una ejecucion completa: al salir (tambien si hay una excepcion) guarda la traza en
+    <traceFilePathPrefix>.npz y <traceFilePathPrefix>.json (Chrome trace) y muestra el informe.
+    """
+
+    def __init__(self, traceFilePathPrefix):
+        self.traceFilePathPrefix = traceFilePathPrefix
+        self.tracer = None
+        self.token = None
+
+    def __enter__(self):
+        self.tracer, self.token = startTracing()
+        return self.tracer
+
+    def __exit__(self, excType, excValue, traceback):
+        stopTracing(self.token)
+        arrays = traceArrays(self.tracer)
+        saveTrace(arrays, self.traceFilePathPrefix + ".npz")
+        saveChromeTrace(arrays, self.traceFilePathPrefix + ".json")
+        print(traceReport(arrays))
+        return False
+
+
+def histogram(durations, edges=(1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)):
+    """
+    Histograma logaritmico en texto: "<0.1ms:3 <1ms:20 ..."
+    """
+    counts = np.histogram(durations, bins=(0.0,) + tuple(edges) + (np.inf,))[0]
+    labels = ["<%gms" % (edge * 1000) for edge in edges] + [">=%gms" % (edges[-1] * 1000)]
+    return " ".join("%s:%d" % (label, count) for label, count in zip(labels, counts) if count)
+
+
+def traceReport(arrays):
+    """
+    Informe por fase: tiempo de la fase, tiempo en escritura / lectura / serial poll / esperas deliberadas,
+    reintentos y percentiles de latencia por tipo de operacion y por comando.\n
+    :return: str
+    """
+    tables = arrays["tables"]
+    kinds = np.array(tables["kind"])[arrays["kind"]] if len(arrays["kind"]) else np.array([], dtype=str)
+    phases = np.array(tables["phase"] + [PHASE_OTHER])[arrays["phase"]] if len(arrays["phase"]) else \
+        np.array([], dtype=str)
+    duration = arrays["duration"]
+    total = float((arrays["start"] + duration).max()) if len(duration) else 0.0
+
+    lines = ["Trace: %d events, %.3f s" % (len(duration), total) +
+             (" (the %d oldest events were dropped: only the end of the run is traced)" % arrays["dropped"]
+              if arrays.get("dropped", 0) else ""),
+             "%-9s %9s %9s %9s %9s %9s %7s %7s" % ("phase", "wall_s", "write_s", "read_s", "stb_s", "sleep_s",
+                                                 "io", "retries")]
+    for phase in tables["phase"] + [PHASE_OTHER]:
+        inPhase = phases == phase
+        if not inPhase.any():
+            continue
+        wall = duration[inPhase & (kinds == EVENT_PHASE)].sum()
+        byKind = {kind: duration[inPhase & (kinds == kind)].sum() for kind in EVENT_KINDS}
+        io = np.count_nonzero(inPhase & np.isin(kinds, (EVENT_WRITE, EVENT_READ, EVENT_STB)))
+        lines.append("%-9s %9.3f %9.3f %9.3f %9.3f %9.3f %7d %7d" % (
+            phase, wall, byKind[EVENT_WRITE], byKind[EVENT_READ], byKind[EVENT_STB], byKind[EVENT_SLEEP], io,
+            np.count_nonzero(inPhase & (kinds == EVENT_RETRY))))
+
+    lines.append("")
+    lines.append("%-9s %-8s %7s %9s %9s %9s %9s  %s" % ("phase", "op", "count", "p50_ms", "p90_ms", "p99_ms",
+                                                        "max_ms", "histogram"))
+    for phase in tables["phase"] + [PHASE_OTHER]:
+        for kind in (EVENT_WRITE, EVENT_READ, EVENT_STB, EVENT_SLEEP):
+            selected = duration[(phases == phase) & (kinds == kind)]
+            if len(selected) == 0:
+                continue
+            p = np.percentile(selected, PERCENTILES) * 1000
+            lines.append("%-9s %-8s %7d %9.3f %9.3f %9.3f %9.3f  %s" % (
+                phase, kind, len(selected), p[0], p[1], p[2], selected.max() * 1000, histogram(selected)))
+
+    # comandos: se agrupan por cabecera (lo que va antes del primer espacio o coma)
+    lines.append("")
+    lines.append("%-20s %7s %9s %9s %9s  %s" % ("command", "count", "p50_ms", "p99_ms", "total_s", "resources"))
+    writes = np.flatnonzero(kinds == EVENT_WRITE)
+    commands = {}
+    for i in writes:
+        text = tables["payload"][arrays["payload"][i]] if arrays["payload"][i] >= 0 else ""
+        header = text.replace(",", " ").split(" ")[0].strip() or "?"
+        commands.setdefault(header, []).append(i)
+    for header, indexes in sorted(commands.items(), key=lambda item: -duration[item[1]].sum()):
+        selected = duration[indexes]
+        p = np.percentile(selected, (50, 99)) * 1000
+        resources = sorted({tables["resource"][arrays["resource"][i]] for i in indexes})
+        lines.append("%-20s %7d %9.3f %9.3f %9.3f  %s" % (header[:20], len(selected), p[0], p[1], selected.sum(),
+                                                          ",".join(resources)))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report of a GPIB trace (.trace.npz)")
+    parser.add_argument("trace", help="compact trace file written by start_process(trace=True) (<results>.trace.npz)")
+    parser.add_argument("--chrome", help="also export it in Chrome trace format to this file")
+    args = parser.parse_args()
+
+    traceArrays_ = loadTrace(args.trace)
+    print(traceReport(traceArrays_))
+    if args.chrome:
+        print(saveChromeTrace(traceArrays_, args.chrome))
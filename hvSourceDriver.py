@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Driver de la fuente HV EURO TEST HPP-120 con cache del estado de la fuente.
+
+HPP120 envuelve el pyvisa.resource de la fuente (o el proxy de traza / el RemoteInstrument del daemon) y:
+    - guarda el estado conocido de la fuente (setpoint, rampa, limite de corriente, kill, HV on/off) solo a partir
+      de los comandos que se le envian, y no reenvia los ajustes que ya tiene (RAMP, I, KILL, HV). Los setpoints (U)
+      se envian siempre. Las lecturas de estado (STATUS,DI) nunca cambian este estado;
+    - guarda la ultima lectura de tension (STATUS,MU) y de estado (STATUS,DI) con su instante: una lectura mas
+      reciente que readbackTTL se devuelve sin preguntar a la fuente (p.ej. la lectura del punto justo despues de la
+      que ha confirmado la estabilizacion). Cualquier comando que cambie la salida invalida las lecturas;
+    - interpreta las respuestas con expresiones regulares precompiladas y con unidades ("2.458kV", "3000V",
+      "150mV"), reensambla las respuestas que llegan en varias lecturas (hasta el terminador \\x00) y reintenta un
+      numero acotado de veces, con esperas crecientes, las respuestas mal formadas o los timeouts de lectura;
+    - decodifica el registro de estado (HV_ON, RAMPING, CURRENT_LIMIT, KILL_ENABLED, INTERLOCK_OPEN).
+
+El formato de la respuesta a STATUS,DI ("DI, STATUS=0x0009") y sus bits son los de instrumentSimulator.py: no estan
+comprobados con el manual de la HPP-120. readStatus / decodeStatus solo sirven con el banco simulado y su resultado
+es informativo.
+"""
+
+import re
+import time
+
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+
+from gpibTrace import sleep, recordRetry
+
+# bits de la respuesta a STATUS,DI (solo banco simulado, ver cabecera del modulo)
+HV_ON = 0x01
+RAMPING = 0x02
+CURRENT_LIMIT = 0x04
+KILL_ENABLED = 0x08
+INTERLOCK_OPEN = 0x10
+STATUS_FLAGS = ((HV_ON, "HV_ON"), (RAMPING, "RAMPING"), (CURRENT_LIMIT, "CURRENT_LIMIT"),
+                (KILL_ENABLED, "KILL_ENABLED"), (INTERLOCK_OPEN, "INTERLOCK_OPEN"))
+
+FRAME_TERMINATOR = b"\x00"
+
+UNIT_SCALES = {"": 1.0, "m": 1e-3, "k": 1e3, "M": 1e6}
+
+# "UM, RANGE=3000V, VALUE=2.458kV"
+MEASUREMENT_PATTERN = re.compile(r"^\s*UM\s*,\s*RANGE\s*=\s*(?P<range>[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*"
+                                 r"(?P<rangePrefix>[mkM]?)V\s*,\s*VALUE\s*=\s*"
+                                 r"(?P<value>[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*(?P<valuePrefix>[mkM]?)V\s*$")
+# "DI, STATUS=0x0009" (solo banco simulado)
+STATUS_PATTERN = re.compile(r"^\s*DI\s*,\s*STATUS\s*=\s*(?P<status>0[xX][0-9a-fA-F]+|\d+)\s*$")
+
+# comandos de configuracion que se pueden saltar si la fuente ya tiene el valor: patron --> clave del estado
+SETTING_PATTERNS = ((re.compile(r"^RAMP,(?P<value>.+)V/s$", re.IGNORECASE), "ramp"),
+                    (re.compile(r"^I,(?P<value>.+)mA$", re.IGNORECASE), "currentLimit"),
+                    (re.compile(r"^KILL,(?P<value>EN|DIS)$", re.IGNORECASE), "kill"),
+                    (re.compile(r"^HV,(?P<value>ON|OFF)$", re.IGNORECASE), "hv"))
+SETPOINT_PATTERN = re.compile(r"^U,(?P<value>[-+]?\d*\.?\d+)kV$", re.IGNORECASE)
+
+
+class HVSourceResponseError(RuntimeError):
+    """
+    La fuente no ha dado una respuesta valida despues de todos los reintentos.
+    """
+    pass
+
+
+def parseMeasurement(frame):
+    """
+    :param frame: str con la respuesta a STATUS,MU sin el terminador, p.ej. "UM, RANGE=3000V, VALUE=2.458kV"
+    :return: (float con la tension, float con el rango). Volts
+    """
+    match = MEASUREMENT_PATTERN.match(frame)
+    if match is None:
+        raise ValueError("Malformed STATUS,MU response: " + repr(frame))
+    return (float(match.group("value")) * UNIT_SCALES[match.group("valuePrefix")],
+            float(match.group("range")) * UNIT_SCALES[match.group("rangePrefix")])
+
+
+def parseStatus(frame):
+    """
+    :param frame: str con la respuesta a STATUS,DI sin el terminador, p.ej. "DI, STATUS=0x0009"
+    :return: int con el registro de estado
+    """
+    match = STATUS_PATTERN.match(frame)
+    if match is None:
+        raise ValueError("Malformed STATUS,DI response: " + repr(frame))
+    return int(match.group("status"), 0)
+
+
+def decodeStatus(status):
+    """
+    :return: list con los nombres de los bits activos de status (STATUS_FLAGS)
+    """
+    return [name for flag, name in STATUS_FLAGS if status & flag]
+
+
+class HPP120:
+    """
+    Driver de la fuente HPP-120 con cache de su estado.
+
+    Args:
+        instrument (pyvisa.resource.resource): Fuente HV
+        readbackTTL (float): Edad maxima de una lectura para reutilizarla sin preguntar a la fuente. Seconds
+        queryDelay (float): Espera por defecto entre la query y la lectura de la respuesta. Seconds
+        retries (int): Reintentos de una query con respuesta mal formada o timeout
+        retryDelay (float): Espera antes del primer reintento (se dobla en cada reintento, maximo maxRetryDelay).
+            Seconds
+        maxRetryDelay (float): Seconds
+        maxFrameReads (int): Lecturas maximas para completar una respuesta (hasta el terminador)
+    """
+
+    def __init__(self, instrument, readbackTTL=1.0, queryDelay=0.5, retries=5, retryDelay=0.25, maxRetryDelay=2.0,
+                 maxFrameReads=4):
+        self.instrument = instrument
+        self.readbackTTL = readbackTTL
+        self.queryDelay = queryDelay
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.maxFrameReads = maxFrameReads
+        self.pending = b""
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Olvida todo el estado conocido de la fuente (p.ej. despues de un error de comunicacion).
+        """
+        self.state = {"setpoint": None, "ramp": None, "currentLimit": None, "kill": None, "hv": None}
+        self.invalidateReadings()
+
+    def invalidateReadings(self):
+        self.voltage = None
+        self.voltageRange = None
+        self.voltageTime = None
+        self.status = None
+        self.statusTime = None
+
+    # ---- comandos ----
+
+    def write(self, command, delayAfter=0.0, force=False):
+        """
+        Envia un comando a la fuente y actualiza el estado conocido.\n
+        :param force: True --> se envia aunque la fuente ya tenga ese ajuste
+        :return: True si se ha enviado, False si se ha saltado por redundante
+        """
+        command = command.strip()
+        if command.upper() in ("*RST", "*CLS"):
+            self.send(command, delayAfter)
+            if command.upper() == "*RST":
+                self.invalidate()
+            return True
+
+        setpoint = SETPOINT_PATTERN.match(command)
+        if setpoint is not None:
+            self.send(command, delayAfter)
+            self.state["setpoint"] = float(setpoint.group("value")) * 1000
+            self.invalidateReadings()
+            return True
+
+        for pattern, key in SETTING_PATTERNS:
+            setting = pattern.match(command)
+            if setting is not None:
+                value = setting.group("value").upper()
+                if not force and self.state[key] == value:
+                    return False
+                self.send(command, delayAfter)
+                self.state[key] = value
+                if key in ("ramp", "hv"):
+                    self.invalidateReadings()
+                return True
+
+        self.send(command, delayAfter)
+        return True
+
+    def send(self, command, delayAfter=0.0):
+        self.instrument.write_raw(command)
+        sleep(delayAfter)
+
+    # ---- queries ----
+
+    def readFrame(self):
+        """
+        Lee una respuesta completa (hasta el terminador \\x00) aunque llegue en varias lecturas.\n
+        :return: str con la respuesta sin el terminador
+        """
+        buffer = self.pending
+        for read in range(self.maxFrameReads):
+            if FRAME_TERMINATOR in buffer:
+                break
+            buffer += self.instrument.read_raw()
+        frame, terminator, self.pending = buffer.partition(FRAME_TERMINATOR)
+        if not terminator:
+            self.pending = b""
+            raise ValueError("Incomplete response after " + str(self.maxFrameReads) + " reads: " + repr(frame))
+        return frame.decode(encoding="ascii", errors="ignore").strip("\r\n ")
+
+    def query(self, command, parser, queryDelay=None):
+        """
+        Envia la query y devuelve la respuesta interpretada por parser, con reintentos acotados.\n
+        :param queryDelay: Espera entre la query y la lectura de la respuesta (None --> self.queryDelay). Seconds
+        """
+        queryDelay = self.queryDelay if queryDelay is None else queryDelay
+        retryDelay = self.retryDelay
+        for attempt in range(self.retries + 1):
+            try:
+                self.pending = b""
+                self.send(command, queryDelay)
+                return parser(self.readFrame())
+            except (ValueError, VisaIOError) as e:
+                if isinstance(e, VisaIOError) and e.error_code != constants.StatusCode.error_timeout:
+                    raise
+                if attempt == self.retries:
+                    raise HVSourceResponseError("No valid response to " + command + " after " +
+                                                str(self.retries + 1) + " attempts: " + str(e))
+                recordRetry(self.instrument, command)
+                sleep(retryDelay)
+                retryDelay = min(retryDelay * 2, self.maxRetryDelay)
+
+    def readVoltage(self, maxAge=None, queryDelay=None):
+        """
+        :param maxAge: Edad maxima de la lectura en cache (None --> readbackTTL, 0 --> siempre se lee). Seconds
+        :param queryDelay: Ver query
+        :return: float con la tension a la salida de la fuente. Volts
+        """
+        maxAge = self.readbackTTL if maxAge is None else maxAge
+        if self.voltageTime is None or time.time() - self.voltageTime > maxAge:
+            self.voltage, self.voltageRange = self.query("STATUS,MU", parseMeasurement, queryDelay)
+            self.voltageTime = time.time()
+        return self.voltage
+
+    def readStatus(self, maxAge=None, queryDelay=None):
+        """
+        Registro de estado (solo banco simulado). No actualiza el estado conocido: los ajustes que se saltan por
+        redundantes dependen solo de los comandos enviados.\n
+        :return: int con el registro de estado (ver decodeStatus)
+        """
+        maxAge = self.readbackTTL if maxAge is None else maxAge
+        if self.statusTime is None or time.time() - self.statusTime > maxAge:
+            self.status = self.query("STATUS,DI", parseStatus, queryDelay)
+            self.statusTime = time.time()
+        return self.status
+
+    def readbackAge(self):
+        """
+        :return: edad de la ultima lectura de tension (None si no hay). Seconds
+        """
+        return None if self.voltageTime is None else time.time() - self.voltageTime
+
+
+# driver de cada fuente abierta (clave: resource_name)
+hvSourceDrivers = {}
+
+
+def hvSourceDriver(hv_source):
+    """
+    :return: HPP120 de la fuente. Con otro objeto de recurso el estado conocido ya no es fiable y se olvida. Como
+    getInstruments envuelve cada open_resource en un TracedInstrument nuevo, el estado solo se conserva dentro de un
+    sweep: cada sweep (tambien con el daemon de sesiones o encadenado) vuelve a enviar sus ajustes
+    """
+    driver = hvSourceDrivers.get(hv_source.resource_name)
+    if driver is None:
+        driver = hvSourceDrivers[hv_source.resource_name] = HPP120(hv_source)
+    elif driver.instrument is not hv_source:
+        driver.instrument = hv_source
+        driver.pending = b""
+        driver.invalidate()
+    return driver
@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Servicio local que mantiene abiertas las sesiones GPIB y las comparte entre sweeps y scripts.
+
+El daemon crea un unico ResourceManager, hace el list_resources() (el escaneo del bus) una sola vez y deja abiertas
+las sesiones de los instrumentos que se van pidiendo. Los clientes (RemoteResourceManager, se usa como
+resourceManager= de start_process) hablan con el por multiprocessing.connection (socket en loopback con authkey):
+    - La authkey es aleatoria y propia de cada instalacion: se crea una vez con --create-authkey en
+      ~/.gpib_daemon_authkey (permisos 0600) o se da en la variable de entorno GPIB_DAEMON_AUTHKEY. Sin authkey, o con
+      un fichero de authkey que pueden leer otros usuarios, ni el daemon ni los clientes arrancan. El daemon solo
+      escucha en direcciones de loopback: las peticiones se deserializan (pickle) y controlan la fuente HV.
+    - Solo se atienden las operaciones de la interfaz de pyvisa que usa main.py (OPERATIONS): write_raw, read_raw,
+      read_stb y los atributos timeout (se aplica a la sesion), identification y healthQuery (solo se guardan en el
+      daemon).
+    - Cada instrumento se presta en exclusiva a un cliente (lease) desde open_resource hasta close() o hasta que el
+      cliente se desconecta; otro cliente que lo pida espera. Asi una secuencia escritura/lectura de un sweep nunca
+      se mezcla con la de otro cliente.
+    - Cada operacion sobre un instrumento se serializa con su lock (tambien respecto a las comprobaciones de salud).
+    - Un hilo comprueba periodicamente las sesiones que no estan prestadas con la query de healthQuery (la de
+      identificacion que pone getInstruments: "*IDN?" en el K2400, "ID" en la HPP-120, que no implementa el serial
+      poll de IEEE 488.2) y las reabre si fallan. Las sesiones sin healthQuery no se comprueban. Una sesion que falla
+      con un error VISA que no es un timeout se cierra y se reabre en la siguiente operacion.
+    - Los atributos que pone un cliente (timeout, identification...) se guardan en la sesion y se vuelven a aplicar
+      al reabrirla. getInstruments guarda la identificacion (*IDN? / ID) en identification: con el daemon solo se
+      pregunta la primera vez.
+
+Uso:
+    python instrumentDaemon.py --create-authkey       (una vez)
+    python instrumentDaemon.py [--address 127.0.0.1:18500] [--authkey-file fichero] [--simulate]
+y en process_config_file.json: "instrumentDaemon": "127.0.0.1:18500"
+"""
+
+import argparse
+import ipaddress
+import itertools
+import os
+import secrets
+import socket
+import threading
+from multiprocessing.connection import Listener, Client
+
+import pyvisa
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+from termcolor import colored
+
+DEFAULT_ADDRESS = "127.0.0.1:18500"
+DEFAULT_AUTHKEY_FILE = os.path.join(os.path.expanduser("~"), ".gpib_daemon_authkey")
+AUTHKEY_ENVIRONMENT_VARIABLE = "GPIB_DAEMON_AUTHKEY"
+AUTHKEY_BYTES = 32
+MIN_AUTHKEY_LENGTH = 16
+
+# operaciones que atiende el daemon sobre un instrumento
+OPERATIONS = ("write_raw", "read_raw", "read_stb", "setattr", "getattr")
+# atributos que se aplican a la sesion VISA / que solo se guardan en el daemon
+RESOURCE_ATTRIBUTES = ("timeout",)
+SESSION_ATTRIBUTES = ("identification", "healthQuery")
+# argumentos de open_resource que se aceptan
+OPEN_ARGUMENTS = ("send_end", "timeout")
+
+
+class InstrumentSessionError(RuntimeError):
+    """
+    Error del daemon (no VISA) al atender una peticion.
+    """
+    pass
+
+
+def parseAddress(address):
+    """
+    "host:port" --> (host, port)
+    """
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def isLoopbackAddress(host):
+    """
+    :return: True si host (IP o nombre) solo resuelve a direcciones de loopback
+    """
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def createAuthkeyFile(authkeyFile=DEFAULT_AUTHKEY_FILE):
+    """
+    Crea una authkey aleatoria en authkeyFile (permisos 0600). No sobreescribe una authkey existente.\n
+    :return: bytes con la authkey
+    """
+    authkey = secrets.token_hex(AUTHKEY_BYTES)
+    descriptor = os.open(authkeyFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "w") as f:
+        f.write(authkey + "\n")
+    return authkey.encode("ascii")
+
+
+def loadAuthkey(authkeyFile=None):
+    """
+    Authkey de la variable de entorno GPIB_DAEMON_AUTHKEY o, si no esta, del fichero authkeyFile
+    (None --> DEFAULT_AUTHKEY_FILE).\n
+    :return: bytes con la authkey
+    """
+    authkey = os.environ.get(AUTHKEY_ENVIRONMENT_VARIABLE, "").strip()
+    source = AUTHKEY_ENVIRONMENT_VARIABLE
+    if not authkey:
+        authkeyFile = DEFAULT_AUTHKEY_FILE if authkeyFile is None else authkeyFile
+        source = authkeyFile
+        if not os.path.exists(authkeyFile):
+            raise InstrumentSessionError("No daemon authkey: create one with 'python instrumentDaemon.py "
+                                         "--create-authkey' or set " + AUTHKEY_ENVIRONMENT_VARIABLE)
+        if os.name == "posix" and os.stat(authkeyFile).st_mode & 0o077:
+            raise InstrumentSessionError("Authkey file " + authkeyFile + " is accessible by other users "
+                                         "(chmod 600 " + authkeyFile + ")")
+        with open(authkeyFile, "r") as f:
+            authkey = f.read().strip()
+    if len(authkey) < MIN_AUTHKEY_LENGTH:
+        raise InstrumentSessionError("Authkey from " + source + " is too short (at least " +
+                                     str(MIN_AUTHKEY_LENGTH) + " characters)")
+    return authkey.encode("utf-8")
+
+
+class InstrumentSession:
+    """
+    Sesion de un instrumento en el daemon.
+
+    Args:
+        resourceManager: ResourceManager del daemon
+        resourceName (str): p.ej. GPIB0::25::INSTR
+        openKwargs (dict): Argumentos de open_resource (p.ej. send_end)
+    """
+
+    def __init__(self, resourceManager, resourceName, openKwargs):
+        self.resourceManager = resourceManager
+        self.resourceName = resourceName
+        self.openKwargs = openKwargs
+        self.resource = None
+        self.attributes = {}
+        self.lock = threading.Lock()  # una operacion a la vez
+        self.leaseCondition = threading.Condition()
+        self.owner = None  # cliente que tiene el instrumento prestado
+        self.reconnections = 0
+        self.lastError = None
+
+    def acquire(self, owner, timeout=None):
+        with self.leaseCondition:
+            if not self.leaseCondition.wait_for(lambda: self.owner is None or self.owner == owner, timeout):
+                raise InstrumentSessionError(self.resourceName + " is in use by another client")
+            self.owner = owner
+
+    def release(self, owner):
+        with self.leaseCondition:
+            if self.owner == owner:
+                self.owner = None
+                self.leaseCondition.notify_all()
+
+    def ensureOpen(self):
+        if self.resource is not None:
+            return
+        if self.lastError is not None:
+            self.reconnections += 1
+            print(colored("Reconnecting " + self.resourceName + " (" + str(self.lastError) + ")", "yellow"))
+        self.resource = self.resourceManager.open_resource(self.resourceName, **self.openKwargs)
+        for name, value in self.attributes.items():
+            if name in RESOURCE_ATTRIBUTES:
+                setattr(self.resource, name, value)
+
+    def discard(self, error):
+        # sesion en estado desconocido: se reabre en la siguiente operacion
+        self.lastError = error
+        resource, self.resource = self.resource, None
+        if resource is not None:
+            try:
+                resource.close()
+            except Exception:
+                pass
+
+    def call(self, operation, *args):
+        if operation not in OPERATIONS:
+            raise InstrumentSessionError("Operation not allowed: " + repr(operation))
+        if operation in ("setattr", "getattr") and args[0] not in RESOURCE_ATTRIBUTES + SESSION_ATTRIBUTES:
+            raise InstrumentSessionError("Attribute not allowed: " + repr(args[0]))
+        with self.lock:
+            self.ensureOpen()
+            try:
+                if operation == "setattr":
+                    name, value = args
+                    if name in RESOURCE_ATTRIBUTES:
+                        setattr(self.resource, name, value)
+                    self.attributes[name] = value
+                    return None
+                if operation == "getattr":
+                    name, = args
+                    if name in self.attributes:
+                        return self.attributes[name]
+                    if name in SESSION_ATTRIBUTES:
+                        raise AttributeError(name)
+                    return getattr(self.resource, name)
+                if operation == "write_raw":
+                    message, = args
+                    return self.resource.write_raw(message)
+                if operation == "read_raw":
+                    return self.resource.read_raw(*args[:1])
+                return self.resource.read_stb()
+            except VisaIOError as e:
+                if e.error_code != constants.StatusCode.error_timeout:
+                    self.discard(e)
+                raise
+
+    def healthCheck(self):
+        """
+        Query healthQuery a la sesion si no esta prestada ni ocupada; si falla se reabre.\n
+        :return: bool, False si la sesion no responde
+        """
+        healthQuery = self.attributes.get("healthQuery")
+        if healthQuery is None or self.owner is not None or not self.lock.acquire(blocking=False):
+            return True
+        try:
+            self.ensureOpen()
+            self.resource.write_raw(healthQuery.encode("ascii"))
+            self.resource.read_raw()
+            return True
+        except Exception as e:
+            self.discard(e)
+            return False
+        finally:
+            self.lock.release()
+
+    def status(self):
+        return {"resourceName": self.resourceName,
+                "open": self.resource is not None,
+                "leased": self.owner is not None,
+                "reconnections": self.reconnections,
+                "lastError": None if self.lastError is None else str(self.lastError),
+                "identification": self.attributes.get("identification")}
+
+
+class InstrumentSessionDaemon:
+    """
+    Daemon de sesiones GPIB (ver cabecera del modulo).
+
+    Args:
+        address (str): "host:port" en el que escucha (solo loopback)
+        resourceManager: ResourceManager a compartir (None --> pyvisa.ResourceManager())
+        authkey (bytes): Clave compartida con los clientes (None --> loadAuthkey())
+        healthCheckPeriod (float): Periodo de las comprobaciones de salud. Seconds
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, resourceManager=None, authkey=None, healthCheckPeriod=30.0):
+        self.address = parseAddress(address)
+        if not isLoopbackAddress(self.address[0]):
+            raise InstrumentSessionError("The daemon only listens on loopback addresses, not on " + self.address[0])
+        self.authkey = authkey if authkey is not None else loadAuthkey()
+        self.resourceManager = resourceManager if resourceManager is not None else pyvisa.ResourceManager()
+        self.healthCheckPeriod = healthCheckPeriod
+        self.sessions = {}
+        self.sessionsLock = threading.Lock()
+        self.resources = None
+        self.resourcesLock = threading.Lock()
+        self.clientIds = itertools.count(1)
+        self.stopped = threading.Event()
+        self.listener = None
+
+    def listResources(self, refresh=False):
+        with self.resourcesLock:
+            if self.resources is None or refresh:
+                self.resources = tuple(self.resourceManager.list_resources())
+            return self.resources
+
+    def session(self, resourceName, openKwargs):
+        with self.sessionsLock:
+            session = self.sessions.get(resourceName)
+            if session is None:
+                session = InstrumentSession(self.resourceManager, resourceName, openKwargs)
+                self.sessions[resourceName] = session
+            return session
+
+    def listen(self):
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.address = self.listener.address
+        threading.Thread(target=self.healthCheckLoop, name="daemon-health", daemon=True).start()
+        print(colored("Instrument session daemon listening on %s:%d" % self.address, "green"))
+
+    def serveForever(self):
+        self.listen()
+        try:
+            self.acceptConnections()
+        finally:
+            self.close()
+
+    def start(self):
+        """
+        Atiende a los clientes en un hilo (p.ej. para usar el daemon dentro del mismo proceso).
+        """
+        self.listen()
+        threading.Thread(target=self.acceptConnections, name="daemon-accept", daemon=True).start()
+        return self
+
+    def acceptConnections(self):
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except Exception:
+                continue  # cliente con authkey incorrecta, cliente que se va durante el handshake o daemon cerrado
+            threading.Thread(target=self.serveConnection, args=(connection,), name="daemon-client",
+                             daemon=True).start()
+
+    def close(self):
+        self.stopped.set()
+        if self.listener is not None:
+            self.listener.close()
+        with self.sessionsLock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            with session.lock:
+                session.discard(None)
+
+    def healthCheckLoop(self):
+        while not self.stopped.wait(self.healthCheckPeriod):
+            with self.sessionsLock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                session.healthCheck()
+
+    def serveConnection(self, connection):
+        """
+        Atiende las peticiones de una conexion: (operacion, argumentos...) --> ("ok", valor), ("visaError", codigo),
+        ("attributeError", mensaje) o ("error", mensaje).
+        Las conexiones de un mismo RemoteResourceManager comparten su clientId (el lease es del cliente).
+        """
+        session = None
+        owner = None
+        try:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+                operation, args = request[0], request[1:]
+                try:
+                    if operation == "hello":
+                        result = next(self.clientIds)
+                    elif operation == "list_resources":
+                        result = self.listResources(*args)
+                    elif operation == "status":
+                        with self.sessionsLock:
+                            result = [s.status() for s in self.sessions.values()]
+                    elif operation == "open":
+                        resourceName, openKwargs, owner, leaseTimeout = args
+                        if any(name not in OPEN_ARGUMENTS for name in openKwargs):
+                            raise InstrumentSessionError("open_resource arguments not allowed: " +
+                                                         str(sorted(set(openKwargs) - set(OPEN_ARGUMENTS))))
+                        session = self.session(resourceName, openKwargs)
+                        session.acquire(owner, leaseTimeout)
+                        with session.lock:
+                            session.ensureOpen()
+                        result = session.resourceName
+                    elif operation == "close":
+                        if session is not None:
+                            session.release(owner)
+                        result = None
+                    elif session is None:
+                        raise InstrumentSessionError("No instrument open on this connection")
+                    else:
+                        result = session.call(operation, *args)
+                    response = ("ok", result)
+                except VisaIOError as e:
+                    response = ("visaError", int(e.error_code))
+                except AttributeError as e:
+                    response = ("attributeError", str(e))
+                except Exception as e:
+                    response = ("error", type(e).__name__ + ": " + str(e))
+                connection.send(response)
+        finally:
+            # cliente desconectado (o muerto): el instrumento queda libre para los demas
+            if session is not None:
+                session.release(owner)
+            connection.close()
+
+
+class _DaemonConnection:
+    """
+    Conexion con el daemon (thread-safe: una peticion/respuesta a la vez).
+    """
+
+    def __init__(self, address, authkey):
+        self.connection = Client(parseAddress(address), authkey=authkey)
+        self.lock = threading.Lock()
+
+    def request(self, *request):
+        with self.lock:
+            self.connection.send(request)
+            status, value = self.connection.recv()
+        if status == "ok":
+            return value
+        if status == "visaError":
+            raise VisaIOError(value)
+        if status == "attributeError":
+            raise AttributeError(value)
+        raise InstrumentSessionError(value)
+
+    def close(self):
+        self.connection.close()
+
+
+class RemoteInstrument:
+    """
+    Instrumento prestado por el daemon, con la interfaz de pyvisa que usa main.py (write_raw, read_raw, read_stb,
+    timeout...). Cada instrumento tiene su propia conexion: los hilos de InstrumentWorker no se bloquean entre si.
+    """
+
+    def __init__(self, connection, resourceName):
+        object.__setattr__(self, "_connection", connection)
+        object.__setattr__(self, "resource_name", resourceName)
+
+    def write_raw(self, message):
+        if isinstance(message, str):
+            message = message.encode("ascii")
+        return self._connection.request("write_raw", message)
+
+    def read_raw(self, size=None):
+        return self._connection.request("read_raw", size) if size is not None else \
+            self._connection.request("read_raw")
+
+    def read_stb(self):
+        return self._connection.request("read_stb")
+
+    def close(self):
+        try:
+            self._connection.request("close")
+        finally:
+            self._connection.close()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._connection.request("getattr", name)
+
+    def __setattr__(self, name, value):
+        self._connection.request("setattr", name, value)
+
+
+class RemoteResourceManager:
+    """
+    ResourceManager que usa las sesiones del daemon (se pasa como resourceManager= a start_process).
+    Un instrumento abierto se reutiliza en los siguientes open_resource del mismo cliente.
+
+    Args:
+        address (str): "host:port" del daemon
+        authkey (bytes): Clave compartida con el daemon (None --> loadAuthkey())
+        leaseTimeout (float): Espera maxima si el instrumento lo tiene otro cliente (None --> sin limite). Seconds
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, leaseTimeout=None):
+        self.address = address
+        self.authkey = authkey if authkey is not None else loadAuthkey()
+        self.leaseTimeout = leaseTimeout
+        self.control = _DaemonConnection(address, self.authkey)
+        self.clientId = self.control.request("hello")
+        self.instruments = {}
+        self.lock = threading.Lock()
+
+    def list_resources(self, query="?*::INSTR", refresh=False):
+        return self.control.request("list_resources", refresh)
+
+    def open_resource(self, resourceName, **kwargs):
+        with self.lock:
+            instrument = self.instruments.get(resourceName)
+            if instrument is None:
+                connection = _DaemonConnection(self.address, self.authkey)
+                try:
+                    connection.request("open", resourceName, kwargs, self.clientId, self.leaseTimeout)
+                except Exception:
+                    connection.close()
+                    raise
+                instrument = RemoteInstrument(connection, resourceName)
+                self.instruments[resourceName] = instrument
+            return instrument
+
+    def status(self):
+        """
+        :return: lista de dict con el estado de cada sesion del daemon
+        """
+        return self.control.request("status")
+
+    def close(self):
+        with self.lock:
+            instruments, self.instruments = self.instruments, {}
+        for instrument in instruments.values():
+            instrument.close()
+        self.control.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Persistent GPIB session daemon shared by the sweeps")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port to listen on (loopback only)")
+    parser.add_argument("--authkey-file", default=DEFAULT_AUTHKEY_FILE,
+                        help="file with the authkey (the " + AUTHKEY_ENVIRONMENT_VARIABLE + " variable takes precedence)")
+    parser.add_argument("--create-authkey", action="store_true", help="create a random authkey file and exit")
+    parser.add_argument("--health-check-period", type=float, default=30.0, help="s")
+    parser.add_argument("--simulate", action="store_true", help="serve a simulated bench (instrumentSimulator)")
+    parser.add_argument("--status", action="store_true", help="print the sessions of a running daemon and exit")
+    args = parser.parse_args()
+
+    if args.create_authkey:
+        createAuthkeyFile(args.authkey_file)
+        print("Authkey written to " + args.authkey_file)
+    elif args.status:
+        remoteResourceManager = RemoteResourceManager(args.address, loadAuthkey(args.authkey_file))
+        for sessionStatus in remoteResourceManager.status():
+            print(sessionStatus)
+        remoteResourceManager.close()
+    else:
+        daemonResourceManager = None
+        if args.simulate:
+            from instrumentSimulator import SimulatedBench
+            daemonResourceManager = SimulatedBench().resourceManager()
+        daemon = InstrumentSessionDaemon(args.address, daemonResourceManager, loadAuthkey(args.authkey_file),
+                                         args.health_check_period)
+        try:
+            daemon.serveForever()
+        except KeyboardInterrupt:
+            pass
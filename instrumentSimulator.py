@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Banco simulado que sustituye al que usa main.py: un Keithley 2400 como amperimetro y una fuente de alta tension
+EURO TEST HPP-120-256, los dos detras de un ResourceManager de pyvisa falso.
+
+Los instrumentos simulados responden a los mismos comandos que manda main.py, modelan la rampa de la fuente HV
+(configurada con "RAMP,") y una curva de corriente de fuga que ve el amperimetro, y pueden añadir una latencia fija a
+cada transaccion GPIB. El banco lleva ademas la cuenta del tiempo en el que el bus y los instrumentos estan ocupados de
+verdad, asi un sweep contra el banco se puede separar en tiempo util y tiempo muerto (ver sweepBenchmark.py).
+"""
+
+import math
+import random
+import re
+import struct
+import threading
+import time
+
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+
+K2400_IDN = "KEITHLEY INSTRUMENTS INC.,MODEL 2400,1234567,C30   Mar 17 2006 09:29:29/A02  /K/J"
+HPP_ID = "ID, EURO TEST HPP-120-256-IEEE, SN 0001, FW 1.0"
+
+HPP_MAX_VOLTAGE = 12000.0  # in V
+HPP_DEFAULT_RAMP = 500.0  # in V/s
+POWER_LINE_FREQUENCY = 50.0  # in Hz
+K2400_RESET_TIME = 0.1  # in s
+
+# bits del status byte IEEE 488.2
+STB_MAV = 0x10
+STB_ESB = 0x20
+STB_RQS = 0x40
+ESR_OPC = 0x01
+
+# bits de la palabra "STATUS,DI" de la HPP simulada
+HPP_STATUS_HV_ON = 0x01
+HPP_STATUS_RAMPING = 0x02
+HPP_STATUS_CURRENT_LIMIT = 0x04
+HPP_STATUS_KILL_ENABLED = 0x08
+HPP_STATUS_INTERLOCK_OPEN = 0x10
+
+
+class LeakageCurve:
+    """
+    Corriente de fuga de la muestra en funcion de la tension aplicada: parte ohmica (voltage / insulationResistance)
+    mas una parte exponencial que crece rapidamente por encima de breakdownVoltage.
+
+    Args:
+        insulationResistance (float): Resistencia de aislamiento de la muestra. Ohms
+        saturationCurrent (float): Factor preexponencial de la parte no ohmica. Amps
+        characteristicVoltage (float): Tension que multiplica por e la parte no ohmica. Volts
+        breakdownVoltage (float): Tension por encima de la cual la corriente se dispara (None --> sin ruptura). Volts
+        noise (float): Desviacion estandar del ruido gaussiano de cada lectura. Amps
+    """
+
+    def __init__(self, insulationResistance=1e14, saturationCurrent=1e-12, characteristicVoltage=2500.0,
+                 breakdownVoltage=None, noise=2e-12):
+        self.insulationResistance = insulationResistance
+        self.saturationCurrent = saturationCurrent
+        self.characteristicVoltage = characteristicVoltage
+        self.breakdownVoltage = breakdownVoltage
+        self.noise = noise
+
+    def current(self, voltage):
+        current = voltage / self.insulationResistance
+        current += self.saturationCurrent * (math.exp(min(abs(voltage) / self.characteristicVoltage, 50)) - 1)
+        if self.breakdownVoltage is not None and abs(voltage) > self.breakdownVoltage:
+            current *= math.exp(min((abs(voltage) - self.breakdownVoltage) / 100.0, 50))
+        return current + random.gauss(0.0, self.noise)
+
+
+def _scpiHeader(command):
+    """
+    Cabecera de un comando SCPI en su forma corta y en mayusculas, p.ej. ":SENSe:AVERage:COUNt" --> "SENS:AVER:COUN".
+    """
+    nodes = []
+    for node in command.strip().lstrip(":").split(":"):
+        if any(c.islower() for c in node):
+            short = ""
+            for c in node:
+                if not c.isupper():
+                    break
+                short += c
+            node = short
+        nodes.append(node.upper())
+    return ":".join(nodes)
+
+
+class SimulatedInstrument:
+    """
+    Comportamiento GPIB comun de los instrumentos simulados: cola de salida, timeout, latencia, cuenta del tiempo de
+    bus y el estado IEEE 488.2 (status byte, *ESE/*SRE/*ESR, *OPC/*OPC?) que usa la sincronizacion por eventos.
+    Las subclases implementan handleCommand, que recibe un comando ya decodificado y puede encolar respuestas.
+    """
+
+    def __init__(self, bench, resourceName):
+        self.bench = bench
+        self.resource_name = resourceName
+        self.timeout = 2000  # in ms, como en pyvisa
+        self.outputQueue = []
+        self.responseReadyAt = 0.0
+        self.eventStatus = 0
+        self.eventStatusEnable = 0
+        self.serviceRequestEnable = 0
+        self.opcPending = False
+
+    def write_raw(self, message):
+        if isinstance(message, bytes):
+            message = message.decode(encoding='ascii', errors='ignore')
+        self.bench.busTransaction()
+        with self.bench.lock:
+            message = message.strip("\r\n\x00")
+            if message:
+                self.handleCommand(message)
+        return len(message)
+
+    def read_raw(self, size=None):
+        self.bench.busTransaction()
+        with self.bench.lock:
+            waitTime = self.responseReadyAt - time.time()
+        if waitTime > 0:
+            if waitTime * 1000 > self.timeout:
+                time.sleep(self.timeout / 1000)
+                raise VisaIOError(constants.StatusCode.error_timeout)
+            time.sleep(waitTime)
+        with self.bench.lock:
+            if self.outputQueue:
+                return self.outputQueue.pop(0)
+        # nada que leer: el timeout pasa sin tener el lock del banco (el otro instrumento sigue trabajando)
+        time.sleep(self.timeout / 1000)
+        raise VisaIOError(constants.StatusCode.error_timeout)
+
+    def read_stb(self):
+        """
+        Serial poll. MAV solo se activa cuando la operacion pendiente (p.ej. la integracion de un :READ?) ha terminado.
+        """
+        self.bench.busTransaction()
+        with self.bench.lock:
+            ready = time.time() >= self.responseReadyAt
+            if self.opcPending and ready:
+                self.eventStatus |= ESR_OPC
+                self.opcPending = False
+            status = 0
+            if self.outputQueue and ready:
+                status |= STB_MAV
+            if self.eventStatus & self.eventStatusEnable:
+                status |= STB_ESB
+            if status & self.serviceRequestEnable:
+                status |= STB_RQS
+            return status
+
+    def close(self):
+        pass
+
+    def busyFor(self, duration):
+        # el instrumento no responde ni completa *OPC hasta que termina la operacion
+        now = time.time()
+        self.responseReadyAt = max(self.responseReadyAt, now) + duration
+        self.bench.busy(now, self.responseReadyAt)
+
+    def handleCommonCommand(self, header, argument):
+        """
+        Comandos comunes IEEE 488.2. Devuelve True si el comando es uno de ellos.
+        """
+        if header == "*CLS":
+            self.eventStatus = 0
+            self.opcPending = False
+        elif header == "*ESE":
+            self.eventStatusEnable = int(argument)
+        elif header == "*SRE":
+            self.serviceRequestEnable = int(argument)
+        elif header == "*ESE?":
+            self.queueResponse("%d\n" % self.eventStatusEnable)
+        elif header == "*SRE?":
+            self.queueResponse("%d\n" % self.serviceRequestEnable)
+        elif header == "*ESR?":
+            if self.opcPending and time.time() >= self.responseReadyAt:
+                self.eventStatus |= ESR_OPC
+                self.opcPending = False
+            self.queueResponse("%d\n" % self.eventStatus)
+            self.eventStatus = 0
+        elif header == "*OPC":
+            self.opcPending = True
+        elif header == "*OPC?":
+            self.queueResponse("1\n")
+        elif header == "*WAI":
+            pass
+        else:
+            return False
+        return True
+
+    def queueResponse(self, response):
+        if isinstance(response, str):
+            response = response.encode(encoding='ascii')
+        self.outputQueue.append(response)
+
+    def handleCommand(self, command):
+        raise NotImplementedError
+
+
+class SimulatedHVSource(SimulatedInstrument):
+    """
+    EURO TEST HPP-120-256. La salida sigue al setpoint con la rampa configurada mientras HV esta ON y vuelve a cero
+    con la misma rampa con HV OFF.
+    """
+
+    def __init__(self, bench, resourceName, readbackNoise=1.0):
+        SimulatedInstrument.__init__(self, bench, resourceName)
+        self.readbackNoise = readbackNoise
+        self.reset()
+
+    def reset(self):
+        self.setpoint = 0.0
+        self.rampRate = HPP_DEFAULT_RAMP
+        self.currentLimit = 0.001
+        self.killEnabled = False
+        self.hvOn = False
+        self.rampStartVoltage = 0.0
+        self.rampStartTime = time.time()
+
+    def targetVoltage(self):
+        return self.setpoint if self.hvOn else 0.0
+
+    def outputVoltage(self, now=None):
+        now = time.time() if now is None else now
+        target = self.targetVoltage()
+        travelled = self.rampRate * (now - self.rampStartTime)
+        if abs(target - self.rampStartVoltage) <= travelled:
+            return target
+        return self.rampStartVoltage + math.copysign(travelled, target - self.rampStartVoltage)
+
+    def _freezeOutput(self):
+        # hay que llamarlo antes de cambiar setpoint, rampa o estado HV: la salida se queda donde esta ahora
+        now = time.time()
+        self.rampStartVoltage = self.outputVoltage(now)
+        self.rampStartTime = now
+
+    def _startRamp(self):
+        self.bench.rampTo(self, self.rampStartVoltage, self.targetVoltage(), self.rampRate, self.rampStartTime)
+
+    def statusWord(self):
+        status = 0
+        if self.hvOn:
+            status |= HPP_STATUS_HV_ON
+        if abs(self.outputVoltage() - self.targetVoltage()) > 0.5:
+            status |= HPP_STATUS_RAMPING
+        if self.killEnabled:
+            status |= HPP_STATUS_KILL_ENABLED
+        if abs(self.bench.leakageCurve.current(self.outputVoltage())) > self.currentLimit:
+            status |= HPP_STATUS_CURRENT_LIMIT
+        return status
+
+    def handleCommand(self, command):
+        command = command.strip().upper()
+        if command == "*RST":
+            self.reset()
+            self.bench.rampTo(self, 0.0, 0.0, self.rampRate, time.time())
+        elif command == "*CLS":
+            self.outputQueue = []
+        elif command == "ID":
+            self.queueResponse(HPP_ID + "\x00")
+        elif command == "STATUS,MU":
+            voltage = self.outputVoltage() + random.gauss(0.0, self.readbackNoise)
+            self.queueResponse("UM, RANGE=%dV, VALUE=%.3fkV\x00" % (HPP_MAX_VOLTAGE, voltage / 1000))
+        elif command == "STATUS,DI":
+            self.queueResponse("DI, STATUS=0x%04X\x00" % self.statusWord())
+        elif command.startswith("U,") and command.endswith("KV"):
+            self._freezeOutput()
+            self.setpoint = min(max(float(command[2:-2]) * 1000, 0.0), HPP_MAX_VOLTAGE)
+            self._startRamp()
+        elif command.startswith("RAMP,") and command.endswith("V/S"):
+            self._freezeOutput()
+            self.rampRate = max(float(command[5:-3]), 1.0)
+            self._startRamp()
+        elif command.startswith("I,") and command.endswith("MA"):
+            self.currentLimit = float(command[2:-2]) / 1000
+        elif command in ("KILL,EN", "KILL,DIS"):
+            self.killEnabled = command == "KILL,EN"
+        elif command in ("HV,ON", "HV,OFF"):
+            self._freezeOutput()
+            self.hvOn = command == "HV,ON"
+            self._startRamp()
+        else:
+            self.bench.unknownCommands.append((self.resource_name, command))
+
+
+class SimulatedK2400(SimulatedInstrument):
+    """
+    Keithley 2400 como amperimetro (fuente de tension fija a 0V, mide corriente) en serie con la fuente HV.
+    :READ? tarda NPLC / frecuencia de red segundos por conversion (por el numero de promedios) hasta tener la
+    respuesta.
+    """
+
+    def __init__(self, bench, resourceName):
+        SimulatedInstrument.__init__(self, bench, resourceName)
+        self.reset()
+
+    def reset(self):
+        self.outputOn = False
+        self.nplc = 1.0
+        self.averageCount = 10
+        self.averageEnabled = False
+        self.compliance = 105e-6
+        self.currentRange = 105e-6
+        self.elements = ["VOLT", "CURR", "RES", "TIME", "STAT"]
+        self.startTime = time.time()
+        self.settings = {}
+        self.dataFormat = "ASC"
+        self.byteOrder = "NORM"
+        self.triggerCount = 1
+        self.bufferPoints = 100
+        self.bufferFeedControl = "NEV"
+        self.buffer = []
+
+    def integrationTime(self):
+        conversions = self.averageCount if self.averageEnabled else 1
+        return conversions * self.nplc / POWER_LINE_FREQUENCY
+
+    def measure(self):
+        now = time.time()
+        if self.outputOn:
+            current = -self.bench.leakageCurve.current(self.bench.hvSource.outputVoltage(now))
+            current = max(min(current, self.compliance), -self.compliance)
+        else:
+            current = 9.91e37  # valor NaN del 2400
+        values = {"VOLT": 0.0, "CURR": current, "RES": 9.91e37, "TIME": now - self.startTime, "STAT": 0.0}
+        return [values[element] for element in self.elements]
+
+    def handleCommand(self, message):
+        # mensajes SCPI compuestos: "cmd1;cmd2;..." (todos nuestros comandos usan rutas absolutas)
+        for command in message.split(";"):
+            if command.strip():
+                self.handleScpiCommand(command)
+
+    def handleScpiCommand(self, command):
+        header, _, argument = command.strip().partition(" ")
+        header = _scpiHeader(header)
+        argument = argument.strip()
+        self.settings[header] = argument
+
+        if self.handleCommonCommand(header, argument):
+            pass
+        elif header == "*IDN?":
+            self.queueResponse(K2400_IDN + "\n")
+        elif header == "*RST":
+            self.reset()
+            self.busyFor(K2400_RESET_TIME)
+        elif header == "OUTP:STAT" or header == "OUTP":
+            self.outputOn = argument.upper() in ("ON", "1")
+        elif header == "SENS:CURR:NPLC":
+            self.nplc = float(argument)
+        elif header == "SENS:AVER:COUN":
+            self.averageCount = int(float(argument))
+        elif header == "SENS:AVER" or header == "SENS:AVER:STAT":
+            self.averageEnabled = argument.upper() in ("ON", "1")
+        elif header == "SENS:CURR:PROT" or header == "SENS:CURR:PROT:LEV":
+            self.compliance = float(argument)
+        elif header == "SENS:CURR:RANG" or header == "SENS:CURR:RANG:UPP":
+            self.currentRange = float(argument)
+        elif header == "FORM:ELEM" or header == "FORM:ELEM:SENS":
+            self.elements = [element.strip().upper()[:4] for element in argument.split(",")]
+        elif header == "FORM:DATA" or header == "FORM":
+            self.dataFormat = "SREAL" if argument.upper().startswith("SRE") else "ASC"
+        elif header == "FORM:BORD":
+            self.byteOrder = argument.upper()[:4]
+        elif header == "TRIG:COUN":
+            self.triggerCount = int(float(argument))
+        elif header == "TRAC:POIN":
+            self.bufferPoints = int(float(argument))
+        elif header == "TRAC:CLE":
+            self.buffer = []
+        elif header == "TRAC:FEED:CONT":
+            self.bufferFeedControl = argument.upper()[:4]
+        elif header == "INIT":
+            self.busyFor(self.integrationTime() * self.triggerCount)
+            readings = [self.measure() for _ in range(self.triggerCount)]
+            if self.bufferFeedControl == "NEXT":
+                self.buffer += readings[:self.bufferPoints - len(self.buffer)]
+                if len(self.buffer) >= self.bufferPoints:
+                    self.bufferFeedControl = "NEV"
+        elif header == "TRAC:DATA?":
+            self.queueResponse(self.formatReadings(self.buffer))
+        elif header == "READ?":
+            self.busyFor(self.integrationTime() * self.triggerCount)
+            self.queueResponse(self.formatReadings([self.measure() for _ in range(self.triggerCount)]))
+
+    def formatReadings(self, readings):
+        values = [value for reading in readings for value in reading]
+        if self.dataFormat == "SREAL":
+            # bloque IEEE 488.2 de longitud indefinida: "#0" + 4 bytes por valor + terminador
+            byteOrder = "<" if self.byteOrder == "SWAP" else ">"
+            return b"#0" + struct.pack(byteOrder + "%df" % len(values), *values) + b"\n"
+        return ",".join("%+.6E" % value for value in values) + "\n"
+
+
+class SimulatedBench:
+    """
+    Los dos instrumentos simulados y la cuenta del tiempo de bus, integracion y rampa.
+
+    Args:
+        k2400_gpibAddress (int): Direccion GPIB del K2400 simulado
+        hvSource_gpibAddress (int): Direccion GPIB de la fuente HPP simulada
+        gpibBoard (int): Indice de la placa GPIB en los nombres de recurso
+        transactionLatency (float): Duracion de cada write_raw / read_raw. Seconds
+        discoveryLatency (float): Duracion de list_resources. Seconds
+        leakageCurve (LeakageCurve): Modelo de corriente de la muestra
+    """
+
+    def __init__(self, k2400_gpibAddress=25, hvSource_gpibAddress=20, gpibBoard=0, transactionLatency=0.0,
+                 discoveryLatency=0.0, leakageCurve=None):
+        self.lock = threading.RLock()
+        self.transactionLatency = transactionLatency
+        self.discoveryLatency = discoveryLatency
+        self.leakageCurve = leakageCurve if leakageCurve is not None else LeakageCurve()
+        self.unknownCommands = []
+        self.transactionCount = 0
+        self.busyIntervals = []
+        self.rampIntervals = {}
+
+        self.k2400 = SimulatedK2400(self, "GPIB%d::%d::INSTR" % (gpibBoard, k2400_gpibAddress))
+        self.hvSource = SimulatedHVSource(self, "GPIB%d::%d::INSTR" % (gpibBoard, hvSource_gpibAddress))
+        self.instruments = {self.k2400.resource_name: self.k2400, self.hvSource.resource_name: self.hvSource}
+
+    def busTransaction(self):
+        start = time.time()
+        if self.transactionLatency > 0:
+            time.sleep(self.transactionLatency)
+        with self.lock:
+            self.transactionCount += 1
+            self.busyIntervals.append((start, start + self.transactionLatency))
+
+    def busy(self, start, end):
+        with self.lock:
+            self.busyIntervals.append((start, end))
+
+    def rampTo(self, instrument, fromVoltage, toVoltage, rampRate, now):
+        with self.lock:
+            # un setpoint nuevo corta la rampa que estaba en curso
+            previous = self.rampIntervals.pop(instrument.resource_name, None)
+            if previous is not None:
+                self.busyIntervals.append((previous[0], min(previous[1], now)))
+            self.rampIntervals[instrument.resource_name] = (now, now + abs(toVoltage - fromVoltage) / rampRate)
+
+    def resetAccounting(self):
+        with self.lock:
+            self.transactionCount = 0
+            self.busyIntervals = []
+            self.rampIntervals = {}
+
+    def busyTime(self, start, end):
+        """
+        Tiempo entre start y end (segundos epoch) en el que el bus o algun instrumento hacian trabajo real
+        (transferencia GPIB, integracion del K2400 o rampa de la fuente HV). La actividad solapada cuenta una vez.
+        """
+        with self.lock:
+            intervals = self.busyIntervals + list(self.rampIntervals.values())
+        clipped = sorted((max(s, start), min(e, end)) for s, e in intervals if e > start and s < end)
+        total = 0.0
+        currentStart, currentEnd = None, None
+        for s, e in clipped:
+            if currentEnd is None or s > currentEnd:
+                if currentEnd is not None:
+                    total += currentEnd - currentStart
+                currentStart, currentEnd = s, e
+            else:
+                currentEnd = max(currentEnd, e)
+        if currentEnd is not None:
+            total += currentEnd - currentStart
+        return total
+
+    def resourceManager(self):
+        return SimulatedResourceManager(self)
+
+
+class SimulatedResourceManager:
+    """
+    Sustituto de pyvisa.ResourceManager que sirve los instrumentos de un SimulatedBench.
+    """
+
+    def __init__(self, bench):
+        self.bench = bench
+
+    def list_resources(self, query="?*::INSTR"):
+        if self.bench.discoveryLatency > 0:
+            time.sleep(self.bench.discoveryLatency)
+        return tuple(sorted(self.bench.instruments))
+
+    def open_resource(self, resource_name, **kwargs):
+        resource_name = re.sub(r"\s", "", resource_name).upper()
+        if resource_name not in self.bench.instruments:
+            raise VisaIOError(constants.StatusCode.error_resource_not_found)
+        instrument = self.bench.instruments[resource_name]
+        if "timeout" in kwargs:
+            instrument.timeout = kwargs["timeout"]
+        return instrument
+
+    def close(self):
+        pass
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Publicacion en vivo de los puntos del sweep.
+
+El bucle de start_process solo hace PointBus.publish(point): el punto se deja en la cola de cada consumidor y cada
+consumidor lo procesa en su propio hilo, asi que una consola lenta (o una sesion RDP) ya no añade latencia a cada
+medida. La excepcion es el fichero de resultados, que se escribe en el propio publish: cuando publish vuelve el punto
+ya esta en el fichero (o en su journal), y si el proceso muere no queda nada en una cola. Si un consumidor falla (p.ej.
+el fichero de resultados no se puede escribir) su excepcion se lanza en ese publish (fichero de resultados) o en el
+siguiente publish o en close (consumidores con hilo), y el sweep se aborta:
+    - ResultsFileConsumer: escribe el fichero de resultados (resultsWriter). Sincrono: sin cola ni hilo.
+    - ConsoleConsumer: el informe de cada punto por consola. Si se queda atras diezma su cola (se salta puntos).
+    - SocketPublisher: servidor TCP local (una linea JSON por punto) para clientes de graficas en vivo. Cada cliente
+      tiene su cola; si se queda atras se descartan sus puntos mas antiguos y si no acepta datos se le desconecta.
+
+Uso (cliente de ejemplo):
+    python livePoints.py --port 5555   --> muestra los puntos que publica un sweep con livePort=5555
+"""
+
+import argparse
+import contextvars
+import json
+import socket
+import threading
+from collections import deque
+
+from termcolor import colored
+
+POLICY_SYNC = "sync"  # sin cola ni hilo: handle se llama desde publish
+POLICY_LOSSLESS = "lossless"  # cola sin limite
+POLICY_DROP = "drop"  # cola llena --> se descarta el punto mas antiguo
+POLICY_DECIMATE = "decimate"  # cola llena --> se descarta uno de cada dos puntos de la cola
+
+
+class SweepPoint:
+    """
+    Un punto del sweep tal y como se publica.
+
+    Args:
+        index (int): Numero de punto (0 el primero)
+        timestamp (float): Instante de la medida (time.time())
+        setpoint (float): Setpoint de la fuente. Volts
+        voltage (float): Lectura de la fuente. Volts
+        current (float): Corriente medida (media si hay varias lecturas). Amps
+        previousCurrent (float): Corriente del punto anterior. Amps
+        delta (float): current - previousCurrent. Amps
+        maxDelta (float): Salto maximo permitido antes de considerar overflow. Amps
+        currents (numpy.ndarray): Todas las lecturas del punto (None si solo hay una)
+        overflow (bool): Si el punto ha disparado el overflow de corriente
+        state (dict): Estado del sweep despues de este punto, para el checkpoint (no se publica por el socket)
+        statistics (dict): currentStatistics.BreakdownDetector.summary() despues de este punto (meanCurrent,
+            currentStd, logSlope, cusum, stopReason)
+    """
+
+    def __init__(self, index, timestamp, setpoint, voltage, current, previousCurrent, delta, maxDelta,
+                 currents=None, overflow=False, state=None, statistics=None):
+        self.index = index
+        self.timestamp = timestamp
+        self.setpoint = setpoint
+        self.voltage = voltage
+        self.current = current
+        self.previousCurrent = previousCurrent
+        self.delta = delta
+        self.maxDelta = maxDelta
+        self.currents = currents
+        self.overflow = overflow
+        self.state = state
+        self.statistics = statistics
+
+    def toDict(self):
+        point = {"index": self.index,
+                 "timestamp": self.timestamp,
+                 "setpoint": self.setpoint,
+                 "voltage": self.voltage,
+                 "current": self.current,
+                 "previousCurrent": self.previousCurrent,
+                 "delta": self.delta,
+                 "maxDelta": self.maxDelta,
+                 "overflow": self.overflow}
+        if self.currents is not None:
+            point["readings"] = len(self.currents)
+            point["currentStd"] = float(self.currents.std(ddof=1))
+        if self.statistics is not None:
+            point["statistics"] = self.statistics
+        return point
+
+
+class PointConsumer:
+    """
+    Consumidor con cola e hilo propios. Las subclases implementan handle(point) y, si lo necesitan, finish().
+    Si handle o finish lanzan una excepcion el consumidor deja de procesar puntos y la guarda en error (raiseError la
+    vuelve a lanzar en el hilo que publica). Con POLICY_SYNC no hay cola ni hilo: offer llama a handle y su excepcion
+    sale directamente de offer.
+    El hilo se arranca con el contexto (contextvars) de quien llama a start: la salida por consola de cada estacion
+    de multiStationRunner sigue yendo a su log.
+
+    Args:
+        name (str): Nombre del hilo
+        policy (str): POLICY_SYNC, POLICY_LOSSLESS, POLICY_DROP o POLICY_DECIMATE
+        maxQueue (int): Tamaño maximo de la cola (ignorado con POLICY_SYNC y POLICY_LOSSLESS)
+    """
+
+    def __init__(self, name, policy=POLICY_LOSSLESS, maxQueue=64):
+        self.name = name
+        self.policy = policy
+        self.maxQueue = maxQueue
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.thread = None
+        self.error = None
+        self.finished = False  # POLICY_SYNC: finish ya llamado
+
+    def start(self):
+        if self.policy == POLICY_SYNC:
+            return
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.run,),
+                                       name="points-" + self.name, daemon=True)
+        self.thread.start()
+
+    def offer(self, point):
+        """
+        Deja el punto en la cola sin bloquear (con POLICY_SYNC lo procesa).
+        """
+        if self.policy == POLICY_SYNC:
+            if self.closed:
+                return
+            try:
+                self.handle(point)
+            except Exception as e:
+                self.fail(e)
+                raise
+            return
+        with self.condition:
+            if self.policy != POLICY_LOSSLESS and len(self.queue) >= self.maxQueue:
+                if self.policy == POLICY_DECIMATE:
+                    kept = list(self.queue)[1::2]
+                    self.dropped += len(self.queue) - len(kept)
+                    self.queue = deque(kept)
+                else:
+                    self.queue.popleft()
+                    self.dropped += 1
+            self.queue.append(point)
+            self.condition.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.closed:
+                        self.condition.wait()
+                    if not self.queue:
+                        return
+                    point = self.queue.popleft()
+                self.handle(point)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            try:
+                self.finish()
+            except Exception as e:
+                self.fail(e)
+
+    def fail(self, error):
+        with self.condition:
+            if self.error is None:
+                self.error = error
+            self.closed = True
+            self.queue.clear()
+
+    def raiseError(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self, timeout=None):
+        """
+        Procesa lo que queda en la cola y para el hilo. Con timeout (consumidores con perdidas) lo que no haya
+        dado tiempo a procesar se descarta y, si el hilo sigue bloqueado (p.ej. en una escritura por consola), se
+        abandona pasado otro timeout (es un hilo daemon).\n
+        :return: bool, False si el hilo no ha terminado
+        """
+        if self.policy == POLICY_SYNC:
+            if not self.finished:
+                self.finished = True
+                try:
+                    self.finish()
+                except Exception as e:
+                    self.fail(e)
+            self.closed = True
+            return True
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                with self.condition:
+                    self.dropped += len(self.queue)
+                    self.queue.clear()
+                self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
+    def handle(self, point):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class ResultsFileConsumer(PointConsumer):
+    """
+    Escribe cada punto con un writer de resultsWriter.py (DatResultsWriter / BinaryResultsWriter) y lo cierra al
+    terminar. Sincrono (POLICY_SYNC): el punto se escribe en el hilo del sweep, dentro de publish. Con checkpoint
+    (sweepCheckpoint.SweepCheckpoint) guarda point.state despues de escribir
+    cada punto.
+    """
+
+    def __init__(self, resultsWriter, checkpoint=None):
+        PointConsumer.__init__(self, "results", POLICY_SYNC)
+        self.resultsWriter = resultsWriter
+        self.checkpoint = checkpoint
+
+    def handle(self, point):
+        self.resultsWriter.append(point.setpoint, point.voltage, point.current, point.currents, point.timestamp)
+        if self.checkpoint is not None and point.state is not None:
+            self.checkpoint.save(point.state)
+
+    def finish(self):
+        self.resultsWriter.close()
+
+
+class ConsoleConsumer(PointConsumer):
+    """
+    El informe de cada punto por consola (el mismo que se imprimia desde el bucle del sweep).
+    """
+
+    def __init__(self, maxQueue=16):
+        PointConsumer.__init__(self, "console", POLICY_DECIMATE, maxQueue)
+        self.reportedDropped = 0
+
+    def handle(self, point):
+        lines = []
+        if self.dropped != self.reportedDropped:
+            lines.append(colored("(" + str(self.dropped - self.reportedDropped) +
+                                 " points not shown, console is too slow)", "grey"))
+            self.reportedDropped = self.dropped
+        lines.append(colored("Voltage source --> " + str(point.voltage) + "V", "cyan"))
+        if point.currents is not None:
+            lines.append(colored("Ammeter Current std --> " + str(point.currents.std(ddof=1)) + "A (" +
+                                 str(len(point.currents)) + " readings)", "cyan"))
+        lines.append(colored("Previous Current --> " + str(point.previousCurrent) + "A", "cyan"))
+        lines.append(colored("Ammeter Current --> " + str(point.current) + "A", "cyan"))
+        lines.append(colored("Current Delta --> " + str(point.delta) + "A", "cyan"))
+        lines.append(colored("Max Current Delta --> " + str(point.maxDelta) + "A", "cyan"))
+        if point.statistics is not None and point.statistics["logSlope"] is not None:
+            lines.append(colored("Current slope --> " + "%.3f" % (point.statistics["logSlope"] * 1000) +
+                                 " decades/kV (CUSUM " + "%.2f" % point.statistics["cusum"] + ")", "cyan"))
+        if point.overflow:
+            stopReason = point.statistics["stopReason"] if point.statistics is not None else None
+            lines.append(colored("CURRENT OVERFLOW!!!!!!!" + ("" if stopReason is None else " (" + stopReason + ")"),
+                                 "red"))
+        print("\n".join(lines))
+
+
+class SocketPublisher(PointConsumer):
+    """
+    Servidor TCP en host:port que envia cada punto como una linea JSON a todos los clientes conectados.
+    Cada cliente tiene una cola de maxQueue puntos (se descartan los mas antiguos); un cliente que no acepta datos
+    en sendTimeout segundos se desconecta.
+    """
+
+    def __init__(self, port, host="127.0.0.1", maxQueue=256, sendTimeout=1.0):
+        PointConsumer.__init__(self, "socket", POLICY_DROP, maxQueue)
+        self.sendTimeout = sendTimeout
+        self.clients = []
+        self.clientsLock = threading.Lock()
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()
+        self.acceptThread = None
+
+    def start(self):
+        PointConsumer.start(self)
+        self.acceptThread = threading.Thread(target=self.acceptClients, name="points-socket-accept", daemon=True)
+        self.acceptThread.start()
+
+    def acceptClients(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return  # servidor cerrado
+            client = _SocketClient(connection, self.maxQueue, self.sendTimeout)
+            with self.clientsLock:
+                self.clients.append(client)
+            client.start()
+
+    def handle(self, point):
+        line = (json.dumps(point.toDict()) + "\n").encode("utf-8")
+        with self.clientsLock:
+            self.clients = [client for client in self.clients if client.connected]
+            clients = list(self.clients)
+        for client in clients:
+            client.offer(line)
+
+    def finish(self):
+        self.server.close()
+        with self.clientsLock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close(self.sendTimeout)
+
+
+class _SocketClient(PointConsumer):
+
+    def __init__(self, connection, maxQueue, sendTimeout):
+        PointConsumer.__init__(self, "socket-client", POLICY_DROP, maxQueue)
+        self.connection = connection
+        self.connection.settimeout(sendTimeout)
+        self.connected = True
+
+    def handle(self, line):
+        if not self.connected:
+            return
+        try:
+            self.connection.sendall(line)
+        except OSError:
+            # cliente desconectado o demasiado lento
+            self.connected = False
+            self.connection.close()
+
+    def finish(self):
+        if self.connected:
+            self.connected = False
+            self.connection.close()
+
+
+class PointBus:
+    """
+    Reparte cada punto publicado entre los consumidores.
+
+    Args:
+        consumers (list): Lista de PointConsumer
+        lossyCloseTimeout (float): Al cerrar, tiempo maximo para que los consumidores con perdidas vacien su cola.
+            Seconds
+    """
+
+    def __init__(self, consumers, lossyCloseTimeout=2.0):
+        self.consumers = list(consumers)
+        self.lossyCloseTimeout = lossyCloseTimeout
+
+    def start(self):
+        for consumer in self.consumers:
+            consumer.start()
+        return self
+
+    def publish(self, point):
+        """
+        :raise: la excepcion del primer consumidor que haya fallado
+        """
+        for consumer in self.consumers:
+            consumer.raiseError()
+        for consumer in self.consumers:
+            consumer.offer(point)
+
+    def close(self, raiseErrors=True):
+        """
+        Espera a que los consumidores terminen (los que no tienen perdidas hasta el ultimo punto) y cierra el
+        fichero de resultados.\n
+        :param raiseErrors: True --> despues de cerrarlos todos se lanza la excepcion del primer consumidor que haya
+        fallado (False al cerrar despues de otro error)
+        """
+        for consumer in self.consumers:
+            closeTimeout = None if consumer.policy in (POLICY_SYNC, POLICY_LOSSLESS) else self.lossyCloseTimeout
+            if not consumer.close(closeTimeout):
+                print(colored("Point consumer " + consumer.name + " did not stop, abandoning its thread", "yellow"))
+        if raiseErrors:
+            for consumer in self.consumers:
+                consumer.raiseError()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live client for the points published by a sweep")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    with socket.create_connection((args.host, args.port)) as connection:
+        for rawLine in connection.makefile("r", encoding="utf-8"):
+            livePoint = json.loads(rawLine)
+            print("%5d %12.3f V %14.6e A%s" % (livePoint["index"], livePoint["voltage"], livePoint["current"],
+                                              "  OVERFLOW" if livePoint["overflow"] else ""))
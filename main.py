@@ -3,25 +3,71 @@
 
 import os
 
-os.system('color')
+if os.name == 'nt':
+    os.system('color')
 
-from time import sleep
 import time
 
+import numpy as np
 import pyvisa
 
 from termcolor import colored
-from fileUtilities import readConfigFile
+from sweepConfig import SweepConfig, parseBoolean, linearSetpoints
+from voltageSettling import RampSettlingPredictor
+from concurrentInstrumentIO import InstrumentWorker, registerOutputInterlock, getOutputInterlock
+from adaptiveStepping import AdaptiveStepController, SWEEP_ADAPTIVE, SWEEP_LINEAR
+from resultsWriter import openResultsWriter
+from sweepCheckpoint import SweepCheckpoint, loadCheckpoint, sweepConfigHash, validateResume, \
+    validateInstrumentSettings
+from currentStatistics import BreakdownDetector
+from hvSourceDriver import hvSourceDriver
+from livePoints import PointBus, SweepPoint, ResultsFileConsumer, ConsoleConsumer, SocketPublisher
+# sleep de gpibTrace: time.sleep que ademas cuenta las esperas deliberadas cuando hay una traza activa
+from gpibTrace import sleep, recordRetry, tracePhase, tracedPhase, traceInstrument, traceRun, \
+    PHASE_INIT, PHASE_SETTLE, PHASE_ACQUIRE, PHASE_LOG, PHASE_SHUTDOWN
 
 # pyvisa.log_to_screen()
 
 voltageStabilizationTimeout = 10  # in s
 HVSourceSettingOFFTimeout = 60  # in s
 
+# Sincronizacion con el K2400:
+#   SYNC_DELAY --> esperas fijas despues de cada comando (comportamiento original)
+#   SYNC_OPC   --> sin esperas, se espera a que el instrumento termine con *OPC?
+#   SYNC_SRQ   --> sin esperas, *OPC + serial poll del status byte (ESB) y MAV antes de cada lectura
+# La fuente HPP no implementa IEEE 488.2 (*OPC?, *ESE...), con ella se mantienen siempre las esperas fijas.
+SYNC_DELAY = "delay"
+SYNC_OPC = "opc"
+SYNC_SRQ = "srq"
+synchronizationMode = SYNC_OPC
+synchronizationTimeout = 30  # in s
+serialPollPeriod = 0.002  # in s
 
-def getInstruments(k2400_gpibAddress, hvSource_gpibAddress):
+# Con estabilizacion predictiva (RampSettlingPredictor) la salida se confirma leyendola dentro de rango,
+# no hace falta el margen de seguridad de 1s de la estabilizacion clasica
+predictiveSettlingLastDelay = 0.2  # in s
+
+# Acceso concurrente a la fuente HV y al K2400 dentro de cada punto del sweep (un hilo por instrumento)
+concurrentInstrumentIO = True
+
+# IEEE 488.2 status byte bits
+STB_MAV = 0x10  # message available
+STB_ESB = 0x20  # event status bit (*ESE enabled events, we enable only OPC)
+
+
+class SweepAbortedError(RuntimeError):
+    """
+    El sweep se ha parado desde fuera (stopEvent de start_process, p.ej. Ctrl+C en multiStationRunner).
+    """
+    pass
+
+
+@tracedPhase(PHASE_INIT)
+def getInstruments(k2400_gpibAddress, hvSource_gpibAddress, resourceManager=None, gpibBoard=0):
     delay = 0.1
-    rm = pyvisa.ResourceManager()
+    k2400Delay = delay if synchronizationMode == SYNC_DELAY else 0
+    # resourceManager permite usar otro backend (p.ej. instrumentSimulator.SimulatedResourceManager)
+    rm = resourceManager if resourceManager is not None else pyvisa.ResourceManager()
 
     l_resources = rm.list_resources()
 
@@ -31,22 +77,47 @@ def getInstruments(k2400_gpibAddress, hvSource_gpibAddress):
     hv_source = None
     k2400 = None
 
-    k2400 = rm.open_resource("GPIB0::" + str(k2400_gpibAddress) + "::INSTR", send_end=True)
+    # TracedInstrument: la E/S de cada instrumento queda registrada cuando hay una traza activa (gpibTrace.py)
+    k2400 = traceInstrument(rm.open_resource("GPIB" + str(gpibBoard) + "::" + str(k2400_gpibAddress) + "::INSTR",
+                                             send_end=True))
     k2400.timeout = 25000  # si configuramos el k2400 con filtro y nplcs altos, necesitaremos tiempos de timeout altos tambien
     # sleep(delay)
 
-    sendCommandToInstrument(k2400, "*IDN?", "", 0, delay)
-    response = k2400.read_raw()  # type(response) =--> bytes
-    decoded_response = response.decode(encoding='ascii', errors='ignore')
-    print(decoded_response)
-
-    hv_source = rm.open_resource("GPIB0::" + str(hvSource_gpibAddress) + "::INSTR", send_end=True)
+    # la identificacion se guarda en la sesion: con una sesion persistente (instrumentDaemon.py) solo se pregunta
+    # la primera vez
+    identification = getattr(k2400, "identification", None)
+    if identification is None:
+        sendCommandToInstrument(k2400, "*IDN?", "", 0, k2400Delay)
+        response = readInstrumentResponse(k2400)  # type(response) =--> bytes
+        decoded_response = response.decode(encoding='ascii', errors='ignore')
+        print(decoded_response)
+        identification = decoded_response.strip()
+        k2400.identification = identification
+        # query con la que el daemon comprueba la sesion cuando no esta prestada
+        k2400.healthQuery = "*IDN?"
+    instrumentIdentification[k2400.resource_name] = identification
+
+    if synchronizationMode == SYNC_SRQ:
+        # el bit OPC debe estar habilitado antes del primer waitForOperationComplete
+        sendCommandToInstrument(k2400, "*ESE 1", "", 0, 0)
+
+    hv_source = traceInstrument(rm.open_resource("GPIB" + str(gpibBoard) + "::" + str(hvSource_gpibAddress) +
+                                                 "::INSTR", send_end=True))
     # sleep(delay)
 
-    sendCommandToInstrument(hv_source, "ID", "", 0, delay)
-    response = hv_source.read_raw()  # type(response) =--> bytes
-    decoded_response = response.decode(encoding='ascii', errors='ignore')
-    print(decoded_response)
+    identification = getattr(hv_source, "identification", None)
+    if identification is None:
+        sendCommandToInstrument(hv_source, "ID", "", 0, delay)
+        response = hv_source.read_raw()  # type(response) =--> bytes
+        decoded_response = response.decode(encoding='ascii', errors='ignore')
+        print(decoded_response)
+        identification = decoded_response.strip("\x00\r\n ")
+        hv_source.identification = identification
+        hv_source.healthQuery = "ID"
+    instrumentIdentification[hv_source.resource_name] = identification
+
+    # reglas de seguridad entre la pareja (ver concurrentInstrumentIO.OutputInterlock)
+    registerOutputInterlock(k2400, hv_source)
 
     return k2400, hv_source
 
@@ -57,70 +128,187 @@ def sendCommandToInstrument(instrument, command, terminator, delayBefore, delayA
     sleep(delayAfter)
 
 
+def serialPollUntil(instrument, mask, timeout=None):
+    """
+    Hace serial poll del status byte del instrumento hasta que alguno de los bits de mask se active.\n
+    :param instrument: pyvisa.resource.resource
+    :param mask: int con los bits del status byte a esperar (p.ej. STB_MAV, STB_ESB)
+    :param timeout: Tiempo maximo de espera. Seconds (None --> synchronizationTimeout)
+    :return: int con el ultimo status byte leido
+    """
+    timeout = synchronizationTimeout if timeout is None else timeout
+    deadTime = time.time() + timeout
+
+    while True:
+        status = instrument.read_stb()
+        if status & mask:
+            return status
+        if time.time() >= deadTime:
+            raise TimeoutError("Serial poll timeout on " + str(instrument.resource_name) +
+                               " waiting for status bits " + hex(mask))
+        sleep(serialPollPeriod)
+
+
+def waitForOperationComplete(instrument, mode=None, timeout=None):
+    """
+    Espera a que el instrumento (IEEE 488.2) termine todas las operaciones pendientes.\n
+    SYNC_OPC --> *OPC? y lectura de la respuesta.
+    SYNC_SRQ --> *OPC, serial poll hasta ESB (requiere *ESE 1) y *ESR? para limpiar el registro de eventos.
+    SYNC_DELAY --> no hace nada, la espera ya se ha hecho con los delays fijos.
+    """
+    mode = synchronizationMode if mode is None else mode
+
+    if mode == SYNC_OPC:
+        sendCommandToInstrument(instrument, "*OPC?", "", 0, 0)
+        instrument.read_raw()
+    elif mode == SYNC_SRQ:
+        sendCommandToInstrument(instrument, "*OPC", "", 0, 0)
+        serialPollUntil(instrument, STB_ESB, timeout)
+        sendCommandToInstrument(instrument, "*ESR?", "", 0, 0)
+        instrument.read_raw()
+
+
+def readInstrumentResponse(instrument, mode=None, timeout=None):
+    """
+    Lee la respuesta a una query de un instrumento IEEE 488.2. En modo SYNC_SRQ no se bloquea el bus con una
+    lectura larga (p.ej. mientras el K2400 integra) sino que se espera al bit MAV por serial poll.
+    """
+    mode = synchronizationMode if mode is None else mode
+
+    if mode == SYNC_SRQ:
+        serialPollUntil(instrument, STB_MAV, timeout)
+    return instrument.read_raw()
+
+
 def printMessage(message, headerStr, footerStr):
     print(colored(len(message) * headerStr, "magenta"))
     print(colored(message, "magenta"))
     print(colored(len(message) * footerStr, "magenta"))
 
 
-def initializeK2400(k2400, compliance, nplcs, range):
-    delay = 0.25  # seconds
+# Respuesta a *IDN? / ID de cada instrumento abierto (clave: resource_name), se guarda en la cabecera de resultados
+instrumentIdentification = {}
+
+# Ultima configuracion aplicada a cada instrumento (clave: resource_name). Permite que una re-inicializacion
+# (p.ej. sweeps consecutivos con el mismo process_config_file.json) solo envie los ajustes que han cambiado.
+appliedInstrumentSettings = {}
+
+# Ajustes del K2400 que dependen de la configuracion del proceso y comando que aplica cada uno
+K2400_SETTING_COMMANDS = {"nplc": ":SENS:CURR:NPLC {}",
+                          "averageControl": ":SENS:AVER:TCON {}",
+                          "averageCount": ":SENS:AVER:COUN {}",
+                          "average": ":SENS:AVER {}",
+                          "range": ":SENS:CURR:RANG {}",  # AMPS
+                          "compliance": ":SENS:CURR:PROT {}",  # AMPS
+                          # trigger model / buffer / formato de datos para la adquisicion en rafaga
+                          "dataFormat": ":FORM:DATA {}",
+                          "byteOrder": ":FORM:BORD {}",
+                          "triggerCount": ":TRIG:COUN {}",
+                          "bufferPoints": ":TRAC:FEED:CONT NEV;:TRAC:CLE;:TRAC:POIN {}",
+                          "bufferFeed": ":TRAC:FEED {}"}
+
+# Ajustes de la fuente HPP y comando que aplica cada uno
+HV_SOURCE_SETTING_COMMANDS = {"currentLimit": "I,{}mA",
+                              "ramp": "RAMP,{}V/s",
+                              "kill": "KILL,{}"}
+
+
+def sendCommandsToInstrument(instrument, commands, terminator, delayBefore, delayAfter):
+    """
+    Envia varios comandos SCPI en un unico mensaje compuesto ("cmd1;cmd2;...") --> una sola transaccion GPIB.
+    Los comandos deben empezar por ':' o '*' (ruta absoluta) para que el separador ';' no cambie su significado.
+    """
+    if commands:
+        sendCommandToInstrument(instrument, ";".join(commands), terminator, delayBefore, delayAfter)
+
+
+def invalidateInstrumentSettings(instrument):
+    """
+    Olvida la configuracion aplicada al instrumento: la siguiente inicializacion sera completa (con *RST).
+    """
+    appliedInstrumentSettings.pop(instrument.resource_name, None)
+
+
+def changedInstrumentSettings(instrument, settings):
+    """
+    Devuelve la lista de claves de settings cuyo valor no coincide con el ultimo aplicado al instrumento
+    o None si no se conoce el estado del instrumento (nunca inicializado o invalidado).
+    """
+    previousSettings = appliedInstrumentSettings.get(instrument.resource_name)
+    if previousSettings is None:
+        return None
+    return [key for key, value in settings.items() if previousSettings.get(key) != value]
+
+
+@tracedPhase(PHASE_INIT)
+def initializeK2400(k2400, compliance, nplcs, range, forceReset=False, readingsPerPoint=1):
+    # con sincronizacion por eventos no hacen falta esperas fijas, el K2400 procesa los comandos en orden
+    # y al final (y despues del *RST) esperamos a que haya terminado
+    delay = 0.25 if synchronizationMode == SYNC_DELAY else 0  # seconds
     term = ""
 
     message = "Initializing the K2400 as Ampermeter....."
     printMessage(message, "*", "*")
 
-    sendCommandToInstrument(k2400, "*CLS", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, "*SRE 4", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, "*ESE 0", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":STAT:OPER:ENAB 0", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":STAT:MEAS:ENAB 0", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":STAT:QUES:ENAB 0", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":FORM:SREG ASC", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, "*RST", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SYST:BEEP:STAT ON", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SOUR:FUNC VOLT", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SOUR:VOLT:LEV 0", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SOUR:VOLT:RANG 0.2", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":FORM:ELEM VOLT, CURR, TIME", term, 0, delay)
-    sleep(delay)
-    # sendCommandToInstrument(k2400, ":SENS:FUNC:CONC ON", term, 0, delay)
-    # sleep(delay)
-    sendCommandToInstrument(k2400, ":SENS:FUNC:OFF:ALL", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SENS:FUNC:ON 'CURR'", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SENS:CURR:NPLC " + str(int(nplcs)), term, 0, delay)
-    sleep(delay)
-
-    sendCommandToInstrument(k2400, ":SENSe:AVERage:TCONtrol REPeat", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SENSe:AVERage:COUNt 8", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SENSe:AVERage ON", term, 0, delay)
-    sleep(delay)
-
-    sendCommandToInstrument(k2400, ":SENS:CURR:RANG " + "{:.8f}".format(range), term, 0, delay)  # AMPS
-    sleep(delay)
-    sendCommandToInstrument(k2400, ":SENS:CURR:PROT " + "{:.8f}".format(compliance), term, 0, delay)  # AMPS
-    sleep(delay)
-
-    sendCommandToInstrument(k2400, ":ROUTE:TERM REAR", term, 0, delay)
-    sleep(delay)
+    settings = {"nplc": "%g" % nplcs,  # el K2400 acepta de 0.01 a 10 NPLC (int() mandaria 0.5 como 0)
+                "averageControl": "REP",
+                "averageCount": "8",
+                "average": "ON",
+                "range": "{:.8f}".format(range),
+                "compliance": "{:.8f}".format(compliance),
+                # con readingsPerPoint > 1 cada :INIT toma readingsPerPoint lecturas que se guardan en el buffer
+                # (TRAC) y se transfieren en binario (SREAL, little endian) con :TRAC:DATA?
+                "dataFormat": "SREAL" if readingsPerPoint > 1 else "ASC",
+                "byteOrder": "SWAP",
+                "triggerCount": str(int(readingsPerPoint)),
+                "bufferPoints": str(int(readingsPerPoint)),
+                "bufferFeed": "SENS"}
+
+    changedSettings = None if forceReset else changedInstrumentSettings(k2400, settings)
+    # mientras no termine la inicializacion el estado del instrumento es desconocido
+    invalidateInstrumentSettings(k2400)
+
+    if changedSettings is None:
+        # estado desconocido: configuracion completa partiendo de *RST
+        sendCommandsToInstrument(k2400, ["*CLS",
+                                         "*SRE 4",
+                                         # en modo SYNC_SRQ necesitamos el bit OPC habilitado para que *OPC
+                                         # active ESB en el status byte
+                                         "*ESE " + ("1" if synchronizationMode == SYNC_SRQ else "0"),
+                                         ":STAT:OPER:ENAB 0",
+                                         ":STAT:MEAS:ENAB 0",
+                                         ":STAT:QUES:ENAB 0",
+                                         ":FORM:SREG ASC"], term, 0, delay)
+        # *RST apaga la salida del amperimetro: solo si la fuente HV esta confirmada en 0V
+        interlock = getOutputInterlock(k2400)
+        if interlock is not None:
+            interlock.checkAmmeterCanGoOff("*RST")
+        sendCommandToInstrument(k2400, "*RST", term, 0, delay)
+        waitForOperationComplete(k2400)
+        sendCommandsToInstrument(k2400, [":SYST:BEEP:STAT ON",
+                                         ":SOUR:FUNC VOLT",
+                                         ":SOUR:VOLT:LEV 0",
+                                         ":SOUR:VOLT:RANG 0.2",
+                                         ":FORM:ELEM VOLT, CURR, TIME",
+                                         # ":SENS:FUNC:CONC ON",
+                                         ":SENS:FUNC:OFF:ALL",
+                                         ":SENS:FUNC:ON 'CURR'",
+                                         ":ROUTE:TERM REAR"], term, 0, delay)
+        changedSettings = list(settings)
+    else:
+        print(colored("K2400 already configured, settings to update --> " + str(changedSettings), "yellow"))
+
+    sendCommandsToInstrument(k2400, [K2400_SETTING_COMMANDS[key].format(settings[key]) for key in changedSettings],
+                             term, 0, delay)
+
     # K2400 ON
     sendCommandToInstrument(k2400, ":OUTP:STAT ON", term, 0, delay)
+    waitForOperationComplete(k2400)
+    interlock = getOutputInterlock(k2400)
+    if interlock is not None:
+        interlock.ammeterOutputTurnedOn()
+
+    appliedInstrumentSettings[k2400.resource_name] = settings
 
     # :SENSe: AVERage:TCONtrol < type >
     # :SENSe: AVERage:COUNt < n >
@@ -130,70 +318,112 @@ def initializeK2400(k2400, compliance, nplcs, range):
     printMessage(message, "*", "*")
 
 
-def initializeHVSource(hv_source, rampVoltage, outputCurrentLimit, enableKill):
-    delay = 0.25
+def decodeBinaryBlock(response, valuesPerReading):
+    """
+    Decodifica un bloque IEEE 488.2 de floats de 32 bits little endian (:FORM:DATA SREAL, :FORM:BORD SWAP)
+    tanto en formato de longitud indefinida ("#0...") como definida ("#<n><length>...").\n
+    :param response: bytes leidos del instrumento
+    :param valuesPerReading: int con el numero de elementos (:FORM:ELEM) de cada lectura
+    :return: numpy.ndarray de shape (lecturas, valuesPerReading)
+    """
+    if response[:1] != b"#":
+        raise ValueError("Not an IEEE 488.2 binary block: " + str(response[:16]))
+
+    digits = int(response[1:2])
+    if digits == 0:
+        data = response[2:]
+        data = data[:len(data) - len(data) % 4]  # fuera el terminador
+    else:
+        length = int(response[2:2 + digits])
+        data = response[2 + digits:2 + digits + length]
+
+    values = np.frombuffer(data, dtype="<f4")
+    return values[:len(values) - len(values) % valuesPerReading].reshape(-1, valuesPerReading)
+
+
+def acquireK2400Burst(k2400, readingsPerPoint):
+    """
+    Toma readingsPerPoint lecturas en una sola transaccion con el trigger model del K2400 (ver initializeK2400)
+    y devuelve las corrientes leidas.\n
+    :param k2400: pyvisa.resource.resource
+    :param readingsPerPoint: int con el numero de lecturas (:TRIG:COUN / :TRAC:POIN)
+    :return: numpy.ndarray con las corrientes en A (float64)
+    """
     term = ""
 
-    message = "Initializing the HV Source....."
-    printMessage(message, "*", "*")
+    # buffer vacio, listo para llenarse con las siguientes lecturas, y disparo
+    sendCommandsToInstrument(k2400, [":TRAC:CLE", ":TRAC:FEED:CONT NEXT", ":INIT"], term, 0, 0)
+    # :TRAC:DATA? no espera a que el buffer este lleno, asi que aqui siempre sincronizamos con *OPC
+    # (tambien en modo SYNC_DELAY, no hay un delay fijo que sirva para cualquier NPLC / numero de lecturas)
+    waitForOperationComplete(k2400, SYNC_SRQ if synchronizationMode == SYNC_SRQ else SYNC_OPC)
+    sendCommandToInstrument(k2400, ":TRAC:DATA?", term, 0, 0)
+    readings = decodeBinaryBlock(readInstrumentResponse(k2400), 3)  # :FORM:ELEM VOLT, CURR, TIME
 
+    return readings[:, 1].astype(np.float64)
+
+
+def hvSourceSettings(rampVoltage, outputCurrentLimit, enableKill):
     outputCurrentLimitInMilliamps = int(outputCurrentLimit * 1000)
 
-    sendCommandToInstrument(hv_source, "*RST", term, 0, delay)
-    sleep(delay)
-    sendCommandToInstrument(hv_source, "*CLS", term, 0, delay)
-    sleep(delay)
-    # set output current limit
-    sendCommandToInstrument(hv_source, "I," + str(outputCurrentLimitInMilliamps) + "mA", term, 0, delay)
-    sleep(delay)
-    # set ramp
-    sendCommandToInstrument(hv_source, "RAMP," + str(int(rampVoltage)) + "V/s", term, 0, delay)
-    sleep(delay)
-    # set kill enable
-    sendCommandToInstrument(hv_source, "KILL," + 'EN' if enableKill else 'DIS', term, 0, delay)
-    sleep(delay)
-    # Setting output voltage to zero
-    setHVOutputVoltage(hv_source, 0, 60)
+    return {"currentLimit": str(outputCurrentLimitInMilliamps),  # set output current limit
+            "ramp": str(int(rampVoltage)),  # set ramp
+            "kill": "EN" if parseBoolean(enableKill) else "DIS"}  # set kill enable (enableKill puede venir como "True")
 
-    message = "Initializing done!!!"
+
+@tracedPhase(PHASE_INIT)
+def initializeHVSource(hv_source, rampVoltage, outputCurrentLimit, enableKill, forceReset=False):
+    delay = 0.25
+
+    message = "Initializing the HV Source....."
     printMessage(message, "*", "*")
 
+    settings = hvSourceSettings(rampVoltage, outputCurrentLimit, enableKill)
 
-def readVoltageFromHVSource(hv_source, delay=0.5):
-    term = ""
-    correctResponse = False
-    voltage = 0.0
+    changedSettings = None if forceReset else changedInstrumentSettings(hv_source, settings)
+    invalidateInstrumentSettings(hv_source)
 
-    while not correctResponse:
+    driver = hvSourceDriver(hv_source)
+    if changedSettings is None:
+        driver.write("*RST", delay)
+        sleep(delay)
+        driver.write("*CLS", delay)
+        sleep(delay)
+        changedSettings = list(settings)
+    else:
+        print(colored("HV Source already configured, settings to update --> " + str(changedSettings), "yellow"))
 
-        sendCommandToInstrument(hv_source, "STATUS,MU", term, 0, delay)
-        response = hv_source.read_raw()  # response should be in format "UM, RANGE=3000V, VALUE=2.458kV\x00"
-        decoded_response = response.decode(encoding='ascii', errors='ignore')
-        decoded_response = decoded_response.split(", ")
-        print(decoded_response)
+    # la fuente HPP no acepta mensajes compuestos, un comando por transaccion
+    for key in changedSettings:
+        if driver.write(HV_SOURCE_SETTING_COMMANDS[key].format(settings[key]), delay):
+            sleep(delay)
 
-        if len(decoded_response) == 3:
-            correctResponse = True
-            voltageString = decoded_response[2][:-1]
-            # de esto "UM, RANGE=3000V, VALUE=2.458kV\x00"
-            # debemos obtener esto otro 2.458
-            voltageString = voltageString.removeprefix("VALUE=")
-            voltageString = voltageString.removesuffix("kV")
-            voltage = float(voltageString) * 1000
-            print(colored("Lectura de voltage correcta en la fuente de HV. Voltage = " + str(voltage) + "V", "green"))
+    # Setting output voltage to zero
+    setHVOutputVoltage(hv_source, 0, 60)
+
+    appliedInstrumentSettings[hv_source.resource_name] = settings
+
+    message = "Initializing done!!!"
+    printMessage(message, "*", "*")
 
-        else:
-            # la lectura del voltage ha fallado, esperamos y volvemos a pedir
-            print(colored(
-                "Fallo en la lectura de voltage a la fuente de HV. Esperamos un tiempo y solicitamos de nuevo...",
-                "red"))
-            sleep(1)
 
+@tracedPhase(PHASE_ACQUIRE)
+def readVoltageFromHVSource(hv_source, delay=0.5, maxAge=None):
+    """
+    Lee la tension a la salida de la fuente (STATUS,MU) con hvSourceDriver.HPP120: respuesta interpretada con
+    unidades, reintentos acotados y la ultima lectura reutilizada si es mas reciente que maxAge.\n
+    :param hv_source: pyvisa.resource.resorce como la fuente de alimentacion
+    :param delay: Espera entre la query y la lectura de la respuesta. Seconds
+    :param maxAge: Edad maxima de una lectura anterior para no preguntar a la fuente. Seconds
+    (None --> readbackTTL del driver, 0 --> siempre se pregunta)
+    :return: float con la tension. Volts
+    """
+    voltage = hvSourceDriver(hv_source).readVoltage(maxAge, delay)
+    print(colored("Lectura de voltage correcta en la fuente de HV. Voltage = " + str(voltage) + "V", "green"))
     return voltage
 
 
 def waitForVoltageStabilization(hv_source, desiredVoltage, maxAbsolutePermissibleError, checkPeriod, lastDelay,
-                                voltageStabilizationTimeout=10):
+                                voltageStabilizationTimeout=10, predictor=None, setpointTime=None):
     """
     Funcion sincrona cuya funcion basica es esperar a que la salida de tension de una fuente de alimentacion (en nuestro caso una hv_voltage)
     entre dentro del rango de error permisible. Una vez la salida se encuentra dentro de dicho rango de error la funcion retorna True.
@@ -209,6 +439,10 @@ def waitForVoltageStabilization(hv_source, desiredVoltage, maxAbsolutePermissibl
         lastDelay (float): Tiempo de espera de seguridad una vez que la salida de la fuente se encuentra dentro del rango. Seconds
         (desiredVoltage-maxAbsolutePermissibleError, desiredVoltage+maxAbsolutePermissibleError)
         voltageStabilizationTimeout (long): Tiempo máximo dado a la funcion para chequear la salida de la fuente de alimentacion. Seconds
+        predictor (voltageSettling.RampSettlingPredictor): Si se da, en lugar de leer cada checkPeriod se duerme hasta la
+        llegada prevista segun la rampa y se lee con periodos cada vez mas cortos. El timeout se amplia si la
+        rampa prevista es mas larga. El predictor aprende el tiempo observado.
+        setpointTime (float): Instante (time.time()) en que se envio el setpoint. Seconds. Por defecto ahora.
     Returns:
         True si el valor leido a la salida de la fuente de alimentacion se encuentra dentro del rango
         (desiredVoltage-maxAbsolutePermissibleError, desiredVoltage+maxAbsolutePermissibleError) \n
@@ -217,11 +451,16 @@ def waitForVoltageStabilization(hv_source, desiredVoltage, maxAbsolutePermissibl
         de la funcion supera o iguala el valor dado por el voltageStabilizationTimeout
     """
 
+    permissibleRange = (desiredVoltage - maxAbsolutePermissibleError, desiredVoltage + maxAbsolutePermissibleError)
+
+    if predictor is not None:
+        return waitForPredictedVoltageStabilization(hv_source, desiredVoltage, permissibleRange, lastDelay,
+                                                    voltageStabilizationTimeout, predictor,
+                                                    time.time() if setpointTime is None else setpointTime)
+
     initialTime = time.time() * 1000
     deadTime = initialTime + voltageStabilizationTimeout * 1000
 
-    permissibleRange = (desiredVoltage - maxAbsolutePermissibleError, desiredVoltage + maxAbsolutePermissibleError)
-
     while True:
         sleep(checkPeriod)
 
@@ -232,7 +471,7 @@ def waitForVoltageStabilization(hv_source, desiredVoltage, maxAbsolutePermissibl
 
         # si no se ha cumplido el timeout miramos la tension a la salida de la fuente y comprobamos si se encuentra
         # dentro del rango permitido
-        readedVoltage = readVoltageFromHVSource(hv_source)
+        readedVoltage = readVoltageFromHVSource(hv_source, maxAge=0)
         if permissibleRange[0] < readedVoltage < permissibleRange[1]:
             break
 
@@ -240,17 +479,74 @@ def waitForVoltageStabilization(hv_source, desiredVoltage, maxAbsolutePermissibl
     return True
 
 
-def getHVSourceStatus(hv_source):
-    delay = 1
-    term = ""
+def waitForPredictedVoltageStabilization(hv_source, desiredVoltage, permissibleRange, lastDelay,
+                                         voltageStabilizationTimeout, predictor, setpointTime):
+    """
+    Estabilizacion predictiva, ver waitForVoltageStabilization.
+    """
+    fromVoltage = predictor.lastSetpoint
+    predictedSettleTime = 0.0 if fromVoltage is None else predictor.predictSettleTime(fromVoltage, desiredVoltage)
+    deadTime = setpointTime + max(voltageStabilizationTimeout, 1.5 * predictedSettleTime + predictor.maxPollPeriod)
+
+    print(colored("Predicted settle time --> " + "{:.2f}".format(predictedSettleTime) + " s", "grey", "on_white"))
+    sleep(max(setpointTime + predictedSettleTime - time.time(), 0))
+
+    pollPeriods = predictor.pollPeriods()
+    firstCheck = True
+
+    while True:
+        readedVoltage = readVoltageFromHVSource(hv_source, maxAge=0)
+        if permissibleRange[0] < readedVoltage < permissibleRange[1]:
+            break
+
+        if time.time() >= deadTime:
+            # la proxima prediccion (si se reenvia el setpoint) parte de donde esta ahora la salida
+            predictor.lastSetpoint = readedVoltage
+            return False  # Se ha cumplido el timeout
+
+        # lo que le queda a la rampa segun la lectura, pero nunca mas que el periodo de polling (que va bajando)
+        firstCheck = False
+        sleep(max(min(predictor.remainingTime(readedVoltage, desiredVoltage), next(pollPeriods)),
+                  predictor.minPollPeriod))
+
+    if fromVoltage is None:
+        predictor.lastSetpoint = desiredVoltage
+    else:
+        predictor.learn(fromVoltage, desiredVoltage, time.time() - setpointTime, firstCheck)
 
-    sendCommandToInstrument(hv_source, "STATUS,DI", term, 0, delay)
-    response = hv_source.read_raw()
+    sleep(lastDelay)
+    return True
+
+
+def getHVSourceStatus(hv_source, maxAge=0):
+    """
+    :return: int con el registro de estado de la fuente (STATUS,DI), ver hvSourceDriver.decodeStatus. Formato y bits
+    solo comprobados con el banco simulado
+    """
+    return hvSourceDriver(hv_source).readStatus(maxAge)
+
+
+@tracedPhase(PHASE_SETTLE)
+def sendHVOutputVoltage(hv_source, targetVoltage):
+    """
+    Envia el setpoint a la fuente sin esperar a la estabilizacion (ver setHVOutputVoltage).\n
+    :param hv_source: pyvisa.resource.resorce como la fuente de alimentacion
+    :param targetVoltage: float con el voltage deseado a la salida de la fuente de alimentacion. Kv
+    :return: float con el instante (time.time()) en que se ha enviado el setpoint
+    """
+    if targetVoltage > 0:
+        interlock = getOutputInterlock(hv_source)
+        if interlock is not None:
+            interlock.checkHVCanBeApplied("U," + "{:.3f}".format(targetVoltage) + "kV")
 
-    return response
+    print(colored("Setting the H Source to --> " + "U," + "{:.3f}".format(targetVoltage) + "kV", "yellow"))
+    setpointTime = time.time()
+    hvSourceDriver(hv_source).write("U," + "{:.3f}".format(targetVoltage) + "kV", 0.5)
+    return setpointTime
 
 
-def setHVOutputVoltage(hv_source, targetVoltage, voltageStabilizationTimeout=10):
+@tracedPhase(PHASE_SETTLE)
+def setHVOutputVoltage(hv_source, targetVoltage, voltageStabilizationTimeout=10, predictor=None, setpointTime=None):
     """
     Funcion sincrona que permite settear una determinada tension (targetVoltage) en la fuente de alimentacion (hv_source) y
     espera a la estabiizacion de esta segun unos criterios definidos por un error, una frecuencia de actualizacion y un tiempo de timeout.\n
@@ -258,24 +554,80 @@ def setHVOutputVoltage(hv_source, targetVoltage, voltageStabilizationTimeout=10)
     :param voltage:   float con el voltage deseado a la salida de la fuente de alimentacion. Kv
     :param voltageStabilizationTimeout: Tiempo de espera que toma la funcion para comprobar qe la salida de
     la fuente de alimentacion ofrece el voltage deseado. Seconds
+    :param predictor: voltageSettling.RampSettlingPredictor para la estabilizacion predictiva (None --> polling cada 0.5s)
+    :param setpointTime: Si el setpoint ya se ha enviado con sendHVOutputVoltage, instante en que se envio.
+    Solo se espera a la estabilizacion (y se reenvia si salta el timeout)
     :return: None
     """
-    term = ""
     hvSource_OutputVoltageStabilization_Success = False
 
     while not hvSource_OutputVoltageStabilization_Success:
         # Actualizamos la tension en la fuente
-        print(colored("Setting the H Source to --> " + "U," + "{:.3f}".format(targetVoltage) + "kV", "yellow"))
-        sendCommandToInstrument(hv_source, "U," + "{:.3f}".format(targetVoltage) + "kV", term, 0, 0.5)
+        if setpointTime is None:
+            setpointTime = sendHVOutputVoltage(hv_source, targetVoltage)
         print(colored("Waiting for voltage stabilization...", "grey", "on_white"))
+        lastDelay = 1 if predictor is None else predictiveSettlingLastDelay
         hvSource_OutputVoltageStabilization_Success = waitForVoltageStabilization(hv_source, targetVoltage * 1000, 20,
-                                                                                  0.5, 1,
-                                                                                  voltageStabilizationTimeout)  # maxAbsolutePermissibleError is 10V
+                                                                                  0.5, lastDelay,
+                                                                                  voltageStabilizationTimeout,
+                                                                                  predictor,
+                                                                                  setpointTime)  # maxAbsolutePermissibleError is 10V
         if not hvSource_OutputVoltageStabilization_Success:
+            setpointTime = None
+            recordRetry(hv_source, "U," + "{:.3f}".format(targetVoltage) + "kV")
             print(colored(
                 "Voltage Stabilization WatchDog has raised an exception. Voltage stabilization is taking too much time...",
                 "red"))
 
+    interlock = getOutputInterlock(hv_source)
+    if interlock is not None:
+        interlock.hvSourceSettledAt(targetVoltage)
+
+
+@tracedPhase(PHASE_SHUTDOWN)
+def shutdownHVSource(hv_source, predictor=None):
+    """
+    Lleva la salida de la fuente a 0V y apaga la HV. El HV,OFF se envia aunque falle la bajada a 0V.\n
+    :param hv_source: pyvisa.resource.resorce como la fuente de alimentacion
+    :param predictor: voltageSettling.RampSettlingPredictor del sweep (None --> polling cada 0.5s)
+    :return: None
+    """
+    delay = 0.5
+
+    try:
+        # Setting output voltage to zero
+        setHVOutputVoltage(hv_source, 0, HVSourceSettingOFFTimeout, predictor)
+    finally:
+        # HV source off (siempre se envia, aunque el driver crea que ya esta apagada)
+        hvSourceDriver(hv_source).write("HV,OFF", delay, force=True)
+
+
+@tracedPhase(PHASE_ACQUIRE)
+def measureK2400Current(k2400, readingsPerPoint=1, delay=0):
+    """
+    Mide la corriente con el K2400 (modo amperimetro) con el signo invertido, positiva para la muestra.\n
+    :param k2400: pyvisa.resource.resource
+    :param readingsPerPoint: int con el numero de lecturas por punto (> 1 --> rafaga, ver acquireK2400Burst)
+    :param delay: Espera despues del :READ? (solo en modo SYNC_DELAY). Seconds
+    :return: (float con la corriente media en A, numpy.ndarray con todas las lecturas o None si readingsPerPoint == 1)
+    """
+    term = ""
+
+    # Al estar el smu en modo amperimetro, el signo de la corriente es negativo
+    # invertimos el signo de la corriente para trabajar mejor
+    if readingsPerPoint > 1:
+        ammeter_currents = -acquireK2400Burst(k2400, readingsPerPoint)
+        return float(ammeter_currents.mean()), ammeter_currents
+
+    sendCommandToInstrument(k2400, ":READ?", term, 0, delay)
+    ammeter_response = readInstrumentResponse(k2400)
+
+    ammeter_decoded_response = ammeter_response.decode(encoding='ascii', errors='ignore')
+    ammeter_decoded_response = ammeter_decoded_response[:-1]
+    ammeter_decoded_response = ammeter_decoded_response.split(",")
+
+    return -float(ammeter_decoded_response[1]), None
+
 
 def start_process(K2400_gpibAddress,
                   HVSource_gpibAddress,
@@ -289,148 +641,366 @@ def start_process(K2400_gpibAddress,
                   ammeterRange,
                   ammeterCompliance,
                   ammeterNPLCs,
-                  resultsFilePath):
+                  resultsFilePath,
+                  resourceManager=None,
+                  readingsPerPoint=1,
+                  gpibBoard=0,
+                  progressCallback=None,
+                  sweepMode=SWEEP_LINEAR,
+                  minStepVoltage=None,
+                  maxStepVoltage=None,
+                  maxPoints=None,
+                  resultsFormat="dat",
+                  trace=False,
+                  livePort=None,
+                  resume=False,
+                  hvSourceVoltage=None,
+                  rampDown=True,
+                  stopEvent=None,
+                  breakdownCurrentFloor=None):
+    # initialVoltage > finalVoltage --> sweep de bajada
+    # hvSourceVoltage: tension (V) a la que sigue encendida la fuente HV con esta misma configuracion porque el sweep
+    #   anterior termino con rampDown=False (sweepJobQueue.py). None --> estado desconocido: se inicializa a 0V
+    # rampDown=False --> al terminar (sin error) la fuente se deja encendida en el ultimo setpoint
+    # stopEvent: threading.Event que se comprueba antes de cada punto. Activado --> la fuente se baja a 0V y se lanza
+    #   SweepAbortedError (el sweep se puede reanudar desde su checkpoint)
+    # breakdownCurrentFloor: corriente (A) por debajo de la cual la deteccion de ruptura la toma como ruido. None -->
+    #   resolucion de ammeterRange (currentStatistics.rangeCurrentFloor)
+    # Devuelve la tension (V) en la que queda la fuente HV, o None si el sweep ha parado por ruptura / overflow (la
+    #   fuente se ha apagado aunque rampDown=False)
+    if trace:
+        # misma llamada dentro de una traza de la E/S GPIB --> <resultsFilePath>.trace.npz / .trace.json
+        parameters = dict(locals())
+        parameters["trace"] = False
+        with traceRun(resultsFilePath + ".trace"):
+            return start_process(**parameters)
+
     delay = 0.5  # in s
+    k2400Delay = delay if synchronizationMode == SYNC_DELAY else 0
     term = ""
 
-    k2400, hv_source = getInstruments(K2400_gpibAddress, HVSource_gpibAddress)
-
-    # !!!!!!!!!MUY IMPORTANTE. PARA PROTEGER LA TENSION QUE VEN LOS BORNES DEL AMPERIMETRO!!!!!!!!!!!!!!
-    # SIEMPRE AMMETER ON ANTES DE APLICAR VOLTAJE O INICIALIZAR LA FUENTE QUE PUEDE TENER VOLTAJE ALTO ANTES DE EMPEZAR EL PROCESO
-
-    # K2400 ON
-    sendCommandToInstrument(k2400, ":OUTP:STAT ON", term, 0, delay)
-
-    # importante inicializar primero la fuente de voltage para bajar a cero antes de inicializar el amperimetro
-    initializeHVSource(hv_source, rampVoltage, outputCurrentLimit, enableKill)
-    initializeK2400(k2400, ammeterCompliance, ammeterNPLCs, ammeterRange)
-
-    # #calculo del step voltage
-    step_voltage = (finalVoltage - initialVoltage) / pointsVoltage
-    next_voltage = initialVoltage
-
-    finalProcess = False
-
-    # HV source ON
-    sendCommandToInstrument(hv_source, "HV,ON", term, 0, delay)
-
-    # Here you have to write to file
-    f = open(resultsFilePath, "a")
-    f.truncate(0)
-
-    # mean_current calculation
-    previous_current = 0.0
-    sum_current = 0.0
-    mean_current = 0.0
-    n_steps = 0
-
-    # current threshold in percent of current value
-    maxCurrentDelta_inTimesOfPreviousCurrent = 100 #20
-    is_current_overflow = False
-
-    # file format
-    sep = "\t"
-
-    while not finalProcess:
-
-        if next_voltage > finalVoltage or is_current_overflow:
-            finalProcess = True
-
+    sweepConfig = {"gpibBoard": gpibBoard,
+                   "K2400_gpibAddress": K2400_gpibAddress,
+                   "HVSource_gpibAddress": HVSource_gpibAddress,
+                   "initialVoltage": initialVoltage,
+                   "finalVoltage": finalVoltage,
+                   "pointsVoltage": pointsVoltage,
+                   "measureDelay_ms": measureDelay_ms,
+                   "rampVoltage": rampVoltage,
+                   "outputCurrentLimit": outputCurrentLimit,
+                   "enableKill": enableKill,
+                   "ammeterRange": ammeterRange,
+                   "ammeterCompliance": ammeterCompliance,
+                   "ammeterNPLCs": ammeterNPLCs,
+                   "readingsPerPoint": readingsPerPoint,
+                   "sweepMode": sweepMode,
+                   "minStepVoltage": minStepVoltage,
+                   "maxStepVoltage": maxStepVoltage,
+                   "maxPoints": maxPoints,
+                   "breakdownCurrentFloor": breakdownCurrentFloor}
+    configHash = sweepConfigHash(sweepConfig)
+
+    # resume --> se sigue el sweep interrumpido de resultsFilePath a partir de su checkpoint (sweepCheckpoint.py)
+    resumeCheckpoint = None
+    if resume:
+        resumeCheckpoint = loadCheckpoint(resultsFilePath)
+        if resumeCheckpoint is None:
+            print(colored("No checkpoint for " + resultsFilePath + ", starting the sweep from the beginning", "yellow"))
+        elif resumeCheckpoint["complete"]:
+            print(colored("The sweep of " + resultsFilePath + " is already complete, nothing to resume", "yellow"))
+            return
         else:
-
-            setHVOutputVoltage(hv_source, next_voltage / 1000, voltageStabilizationTimeout)
-
-            print(
-                colored("Waiting for measure delay = " + str(measureDelay_ms / 1000) + " seconds", "grey", "on_white"))
-            sleep(measureDelay_ms / 1000)
-
-            # Una vez el voltaje de la fuente es estable a su salida podremos considerar que actualvoltage = nextvoltage
-            actual_voltage = next_voltage
-
-            # Here you have to measure the hv_source volatge
-            hv_source_voltage = readVoltageFromHVSource(hv_source)
-            print(colored("Voltage source --> " + str(hv_source_voltage) + "V", "cyan"))
-            # Here you have to measure the current of the k2400
-            sendCommandToInstrument(k2400, ":READ?", term, 0, 0.5)
-            ammeter_response = k2400.read_raw()
-
-            ammeter_decoded_response = ammeter_response.decode(encoding='ascii', errors='ignore')
-            ammeter_decoded_response = ammeter_decoded_response[:-1]
-            ammeter_decoded_response = ammeter_decoded_response.split(",")
-
-            ammeter_current = float(ammeter_decoded_response[1])
-
-            #Al estar el smu en modo amperimetro, el signo de la corriente es negativo
-            #invertimos el signo de la corriente para trabajar mejor
-            ammeter_current = -ammeter_current
-
-            if n_steps == 0:
-                previous_current = ammeter_current
-
-            print(colored("Previous Current --> " + str(previous_current) + "A", "cyan"))
-            print(colored("Ammeter Current --> " + str(ammeter_current) + "A", "cyan"))
-            print(colored("Current Delta --> " + str(ammeter_current - previous_current) + "A", "cyan"))
-            print(colored(
-                "Max Current Delta --> " + str(abs(maxCurrentDelta_inTimesOfPreviousCurrent * previous_current)) + "A",
-                "cyan"))
-
-            # Here you have to write to file
-            f.write(str(hv_source_voltage) + sep + str(abs(ammeter_current)) + "\n")
-            f.flush()
-
-            # check if the ammeter_current overflows
-
-            current_delta = ammeter_current - previous_current
-
-            if current_delta > 0:
-                if abs(current_delta) > abs(maxCurrentDelta_inTimesOfPreviousCurrent * previous_current):
-                    # ammeter_currrent overflow
+            validateResume(resumeCheckpoint, configHash, resultsFormat)
+
+    k2400, hv_source = getInstruments(K2400_gpibAddress, HVSource_gpibAddress, resourceManager, gpibBoard)
+    # a partir de aqui cualquier error (tambien durante la preparacion: fichero de resultados, checkpoint, socket
+    # de livePort...) baja la fuente a 0V antes de propagarse. En un sweep encadenado la fuente ya esta en
+    # hvSourceVoltage desde el principio
+    settlingPredictor = None
+    pointBus = None
+    hvWorker = None
+    k2400Worker = None
+    try:
+        instruments = {"k2400": instrumentIdentification.get(k2400.resource_name),
+                       "hvSource": instrumentIdentification.get(hv_source.resource_name)}
+        if resumeCheckpoint is not None:
+            validateResume(resumeCheckpoint, configHash, resultsFormat, instruments)
+
+        # !!!!!!!!!MUY IMPORTANTE. PARA PROTEGER LA TENSION QUE VEN LOS BORNES DEL AMPERIMETRO!!!!!!!!!!!!!!
+        # SIEMPRE AMMETER ON ANTES DE APLICAR VOLTAJE O INICIALIZAR LA FUENTE QUE PUEDE TENER VOLTAJE ALTO ANTES DE EMPEZAR EL PROCESO
+
+        # K2400 ON
+        sendCommandToInstrument(k2400, ":OUTP:STAT ON", term, 0, k2400Delay)
+        waitForOperationComplete(k2400)
+        getOutputInterlock(k2400).ammeterOutputTurnedOn()
+
+        # importante inicializar primero la fuente de voltage para bajar a cero antes de inicializar el amperimetro
+        # (salvo sweep encadenado: la fuente sigue en hvSourceVoltage con la misma configuracion, no se toca)
+        chained = hvSourceVoltage is not None and \
+            changedInstrumentSettings(hv_source, hvSourceSettings(rampVoltage, outputCurrentLimit, enableKill)) == []
+        if chained:
+            print(colored("Chained sweep: HV Source kept at " + str(hvSourceVoltage) + "V", "yellow"))
+        else:
+            initializeHVSource(hv_source, rampVoltage, outputCurrentLimit, enableKill)
+        initializeK2400(k2400, ammeterCompliance, ammeterNPLCs, ammeterRange, readingsPerPoint=readingsPerPoint)
+
+        instrumentSettings = {"k2400": appliedInstrumentSettings.get(k2400.resource_name),
+                              "hvSource": appliedInstrumentSettings.get(hv_source.resource_name)}
+        if resumeCheckpoint is not None:
+            validateInstrumentSettings(resumeCheckpoint, instrumentSettings)
+
+        # la fuente esta en 0V despues de initializeHVSource, a partir de aqui cada setpoint se espera segun la rampa
+        settlingPredictor = RampSettlingPredictor(rampVoltage)
+        settlingPredictor.lastSetpoint = float(hvSourceVoltage) if chained else 0.0
+
+        # #calculo del step voltage
+        step_voltage = (finalVoltage - initialVoltage) / pointsVoltage
+        next_voltage = initialVoltage
+        # setpoints del sweep lineal calculados de una vez (sin acumular el error de redondeo de cada paso)
+        plannedSetpoints = linearSetpoints(initialVoltage, finalVoltage, pointsVoltage)
+
+        # el sweep termina al pasar de finalVoltage en el sentido del sweep (con margen para el error de redondeo)
+        direction = 1 if finalVoltage >= initialVoltage else -1
+
+        def beyondFinalVoltage(voltage):
+            return voltage is None or direction * (voltage - finalVoltage) > abs(step_voltage) * 1e-6
+
+        # en modo adaptativo el paso lo decide el controlador a partir de la corriente medida (next_voltage = None
+        # cuando el sweep ha terminado). Por defecto: paso entre step/4 y 4*step y los mismos puntos que el lineal
+        stepController = None
+        if sweepMode == SWEEP_ADAPTIVE:
+            stepController = AdaptiveStepController(initialVoltage, finalVoltage,
+                                                    step_voltage / 4 if minStepVoltage is None else minStepVoltage,
+                                                    step_voltage * 4 if maxStepVoltage is None else maxStepVoltage,
+                                                    pointsVoltage + 1 if maxPoints is None else maxPoints,
+                                                    initialStepVoltage=step_voltage)
+
+        finalProcess = False
+
+        # HV source ON
+        getOutputInterlock(hv_source).checkHVCanBeApplied("HV,ON")
+        hvSourceDriver(hv_source).write("HV,ON", delay)
+
+        # Here you have to write to file
+        # resultsFormat "dat" --> texto (formato de siempre), "binary" --> .ivb con cabecera y journal (resultsWriter.py)
+        metadata = {"startTime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "instruments": instruments,
+                    "config": sweepConfig}
+        # al reanudar se conservan los puntos del checkpoint y se añade a continuacion
+        f = openResultsWriter(resultsFormat, resultsFilePath, metadata,
+                              None if resumeCheckpoint is None else resumeCheckpoint["state"]["points"])
+
+        # el checkpoint se actualiza despues de escribir cada punto en el fichero
+        checkpoint = SweepCheckpoint(resultsFilePath, configHash, resultsFormat, instruments)
+        if resumeCheckpoint is not None:
+            checkpoint.restore(resumeCheckpoint)
+        else:
+            checkpoint.setInstrumentSettings(instrumentSettings)
+
+        # cada punto se publica en pointBus: fichero de resultados, consola y (con livePort) clientes TCP locales lo
+        # consumen en sus hilos, el bucle del sweep no espera a ninguno (livePoints.py)
+        consumers = [ResultsFileConsumer(f, checkpoint), ConsoleConsumer()]
+        if livePort is not None:
+            consumers.append(SocketPublisher(livePort))
+        pointBus = PointBus(consumers).start()
+
+        previous_current = 0.0
+        n_steps = 0
+
+        # current threshold in percent of current value
+        maxCurrentDelta_inTimesOfPreviousCurrent = 100 #20
+        is_current_overflow = False
+        # media / varianza / pendiente de las corrientes y deteccion temprana de ruptura, fuga que se dispara o
+        # compliance del K2400 (currentStatistics.py): ademas del salto de x100 entre dos puntos
+        breakdownDetector = BreakdownDetector(maxCurrentDelta_inTimesOfPreviousCurrent, complianceCurrent=ammeterCompliance,
+                                              currentFloor=breakdownCurrentFloor, currentRange=ammeterRange)
+        if stepController is not None:
+            stepController.overflowFactor = maxCurrentDelta_inTimesOfPreviousCurrent
+
+        # puntos escritos en el fichero de resultados (para progressCallback)
+        n_points = 0
+
+        def sweepState():
+            # estado del sweep para el checkpoint: lo necesario para seguir desde el siguiente setpoint pendiente
+            return {"points": n_points,
+                    "steps": n_steps,
+                    "lastSetpoint": actual_voltage,
+                    "nextVoltage": next_voltage,
+                    "previousCurrent": previous_current,
+                    "overflow": is_current_overflow,
+                    "breakdownDetector": breakdownDetector.getState(),
+                    "stepController": None if stepController is None else stepController.getState()}
+
+        actual_voltage = None
+        if resumeCheckpoint is not None:
+            # la fuente esta en 0V (initializeHVSource): el primer setpoint enviado es directamente el pendiente
+            state = resumeCheckpoint["state"]
+            n_points = state["points"]
+            n_steps = state["steps"]
+            actual_voltage = state["lastSetpoint"]
+            next_voltage = state["nextVoltage"]
+            previous_current = state["previousCurrent"]
+            is_current_overflow = state["overflow"]
+            if state.get("breakdownDetector") is not None:
+                breakdownDetector.setState(state["breakdownDetector"])
+            if stepController is not None and state["stepController"] is not None:
+                stepController.setState(state["stepController"])
+            print(colored("Resuming the sweep after " + str(n_points) + " points, ramping directly to " +
+                          str(next_voltage) + "V", "yellow"))
+        checkpoint.save(sweepState())
+
+        # cada instrumento tiene su hilo: la lectura de la fuente se solapa con la medida del K2400 y la rampa al
+        # siguiente setpoint empieza mientras se registra el punto actual
+        hvWorker = InstrumentWorker(hv_source, concurrentInstrumentIO)
+        k2400Worker = InstrumentWorker(k2400, concurrentInstrumentIO)
+
+        pendingSetpoint = None
+        if not beyondFinalVoltage(next_voltage):
+            pendingSetpoint = hvWorker.submit(sendHVOutputVoltage, hv_source, next_voltage / 1000)
+
+        while not finalProcess:
+
+            if stopEvent is not None and stopEvent.is_set():
+                raise SweepAbortedError("Sweep stopped on request after " + str(n_points) + " points")
+
+            if beyondFinalVoltage(next_voltage) or is_current_overflow:
+                finalProcess = True
+
+            else:
+
+                hvWorker.call(setHVOutputVoltage, hv_source, next_voltage / 1000, voltageStabilizationTimeout,
+                              settlingPredictor, pendingSetpoint.result())
+                pendingSetpoint = None
+
+                print(
+                    colored("Waiting for measure delay = " + str(measureDelay_ms / 1000) + " seconds", "grey",
+                            "on_white"))
+                with tracePhase(PHASE_SETTLE):
+                    sleep(measureDelay_ms / 1000)
+
+                # Una vez el voltaje de la fuente es estable a su salida podremos considerar que actualvoltage = nextvoltage
+                actual_voltage = next_voltage
+
+                point_timestamp = time.time()
+                # Here you have to measure the hv_source volatge
+                # lectura nueva (maxAge=0): la que confirmo la estabilizacion puede ser de antes del measure delay y
+                # estar solo dentro de la banda de tolerancia
+                hvSourceReading = hvWorker.submit(readVoltageFromHVSource, hv_source, maxAge=0)
+                # Here you have to measure the current of the k2400
+                ammeterReading = k2400Worker.submit(measureK2400Current, k2400, readingsPerPoint, k2400Delay)
+                hv_source_voltage = hvSourceReading.result()
+                ammeter_current, ammeter_currents = ammeterReading.result()
+
+                if n_steps == 0:
+                    previous_current = ammeter_current
+                point_previous_current = previous_current
+
+                # check if the ammeter_current overflows (o si hay ruptura / fuga que se dispara / compliance)
+
+                current_delta = ammeter_current - previous_current
+
+                if breakdownDetector.update(actual_voltage, ammeter_current) is not None:
                     is_current_overflow = True
-                    print(colored("CURRENT OVERFLOW!!!!!!!", "red"))
-
-            if not is_current_overflow:
-                next_voltage = actual_voltage + step_voltage
-                previous_current = ammeter_current
-                n_steps = n_steps + 1
 
-    message = "Closing the results file!!!"
-    printMessage(message, "*", "*")
-    f.close()
+                if not is_current_overflow:
+                    if stepController is not None:
+                        next_voltage = stepController.nextVoltage(actual_voltage, ammeter_current)
+                    else:
+                        # despues del ultimo setpoint seguimos un paso mas alla de finalVoltage: fin del sweep
+                        next_voltage = float(plannedSetpoints[n_steps + 1]) if n_steps + 1 < len(plannedSetpoints) \
+                            else actual_voltage + step_voltage
+                    previous_current = ammeter_current
+                    n_steps = n_steps + 1
+                    # la fuente empieza a ir al siguiente setpoint mientras registramos este punto
+                    if not beyondFinalVoltage(next_voltage):
+                        pendingSetpoint = hvWorker.submit(sendHVOutputVoltage, hv_source, next_voltage / 1000)
+
+                with tracePhase(PHASE_LOG):
+                    # Here you have to write to file (y mostrar el punto): lo hacen los consumidores de pointBus
+                    n_points = n_points + 1
+                    pointBus.publish(SweepPoint(n_points - 1, point_timestamp, actual_voltage, hv_source_voltage,
+                                                ammeter_current, point_previous_current, current_delta,
+                                                abs(maxCurrentDelta_inTimesOfPreviousCurrent * point_previous_current),
+                                                ammeter_currents, is_current_overflow, sweepState(),
+                                                breakdownDetector.summary()))
+
+                    if progressCallback is not None:
+                        progressCallback(n_points, hv_source_voltage, ammeter_current)
+
+        # dentro del bloque protegido: si el fichero de resultados o el checkpoint han fallado, close lanza su error
+        # y la fuente se baja a 0V
+        message = "Closing the results file!!!"
+        printMessage(message, "*", "*")
+        pointBus.close()
+        checkpoint.markComplete()
+
+    except BaseException:
+        # fallo en la preparacion o en mitad del sweep (GPIB, timeout, Ctrl+C...): antes de propagar el error dejamos
+        # la fuente segura
+        print(colored("Sweep aborted!!! Bringing the HV Source to 0V...", "red"))
+        if hvWorker is not None:
+            hvWorker.shutdown()
+        try:
+            shutdownHVSource(hv_source, settlingPredictor)
+        finally:
+            if pointBus is not None:
+                # el error que se propaga es el original, no el de un consumidor
+                pointBus.close(raiseErrors=False)
+                print(colored("The sweep can be resumed from its checkpoint with resume=True", "yellow"))
+        raise
+
+    finally:
+        if hvWorker is not None:
+            hvWorker.shutdown()
+        if k2400Worker is not None:
+            k2400Worker.shutdown()
 
     message = "Process Complete!!!"
     printMessage(message, "*", "*")
 
+    currents = breakdownDetector.currents
+    print(colored("Current: mean " + str(currents.mean) + "A, std " + str(currents.std) + "A, max " +
+                  str(currents.maximum) + "A (" + str(currents.count) + " points)", "cyan"))
+
+    if is_current_overflow:
+        # parada por ruptura / overflow: la fuente se baja siempre, aunque el sweep fuera a encadenarse
+        message = "Sweep stopped early (" + str(breakdownDetector.stopReason) + ") at " + str(actual_voltage) + \
+                  "V: powering off instruments!!!"
+        printMessage(message, "*", "*")
+        shutdownHVSource(hv_source, settlingPredictor)
+        message = "Now HV Source is safe!!!!"
+        printMessage(message, "*", "*")
+        return None
+
+    if not rampDown:
+        # sin setpoint pendiente: la fuente esta en el ultimo punto medido
+        hvVoltage = actual_voltage if actual_voltage is not None else settlingPredictor.lastSetpoint
+        message = "HV Source kept ON at " + str(hvVoltage) + "V for the next sweep!!!"
+        printMessage(message, "*", "*")
+        return hvVoltage
+
     message = "Powering off instruments!!!"
     printMessage(message, "*", "*")
 
-    # Setting output voltage to zero
-    setHVOutputVoltage(hv_source, 0, 60)
-
-    # HV source off
-    sendCommandToInstrument(hv_source, "HV,OFF", term, 0, delay)
+    shutdownHVSource(hv_source, settlingPredictor)
 
     message = "Now HV Source is safe!!!!"
     printMessage(message, "*", "*")
+    return 0.0
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
     process_config_file_path = "process_config_file.json"
 
-    K2400_gpibAddress, \
-    HVSource_gpibAddress, \
-    initialVoltage, \
-    finalVoltage, \
-    pointsVoltage, \
-    measureDelay_ms, \
-    rampVoltage, \
-    outputCurrentLimit, \
-    enableKill, \
-    ammeterRange, \
-    ammeterCompliance, \
-    ammeterNPLCs, \
-    resultsFileName, \
-    resultsFileExtension = readConfigFile(process_config_file_path)
+    # configuracion validada (tipos, rangos y limites de seguridad) antes de tocar ningun instrumento
+    config = SweepConfig.fromConfigFile(process_config_file_path)
+
+    # "host:port" de instrumentDaemon.py: sesiones GPIB ya abiertas e identificadas, sin escanear el bus
+    resourceManager = None
+    if config.instrumentDaemon is not None:
+        from instrumentDaemon import RemoteResourceManager
+        resourceManager = RemoteResourceManager(config.instrumentDaemon)
 
     # print(measureDelay_ms)
     # exit(0)
@@ -453,16 +1023,4 @@ if __name__ == '__main__':
     #                   resultsFileName + str(counter) + "." + resultsFileExtension)
     #     counter += 1
 
-    start_process(K2400_gpibAddress,
-                  HVSource_gpibAddress,
-                  initialVoltage,
-                  finalVoltage,
-                  pointsVoltage,
-                  measureDelay_ms,
-                  rampVoltage,
-                  outputCurrentLimit,
-                  enableKill,
-                  ammeterRange,
-                  ammeterCompliance,
-                  ammeterNPLCs,
-                  resultsFileName + "." + resultsFileExtension)
+    start_process(resourceManager=resourceManager, **config.startProcessParameters())
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Lanza en paralelo el sweep de varias estaciones (pareja K2400 + fuente HV), un hilo por estacion.
+
+Cada estacion tiene su placa GPIB, sus direcciones y su fichero de resultados. Un fallo en una estacion (GPIB,
+timeout, interlock...) no para a las demas: start_process deja su fuente a 0V y la estacion queda marcada como
+FAILED. La salida por consola de cada estacion va a su propio fichero <resultados>.log y por pantalla solo se
+muestra una tabla de progreso comun. Con Ctrl+C se activa un stopEvent comun: cada estacion baja su fuente a 0V antes
+del siguiente punto (ABORTED) y el runner espera a que todas terminen.
+
+La configuracion de cada estacion (la comun con los parametros de la estacion encima) se valida con SweepConfig
+antes de lanzar ninguna: un parametro mal escrito o fuera de rango para el runner al principio, no en mitad de un
+sweep. Tambien se rechazan dos estaciones con el mismo instrumento (placa + direccion), el mismo livePort o el mismo
+fichero de resultados: el estado de cada instrumento (configuracion aplicada, interlock, driver de la fuente) se
+guarda por nombre de recurso y dos hilos manejarian la misma fuente sin proteccion.
+
+Uso:
+    python multiStationRunner.py stations_config_file.json [--config process_config_file.json] [--simulate]
+                                 [--daemon 127.0.0.1:18500]
+
+Formato de stations_config_file.json:
+    {"stations": [{"name": "bench1", "gpibBoard": 0, "K2400_gpibAddress": 25, "HVSource_gpibAddress": 20,
+                   "resultsFile": "s1@250_0h.dat"}, ...]}
+Cualquier otro parametro de start_process (finalVoltage, rampVoltage...) puede darse por estacion y sustituye
+al de process_config_file.json.
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from termcolor import colored
+
+from adaptiveStepping import SWEEP_ADAPTIVE
+from sweepConfig import SweepConfig, ConfigError
+import main
+
+STATION_WAITING = "WAITING"
+STATION_RUNNING = "RUNNING"
+STATION_DONE = "DONE"
+STATION_FAILED = "FAILED"
+STATION_ABORTED = "ABORTED"
+
+# parametros de start_process que son de cada estacion y no del fichero de configuracion comun
+STATION_PARAMETERS = ("gpibBoard", "K2400_gpibAddress", "HVSource_gpibAddress", "resultsFilePath")
+
+
+class Station:
+    """
+    Una pareja K2400 + fuente HV y el sweep que hay que hacer con ella.
+
+    Args:
+        name (str): Nombre de la estacion en los informes
+        gpibBoard (int): Indice de la placa GPIB (GPIB<gpibBoard>::...)
+        K2400_gpibAddress (int): Direccion GPIB del K2400
+        HVSource_gpibAddress (int): Direccion GPIB de la fuente HV
+        resultsFilePath (str): Fichero de resultados del sweep
+        sweepParameters (dict): Parametros de start_process propios de la estacion
+    """
+
+    def __init__(self, name, gpibBoard, K2400_gpibAddress, HVSource_gpibAddress, resultsFilePath,
+                 sweepParameters=None):
+        self.name = name
+        self.gpibBoard = gpibBoard
+        self.K2400_gpibAddress = K2400_gpibAddress
+        self.HVSource_gpibAddress = HVSource_gpibAddress
+        self.resultsFilePath = resultsFilePath
+        self.sweepParameters = sweepParameters if sweepParameters is not None else {}
+
+        # progreso, actualizado desde el hilo de la estacion
+        self.state = STATION_WAITING
+        self.points = 0
+        self.expectedPoints = 0
+        self.lastVoltage = None
+        self.lastCurrent = None
+        self.startTime = None
+        self.endTime = None
+        self.error = None
+
+    def elapsedTime(self):
+        if self.startTime is None:
+            return 0.0
+        return (self.endTime if self.endTime is not None else time.time()) - self.startTime
+
+
+class ThreadRoutedStdout:
+    """
+    Sustituto de sys.stdout que envia lo que escribe cada estacion a su propio stream.
+    contextlib.redirect_stdout no sirve aqui: cambia sys.stdout para todos los hilos a la vez.
+    El stream se guarda en una ContextVar, asi que tambien lo usan los hilos de I/O de la estacion
+    (InstrumentWorker ejecuta cada operacion en el contexto de quien la lanza).
+    """
+
+    def __init__(self, defaultStream):
+        self.defaultStream = defaultStream
+        self.stream = contextvars.ContextVar("stationStdout", default=None)
+
+    def register(self, stream):
+        self.stream.set(stream)
+
+    def unregister(self):
+        self.stream.set(None)
+
+    def currentStream(self):
+        stream = self.stream.get()
+        return self.defaultStream if stream is None else stream
+
+    def write(self, text):
+        return self.currentStream().write(text)
+
+    def flush(self):
+        self.currentStream().flush()
+
+
+def readStationsFile(stationsFilePath):
+    with open(stationsFilePath) as f:
+        jsonContent = json.load(f)
+
+    stations = []
+    for i, stationContent in enumerate(jsonContent["stations"]):
+        stationContent = dict(stationContent)
+        stations.append(Station(stationContent.pop("name", "station" + str(i)),
+                                stationContent.pop("gpibBoard", 0),
+                                stationContent.pop("K2400_gpibAddress"),
+                                stationContent.pop("HVSource_gpibAddress"),
+                                stationContent.pop("resultsFile"),
+                                stationContent))
+    return stations
+
+
+def sweepParametersFromConfigFile(configFilePath):
+    """
+    :return: dict con los parametros de start_process comunes a todas las estaciones (configuracion validada; las
+    direcciones GPIB, la placa y el fichero de resultados son de cada estacion; livePort normalmente tambien, cada
+    estacion necesita su propio puerto)
+    """
+    return sweepParametersFromConfig(SweepConfig.fromConfigFile(configFilePath))
+
+
+def sweepParametersFromConfig(config):
+    parameters = config.startProcessParameters()
+    for name in STATION_PARAMETERS:
+        parameters.pop(name, None)
+    return parameters
+
+
+def validateStations(stations, config):
+    """
+    Valida la configuracion de cada estacion (config con la placa, las direcciones y los parametros de la estacion
+    encima) y deja en station.sweepParameters los valores ya convertidos. Comprueba ademas que ningun instrumento,
+    livePort ni fichero de resultados lo usan dos estaciones.\n
+    :param config: sweepConfig.SweepConfig comun
+    :raise: sweepConfig.ConfigError con los problemas de todas las estaciones
+    """
+    problems = []
+    owners = {}  # (que, valor) --> nombre de la primera estacion que lo usa
+
+    def claim(kind, value, station):
+        owner = owners.setdefault((kind, value), station.name)
+        if owner != station.name:
+            problems.append(station.name + ": " + kind + " " + str(value) + " is already used by " + owner)
+
+    for station in stations:
+        try:
+            stationConfig = config.replace(gpibBoard=station.gpibBoard,
+                                           K2400_gpibAddress=station.K2400_gpibAddress,
+                                           HVSource_gpibAddress=station.HVSource_gpibAddress,
+                                           **station.sweepParameters)
+        except ConfigError as e:
+            problems.extend(station.name + ": " + problem for problem in e.problems)
+            continue
+        station.gpibBoard = stationConfig.gpibBoard
+        station.K2400_gpibAddress = stationConfig.K2400_gpibAddress
+        station.HVSource_gpibAddress = stationConfig.HVSource_gpibAddress
+        station.sweepParameters = {name: getattr(stationConfig, name) for name in station.sweepParameters}
+
+        for address in (stationConfig.K2400_gpibAddress, stationConfig.HVSource_gpibAddress):
+            claim("instrument", "GPIB%d::%d::INSTR" % (stationConfig.gpibBoard, address), station)
+        if stationConfig.livePort is not None:
+            claim("livePort", stationConfig.livePort, station)
+        claim("results file", os.path.abspath(station.resultsFilePath), station)
+    if problems:
+        raise ConfigError(problems)
+
+
+def runStation(station, sweepParameters, stdoutRouter, resourceManagerFactory=None, stopEvent=None):
+    """
+    Cuerpo del hilo de una estacion. Nunca propaga excepciones: el fallo queda en station.state / station.error.
+    """
+    parameters = dict(sweepParameters)
+    parameters.update(station.sweepParameters)
+    # en modo adaptativo maxPoints es la cota de puntos del sweep (puede terminar antes)
+    if parameters.get("sweepMode") == SWEEP_ADAPTIVE and parameters.get("maxPoints") is not None:
+        station.expectedPoints = int(parameters["maxPoints"])
+    else:
+        station.expectedPoints = int(parameters["pointsVoltage"]) + 1
+
+    def progress(points, voltage, current):
+        station.points = points
+        station.lastVoltage = voltage
+        station.lastCurrent = current
+
+    with open(station.resultsFilePath + ".log", "w") as log:
+        stdoutRouter.register(log)
+        station.state = STATION_RUNNING
+        station.startTime = time.time()
+        try:
+            resourceManager = resourceManagerFactory(station) if resourceManagerFactory is not None else None
+            main.start_process(station.K2400_gpibAddress,
+                               station.HVSource_gpibAddress,
+                               resultsFilePath=station.resultsFilePath,
+                               resourceManager=resourceManager,
+                               gpibBoard=station.gpibBoard,
+                               progressCallback=progress,
+                               stopEvent=stopEvent,
+                               **parameters)
+            station.state = STATION_DONE
+            station.expectedPoints = station.points
+        except main.SweepAbortedError as e:
+            station.error = str(e)
+            station.state = STATION_ABORTED
+        except Exception as e:
+            traceback.print_exc(file=log)
+            station.error = repr(e)
+            station.state = STATION_FAILED
+        finally:
+            station.endTime = time.time()
+            stdoutRouter.unregister()
+
+
+def printProgress(stations, stream):
+    stateColors = {STATION_WAITING: "grey", STATION_RUNNING: "yellow", STATION_DONE: "green", STATION_FAILED: "red",
+                   STATION_ABORTED: "magenta"}
+
+    lines = ["%-12s %-9s %10s %10s %14s %10s" % ("station", "state", "points", "voltage_V", "current_A", "elapsed_s")]
+    for station in stations:
+        line = "%-12s %-9s %10s %10s %14s %10.1f" % (
+            station.name, station.state, str(station.points) + "/" + str(station.expectedPoints),
+            "-" if station.lastVoltage is None else "%.1f" % station.lastVoltage,
+            "-" if station.lastCurrent is None else "%.4e" % station.lastCurrent,
+            station.elapsedTime())
+        if station.error is not None:
+            line += "  " + station.error
+        lines.append(colored(line, stateColors[station.state]))
+    stream.write("\n".join(lines) + "\n\n")
+    stream.flush()
+
+
+def runStations(stations, sweepParameters, resourceManagerFactory=None, progressPeriod=5.0):
+    """
+    Ejecuta en paralelo el sweep de todas las estaciones y espera a que terminen.
+
+    Args:
+        stations (list): Lista de Station
+        sweepParameters (dict): Parametros de start_process comunes a todas las estaciones
+        resourceManagerFactory (callable): Station --> ResourceManager (None --> pyvisa.ResourceManager())
+        progressPeriod (float): Periodo de refresco de la tabla de progreso. Seconds
+    Returns:
+        La lista de estaciones con su estado final
+    """
+    stdout = sys.stdout
+    stdoutRouter = ThreadRoutedStdout(stdout)
+    sys.stdout = stdoutRouter
+    stopEvent = threading.Event()
+
+    try:
+        threads = [threading.Thread(target=runStation, name="station-" + station.name,
+                                    args=(station, sweepParameters, stdoutRouter, resourceManagerFactory, stopEvent))
+                   for station in stations]
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads):
+            try:
+                printProgress(stations, stdout)
+                for thread in threads:
+                    thread.join(timeout=progressPeriod / len(threads))
+            except KeyboardInterrupt:
+                # las estaciones bajan su fuente a 0V antes del siguiente punto: se espera a que terminen
+                if stopEvent.is_set():
+                    raise
+                stopEvent.set()
+                stdout.write(colored("Stopping all stations: bringing every HV Source to 0V "
+                                     "(Ctrl+C again to exit without waiting)...\n", "red"))
+        printProgress(stations, stdout)
+    finally:
+        sys.stdout = stdout
+
+    return stations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel sweeps on several K2400 / HV source stations")
+    parser.add_argument("stations", help="stations json file")
+    parser.add_argument("--config", default="process_config_file.json", help="common sweep configuration")
+    parser.add_argument("--simulate", action="store_true", help="run every station against a simulated bench")
+    parser.add_argument("--daemon", help="host:port of instrumentDaemon.py to take the GPIB sessions from")
+    args = parser.parse_args()
+
+    stations = readStationsFile(args.stations)
+    config = SweepConfig.fromConfigFile(args.config)
+    try:
+        validateStations(stations, config)
+    except ConfigError as e:
+        print(e)
+        sys.exit(2)
+    sweepParameters = sweepParametersFromConfig(config)
+
+    resourceManagerFactory = None
+    if args.simulate:
+        from instrumentSimulator import SimulatedBench
+
+        def resourceManagerFactory(station):
+            return SimulatedBench(station.K2400_gpibAddress, station.HVSource_gpibAddress,
+                                  station.gpibBoard).resourceManager()
+    elif args.daemon is not None:
+        from instrumentDaemon import RemoteResourceManager
+
+        def resourceManagerFactory(station):
+            return RemoteResourceManager(args.daemon)
+
+    stations = runStations(stations, sweepParameters, resourceManagerFactory)
+
+    sys.exit(0 if all(station.state == STATION_DONE for station in stations) else 1)
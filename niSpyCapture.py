@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Lectura de capturas de NI I/O Trace / NI Spy (.nitrace) y backend de replay para main.getInstruments /
+main.start_process.
+
+Formato (NI Spy 17.0, little endian, deducido de Capture.nitrace):
+
+    u8 longitud + "NI Spy 17.0 Capture File" | bloque de 16 bytes (3, 3, 0...) | registros
+
+Cada llamada VISA deja dos registros, uno a la entrada y otro a la salida, con el mismo numero de secuencia:
+
+    u32 | u32 0x1100 | u32 3 | u32 secuencia | u32 pid | u32 tid | u32 0 | u64 fraccion | u64 segundos  (desde 1904)
+    u8 longitud del nombre de la funcion (0 en la salida) | 3 bytes | u32 n parametros | 8 bytes | u32 bytes de datos
+    | u32 | n descriptores de 16 bytes | datos (nombre de la funcion, nombres y valores de los parametros)
+
+    descriptor: u8 | u24 offset del valor | u24 offset del nombre (0xFFFFFF --> status de retorno) | u8 tamaño del
+                elemento (1 bytes, 2/4/8 entero) | u32 tipo | u32 tamaño del valor
+
+Los registros de salida van seguidos de otro bloque de 16 bytes (3, 3, 0...).
+
+Replay: ReplayResourceManager sirve como resourceManager= de main. Para cada comando que aparece en la captura
+devuelve la respuesta grabada, con la duracion original de viWrite / viRead (multiplicada por timeScale); list_resources
+y open_resource esperan tambien lo que tardaron viFindRsrc (+ viFindNext) y viOpen en la captura. Los
+comandos o instrumentos que no estan en la captura se pasan a fallbackResourceManager (p.ej. el banco simulado).
+
+Uso:
+    python niSpyCapture.py Capture.nitrace   --> llamadas VISA y tiempo de bus frente a tiempo fuera de VISA
+"""
+
+import argparse
+import re
+import struct
+import time
+from collections import deque
+
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+
+CAPTURE_SIGNATURE = b"NI Spy"
+LABVIEW_EPOCH_OFFSET = 2082844800  # segundos entre 1904-01-01 y 1970-01-01
+
+RECORD_HEADER = struct.Struct("<IIIIIIIQQBxxxI8xII")
+RECORD_MARKER = 0x1100
+DESCRIPTOR = struct.Struct("<4s4sII")
+NO_NAME = 0xFFFFFF
+SEPARATOR = struct.Struct("<II8x")
+
+# llamadas que mueven datos por el bus
+BUS_FUNCTIONS = ("viWrite", "viRead", "viReadSTB", "viQueryf", "viPrintf", "viScanf", "viBufWrite", "viBufRead",
+                 "viAssertTrigger", "viClear")
+
+
+class ViCall:
+    """
+    Una llamada VISA de la captura.
+
+    Args:
+        sequence (int): Numero de secuencia de NI Spy
+        function (str): Nombre de la funcion (viWrite, viRead...)
+        pid (int): Proceso que hizo la llamada
+        tid (int): Hilo que hizo la llamada
+        startTime (float): Entrada en la funcion (time.time())
+        endTime (float): Salida de la funcion (time.time())
+        inputs (dict): Parametros a la entrada (nombre --> valor)
+        outputs (dict): Parametros a la salida (nombre --> valor)
+        status (int): Codigo de retorno VISA
+    """
+
+    def __init__(self, sequence, function, pid, tid, startTime, endTime, inputs, outputs, status):
+        self.sequence = sequence
+        self.function = function
+        self.pid = pid
+        self.tid = tid
+        self.startTime = startTime
+        self.endTime = endTime
+        self.inputs = inputs
+        self.outputs = outputs
+        self.status = status
+        self.resource = None
+
+    @property
+    def duration(self):
+        return self.endTime - self.startTime
+
+    @property
+    def payload(self):
+        # bytes escritos (viWrite) o leidos (viRead)
+        if self.function == "viWrite":
+            return self.inputs.get("buf", b"")
+        if self.function == "viRead":
+            return self.outputs.get("buf", b"")
+        return None
+
+    def __repr__(self):
+        return "ViCall(%d, %s, %s, %.6f s, status=%d%s)" % (
+            self.sequence, self.function, self.resource, self.duration, self.status,
+            "" if self.payload is None else ", " + repr(self.payload))
+
+
+def normalizeResourceName(resourceName):
+    """
+    "GPIB0::20::0::INSTR" (direccion secundaria 0) y "GPIB0::20::INSTR" son el mismo instrumento para el replay.
+    """
+    match = re.match(r"^GPIB(\d*)::(\d+)(?:::\d+)?::INSTR$", resourceName.strip(), re.IGNORECASE)
+    if match is None:
+        return resourceName.strip()
+    return "GPIB%d::%d::INSTR" % (int(match.group(1) or 0), int(match.group(2)))
+
+
+def _decodeValue(raw, elementSize):
+    if elementSize == 1:
+        return raw
+    if len(raw) in (2, 4, 8):
+        return int.from_bytes(raw, "little", signed=elementSize != 8)
+    return raw
+
+
+def _readRecord(data, position):
+    """
+    :return: (dict con el registro, posicion del siguiente)
+    """
+    unused, marker, three, sequence, pid, tid, zero, fraction, seconds, nameLength, parameters, dataLength, \
+        unused2 = RECORD_HEADER.unpack_from(data, position)
+    if marker != RECORD_MARKER:
+        raise ValueError("Unexpected NI Spy record at offset " + hex(position))
+
+    descriptors = position + RECORD_HEADER.size
+    values = descriptors + parameters * DESCRIPTOR.size
+    function = data[values:values + nameLength].rstrip(b"\x00").decode("ascii", errors="replace")
+
+    fields = {}
+    status = 0
+    for i in range(parameters):
+        valueOffset, nameOffset, kind, size = DESCRIPTOR.unpack_from(data, descriptors + i * DESCRIPTOR.size)
+        elementSize = nameOffset[3]
+        valueOffset = int.from_bytes(valueOffset[1:4], "little")
+        nameOffset = int.from_bytes(nameOffset[0:3], "little")
+        value = _decodeValue(data[values + valueOffset:values + valueOffset + size], elementSize)
+        if nameOffset == NO_NAME:
+            status = value
+            continue
+        nameEnd = data.index(b"\x00", values + nameOffset)
+        name = data[values + nameOffset:nameEnd].decode("ascii", errors="replace").lstrip("*")
+        # los punteros (tamaño de elemento 8) no sustituyen a un valor ya leido (p.ej. el contenido de buf)
+        if elementSize != 8 or name not in fields:
+            fields[name] = value
+
+    record = {"sequence": sequence, "pid": pid, "tid": tid,
+              "time": seconds + fraction / 2.0 ** 64 - LABVIEW_EPOCH_OFFSET,
+              "function": function, "fields": fields, "status": status, "entry": nameLength > 0}
+
+    position = values + dataLength
+    if position + SEPARATOR.size <= len(data) and SEPARATOR.unpack_from(data, position) == (3, 3):
+        position += SEPARATOR.size
+    return record, position
+
+
+def parseCapture(captureFilePath):
+    """
+    :return: lista de ViCall ordenada por instante de entrada
+    """
+    with open(captureFilePath, "rb") as f:
+        data = f.read()
+
+    signatureLength = data[0]
+    if not data[1:1 + signatureLength].startswith(CAPTURE_SIGNATURE):
+        raise ValueError("Not an NI Spy capture file: " + str(captureFilePath))
+    position = 1 + signatureLength + SEPARATOR.size
+
+    pendingCalls = {}
+    calls = []
+    while position + RECORD_HEADER.size <= len(data):
+        record, position = _readRecord(data, position)
+        key = (record["pid"], record["sequence"])
+        if record["entry"]:
+            pendingCalls[key] = record
+            continue
+        entry = pendingCalls.pop(key, None)
+        if entry is None:
+            continue
+        calls.append(ViCall(record["sequence"], entry["function"], record["pid"], record["tid"], entry["time"],
+                            record["time"], entry["fields"], record["fields"], record["status"]))
+
+    calls.sort(key=lambda call: call.startTime)
+    _assignResources(calls)
+    return calls
+
+
+def _assignResources(calls):
+    # el recurso de cada llamada: parametro "dummyses" (descripcion de la sesion) o rsrcName; si solo hay vi, el
+    # que se abrio con viOpen para esa sesion en ese proceso
+    sessions = {}
+    for call in calls:
+        resource = call.inputs.get("dummyses")
+        if resource is None and call.function in ("viOpen", "viParseRsrcEx", "viParseRsrc"):
+            resource = call.inputs.get("rsrcName")
+        if isinstance(resource, bytes):
+            resource = normalizeResourceName(resource.decode("ascii", errors="replace"))
+        if call.function == "viOpen" and "vi" in call.outputs:
+            sessions[(call.pid, call.outputs["vi"])] = resource
+        if resource is None and "vi" in call.inputs:
+            resource = sessions.get((call.pid, call.inputs["vi"]))
+        call.resource = resource
+
+
+def _normalizeCommand(message):
+    if isinstance(message, str):
+        message = message.encode("ascii", errors="replace")
+    return message.strip().upper()
+
+
+def captureTransactions(calls):
+    """
+    Pares comando --> respuesta de cada instrumento: cada viWrite con los viRead que le siguen en el mismo recurso
+    hasta el siguiente viWrite.\n
+    :return: dict recurso --> dict comando normalizado --> lista de (duracion viWrite, respuesta o None,
+        duracion viRead)
+    """
+    transactions = {}
+    lastWrite = {}
+    for call in calls:
+        if call.resource is None or call.status < 0:
+            continue
+        if call.function == "viWrite":
+            command = _normalizeCommand(call.payload)
+            transaction = [call.duration, None, 0.0]
+            transactions.setdefault(call.resource, {}).setdefault(command, []).append(transaction)
+            lastWrite[call.resource] = transaction
+        elif call.function == "viRead" and lastWrite.get(call.resource) is not None:
+            transaction = lastWrite.pop(call.resource)
+            transaction[1] = call.payload
+            transaction[2] = call.duration
+    return transactions
+
+
+def captureSetupDurations(calls):
+    """
+    Duraciones de la busqueda y apertura de recursos de la captura.\n
+    :return: (lista con la duracion de cada busqueda: viFindRsrc + sus viFindNext,
+        dict recurso --> lista de duraciones de viOpen)
+    """
+    findDurations = []
+    openDurations = {}
+    for call in calls:
+        if call.status < 0:
+            continue
+        if call.function == "viFindRsrc":
+            findDurations.append(call.duration)
+        elif call.function == "viFindNext" and findDurations:
+            findDurations[-1] += call.duration
+        elif call.function == "viOpen" and call.resource is not None:
+            openDurations.setdefault(call.resource, []).append(call.duration)
+    return findDurations, openDurations
+
+
+def _replayWait(duration, timeScale):
+    if timeScale > 0 and duration > 0:
+        time.sleep(duration * timeScale)
+
+
+def _unionLength(intervals):
+    total = 0.0
+    end = None
+    for intervalStart, intervalEnd in sorted(intervals):
+        if end is None or intervalStart > end:
+            total += intervalEnd - intervalStart
+            end = intervalEnd
+        elif intervalEnd > end:
+            total += intervalEnd - end
+            end = intervalEnd
+    return total
+
+
+def sessionTimeBreakdown(calls):
+    """
+    Para cada proceso de la captura: duracion de la sesion, tiempo dentro de VISA, tiempo de bus (viWrite, viRead...)
+    y tiempo fuera de VISA (esperas y proceso del programa).\n
+    :return: dict pid --> dict
+    """
+    breakdown = {}
+    for pid in sorted({call.pid for call in calls}):
+        processCalls = [call for call in calls if call.pid == pid]
+        span = max(call.endTime for call in processCalls) - min(call.startTime for call in processCalls)
+        visaTime = _unionLength([(call.startTime, call.endTime) for call in processCalls])
+        busTime = _unionLength([(call.startTime, call.endTime) for call in processCalls
+                                if call.function in BUS_FUNCTIONS])
+        functions = {}
+        for call in processCalls:
+            count, total = functions.get(call.function, (0, 0.0))
+            functions[call.function] = (count + 1, total + call.duration)
+        breakdown[pid] = {"span": span, "visaTime": visaTime, "busTime": busTime,
+                          "outsideVisaTime": span - visaTime, "calls": len(processCalls), "functions": functions,
+                          "startTime": min(call.startTime for call in processCalls)}
+    return breakdown
+
+
+class ReplayInstrument:
+    """
+    Instrumento que responde con lo grabado en la captura.
+
+    Args:
+        resourceName (str): Recurso VISA
+        transactions (dict): comando normalizado --> lista de (duracion viWrite, respuesta, duracion viRead)
+        timeScale (float): Factor de las duraciones grabadas (1 original, 0 sin esperas)
+        fallbackInstrument: Instrumento al que se pasan los comandos que no estan en la captura (None --> se
+            aceptan sin respuesta)
+        strict (bool): Si True un comando que no esta en la captura (y sin fallbackInstrument) lanza VisaIOError
+    """
+
+    def __init__(self, resourceName, transactions, timeScale=1.0, fallbackInstrument=None, strict=False):
+        self.resource_name = resourceName
+        self.transactions = transactions
+        self.timeScale = timeScale
+        self.fallbackInstrument = fallbackInstrument
+        self.strict = strict
+        self.timeout = 2000
+        self.replayCount = {}  # comando --> veces que se ha respondido (las respuestas grabadas se reciclan)
+        self.pendingResponses = deque()
+        self.unmatchedCommands = []
+
+    def wait(self, duration):
+        _replayWait(duration, self.timeScale)
+
+    def write_raw(self, message):
+        command = _normalizeCommand(message)
+        recorded = self.transactions.get(command)
+
+        if recorded is None:
+            if self.fallbackInstrument is not None:
+                return self.fallbackInstrument.write_raw(message)
+            if self.strict:
+                raise VisaIOError(constants.StatusCode.error_nonsupported_operation)
+            self.unmatchedCommands.append(command)
+            return len(message)
+
+        count = self.replayCount.get(command, 0)
+        self.replayCount[command] = count + 1
+        writeDuration, response, readDuration = recorded[count % len(recorded)]
+        self.wait(writeDuration)
+        if response is not None:
+            self.pendingResponses.append((response, readDuration))
+        return len(message)
+
+    def read_raw(self, size=None):
+        # primero las respuestas grabadas pendientes, despues las del fallback
+        if self.pendingResponses:
+            response, readDuration = self.pendingResponses.popleft()
+            self.wait(readDuration)
+            return response
+        if self.fallbackInstrument is not None:
+            return self.fallbackInstrument.read_raw()
+        raise VisaIOError(constants.StatusCode.error_timeout)
+
+    def read_stb(self):
+        if self.fallbackInstrument is not None:
+            return self.fallbackInstrument.read_stb()
+        return 0x10 if self.pendingResponses else 0
+
+    def close(self):
+        if self.fallbackInstrument is not None:
+            self.fallbackInstrument.close()
+
+
+class ReplayResourceManager:
+    """
+    resourceManager= para main.getInstruments / main.start_process que reproduce una captura.
+
+    Args:
+        calls (list): Llamadas de la captura (parseCapture)
+        timeScale (float): Factor de las duraciones grabadas (1 original, 0 sin esperas)
+        fallbackResourceManager: Resource manager para los instrumentos / comandos que no estan en la captura
+        strict (bool): Ver ReplayInstrument
+    """
+
+    def __init__(self, calls, timeScale=1.0, fallbackResourceManager=None, strict=False):
+        self.calls = calls
+        self.timeScale = timeScale
+        self.fallbackResourceManager = fallbackResourceManager
+        self.strict = strict
+        self.transactions = captureTransactions(calls)
+        self.findDurations, self.openDurations = captureSetupDurations(calls)
+        self.findCount = 0
+        self.openCount = {}  # recurso --> veces abierto (las duraciones grabadas se reciclan)
+        self.instruments = {}
+
+    def list_resources(self, query="?*::INSTR"):
+        if self.findDurations:
+            _replayWait(self.findDurations[self.findCount % len(self.findDurations)], self.timeScale)
+            self.findCount += 1
+        resources = [call.outputs["rsrcName"].decode("ascii", errors="replace")
+                     for call in self.calls if call.function in ("viFindRsrc", "viFindNext") and
+                     isinstance(call.outputs.get("rsrcName"), bytes)]
+        resources += list(self.transactions)
+        if self.fallbackResourceManager is not None:
+            resources += list(self.fallbackResourceManager.list_resources(query))
+        return tuple(dict.fromkeys(resources))
+
+    def open_resource(self, resource_name, **kwargs):
+        resourceName = normalizeResourceName(resource_name)
+        fallbackInstrument = None
+        if self.fallbackResourceManager is not None:
+            fallbackInstrument = self.fallbackResourceManager.open_resource(resource_name, **kwargs)
+        if resourceName not in self.transactions:
+            if fallbackInstrument is not None:
+                return fallbackInstrument
+            raise VisaIOError(constants.StatusCode.error_resource_not_found)
+
+        openDurations = self.openDurations.get(resourceName)
+        if openDurations:
+            count = self.openCount.get(resourceName, 0)
+            self.openCount[resourceName] = count + 1
+            _replayWait(openDurations[count % len(openDurations)], self.timeScale)
+        instrument = ReplayInstrument(resource_name, self.transactions[resourceName], self.timeScale,
+                                      fallbackInstrument, self.strict)
+        self.instruments[resource_name] = instrument
+        return instrument
+
+    def close(self):
+        if self.fallbackResourceManager is not None:
+            self.fallbackResourceManager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VISA calls and bus time of an NI Spy capture")
+    parser.add_argument("capture", help=".nitrace file")
+    parser.add_argument("--calls", action="store_true", help="list every VISA call")
+    args = parser.parse_args()
+
+    viCalls = parseCapture(args.capture)
+    if args.calls or len(viCalls) <= 100:
+        firstTime = viCalls[0].startTime if viCalls else 0.0
+        for viCall in viCalls:
+            print("%10.4f %9.4f %6d %-16s %-22s %s" % (
+                viCall.startTime - firstTime, viCall.duration, viCall.pid, viCall.function, viCall.resource or "",
+                "" if viCall.payload is None else repr(viCall.payload)))
+        print()
+
+    for processId, processBreakdown in sessionTimeBreakdown(viCalls).items():
+        print("pid %d (%s): %d calls, session %.3f s, inside VISA %.3f s, bus %.3f s, outside VISA %.3f s (%.1f%%)" % (
+            processId, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(processBreakdown["startTime"])),
+            processBreakdown["calls"], processBreakdown["span"], processBreakdown["visaTime"],
+            processBreakdown["busTime"], processBreakdown["outsideVisaTime"],
+            100 * processBreakdown["outsideVisaTime"] / processBreakdown["span"] if processBreakdown["span"] else 0))
+        for function, (count, total) in sorted(processBreakdown["functions"].items(), key=lambda item: -item[1][1]):
+            print("    %-18s %4d calls %9.4f s" % (function, count, total))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Escritura de los resultados de un sweep.
+
+DatResultsWriter escribe el formato de siempre (.dat, texto: "voltage<TAB>|corriente|" por linea). Con varias
+lecturas por punto añade desviacion estandar, minimo y maximo de las lecturas en el mismo convenio que |corriente|:
+si la media es negativa las lecturas se cambian de signo (minimo = -maximo con signo, maximo = -minimo con signo), asi
+minimo <= |corriente| <= maximo. El .ivb guarda los valores con signo.
+BinaryResultsWriter escribe un formato binario tipado y de solo-añadir (.ivb):
+
+    "IVRB" | version (uint16) | longitud de la cabecera (uint32) | cabecera JSON (utf-8) | registros
+
+La cabecera guarda la configuracion del sweep, la identificacion de los instrumentos y la hora de inicio.
+Cada registro (RECORD_DTYPE, 64 bytes, little endian) guarda el indice del punto, timestamp, setpoint, lectura de la
+fuente, corriente con signo y, para la adquisicion en rafaga, desviacion estandar, minimo, maximo y numero de lecturas.
+
+Los registros se escriben en el fichero por lotes. Mientras tanto cada registro se añade (una sola llamada a
+os.write, sin formatear floats) a un journal <fichero>.journal, que se vacia cada vez que se escribe un lote. Si el
+proceso muere, recoverResultsFile recupera del journal los registros que no llegaron al fichero: como mucho se
+pierde el punto que se estaba escribiendo.
+
+Uso:
+    python resultsWriter.py resultados.ivb [resultados.dat]   --> recupera el journal (si hay) y convierte a .dat
+"""
+
+import json
+import math
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+MAGIC = b"IVRB"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sHI")  # magic, version, longitud de la cabecera
+
+RECORD_DTYPE = np.dtype([("index", "<u4"),
+                         ("readings", "<u4"),
+                         ("timestamp", "<f8"),
+                         ("setpoint", "<f8"),
+                         ("voltage", "<f8"),
+                         ("current", "<f8"),
+                         ("currentStd", "<f8"),
+                         ("currentMin", "<f8"),
+                         ("currentMax", "<f8")])
+RECORD = struct.Struct("<II7d")
+
+JOURNAL_SUFFIX = ".journal"
+
+
+class DatResultsWriter:
+    """
+    Formato .dat de siempre: "voltage<TAB>|corriente|" y, con varias lecturas por punto, ademas desviacion estandar,
+    minimo y maximo (en el convenio de |corriente|, ver cabecera del modulo). Una linea (y un flush) por punto.
+    Con resumePoints (reanudacion de un sweep) se conservan las primeras resumePoints lineas del fichero y se añade
+    a continuacion.
+    """
+
+    def __init__(self, resultsFilePath, metadata=None, resumePoints=None):
+        self.resultsFilePath = resultsFilePath
+        if resumePoints is None:
+            self.f = open(resultsFilePath, "w")
+            return
+
+        with open(resultsFilePath, "r+b") as f:
+            data = f.read()
+            offset = 0
+            for point in range(resumePoints):
+                offset = data.find(b"\n", offset) + 1
+                if offset == 0:
+                    raise ValueError(resultsFilePath + " has less than " + str(resumePoints) + " points")
+            f.truncate(offset)
+        self.f = open(resultsFilePath, "a")
+
+    def append(self, setpoint, voltage, current, currents=None, timestamp=None):
+        sep = "\t"
+        if currents is not None:
+            # voltage, |media|, desviacion estandar, minimo y maximo de las lecturas del punto (cambiadas de signo
+            # si la media es negativa)
+            minimum, maximum = float(currents.min()), float(currents.max())
+            if current < 0:
+                minimum, maximum = -maximum, -minimum
+            self.f.write(str(voltage) + sep + str(abs(current)) + sep +
+                         str(float(currents.std(ddof=1))) + sep +
+                         str(minimum) + sep +
+                         str(maximum) + "\n")
+        else:
+            self.f.write(str(voltage) + sep + str(abs(current)) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class BinaryResultsWriter:
+    """
+    Formato binario .ivb (ver cabecera del modulo).
+
+    Args:
+        resultsFilePath (str): Fichero de resultados
+        metadata (dict): Cabecera del fichero (serializable a JSON)
+        batchSize (int): Registros que se acumulan en memoria antes de escribirlos en el fichero
+        durable (bool): Si True se hace fsync del journal en cada punto (sobrevive tambien a un corte de luz)
+        resumePoints (int): Reanudacion de un sweep: se recupera el journal, se conservan los primeros resumePoints
+            registros (y la cabecera original) y se añade a continuacion
+    """
+
+    def __init__(self, resultsFilePath, metadata=None, batchSize=32, durable=False, resumePoints=None):
+        self.resultsFilePath = resultsFilePath
+        self.journalFilePath = resultsFilePath + JOURNAL_SUFFIX
+        self.batchSize = batchSize
+        self.durable = durable
+        self.batch = []
+        self.index = 0
+
+        if resumePoints is None:
+            header = json.dumps(metadata if metadata is not None else {}, default=str).encode("utf-8")
+            self.f = open(resultsFilePath, "wb")
+            self.f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)) + header)
+        else:
+            if os.path.exists(self.journalFilePath):
+                recoverResultsFile(resultsFilePath)
+            self.f = open(resultsFilePath, "r+b")
+            metadata, dataOffset = _readHeader(self.f)
+            self.f.seek(0, os.SEEK_END)
+            if (self.f.tell() - dataOffset) // RECORD.size < resumePoints:
+                self.f.close()
+                raise ValueError(resultsFilePath + " has less than " + str(resumePoints) + " points")
+            self.f.truncate(dataOffset + resumePoints * RECORD.size)
+            self.f.seek(0, os.SEEK_END)
+            self.index = resumePoints
+        self.f.flush()
+        self.journal = os.open(self.journalFilePath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def append(self, setpoint, voltage, current, currents=None, timestamp=None):
+        if currents is not None:
+            record = RECORD.pack(self.index, len(currents), time.time() if timestamp is None else timestamp,
+                                 setpoint, voltage, current, float(currents.std(ddof=1)), float(currents.min()),
+                                 float(currents.max()))
+        else:
+            record = RECORD.pack(self.index, 1, time.time() if timestamp is None else timestamp,
+                                 setpoint, voltage, current, math.nan, current, current)
+        self.index += 1
+
+        os.write(self.journal, record)
+        if self.durable:
+            os.fsync(self.journal)
+
+        self.batch.append(record)
+        if len(self.batch) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        self.f.write(b"".join(self.batch))
+        self.f.flush()
+        if self.durable:
+            os.fsync(self.f.fileno())
+        self.batch = []
+        # todo lo que habia en el journal ya esta en el fichero
+        os.ftruncate(self.journal, 0)
+        os.lseek(self.journal, 0, os.SEEK_SET)
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        os.close(self.journal)
+        os.remove(self.journalFilePath)
+
+
+def openResultsWriter(resultsFormat, resultsFilePath, metadata=None, resumePoints=None):
+    """
+    :param resultsFormat: "dat" (texto, formato de siempre) o "binary" (.ivb)
+    :param resumePoints: None --> fichero nuevo, N --> se conservan los N primeros puntos y se añade a continuacion
+    """
+    if resultsFormat == "binary":
+        return BinaryResultsWriter(resultsFilePath, metadata, resumePoints=resumePoints)
+    if resultsFormat == "dat":
+        return DatResultsWriter(resultsFilePath, metadata, resumePoints=resumePoints)
+    raise ValueError("Unknown results format: " + str(resultsFormat))
+
+
+def _readHeader(f):
+    magic, version, headerLength = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError("Not a binary results file: " + str(f.name))
+    if version != VERSION:
+        raise ValueError("Unsupported binary results version " + str(version) + ": " + str(f.name))
+    return json.loads(f.read(headerLength).decode("utf-8")), PREAMBLE.size + headerLength
+
+
+def recoverResultsFile(resultsFilePath):
+    """
+    Deja el fichero consistente despues de un cierre inesperado: descarta un registro a medio escribir al final
+    y añade los registros del journal que no llegaron al fichero (los que tienen indice mayor que el ultimo).\n
+    :return: int con el numero de registros recuperados del journal
+    """
+    journalFilePath = resultsFilePath + JOURNAL_SUFFIX
+
+    with open(resultsFilePath, "r+b") as f:
+        metadata, dataOffset = _readHeader(f)
+        f.seek(0, os.SEEK_END)
+        records = (f.tell() - dataOffset) // RECORD.size
+        f.truncate(dataOffset + records * RECORD.size)
+
+        lastIndex = -1
+        if records > 0:
+            f.seek(dataOffset + (records - 1) * RECORD.size)
+            lastIndex = RECORD.unpack(f.read(RECORD.size))[0]
+
+        recovered = 0
+        if os.path.exists(journalFilePath):
+            with open(journalFilePath, "rb") as journal:
+                data = journal.read()
+            f.seek(0, os.SEEK_END)
+            for offset in range(0, len(data) - len(data) % RECORD.size, RECORD.size):
+                record = data[offset:offset + RECORD.size]
+                if RECORD.unpack(record)[0] > lastIndex:
+                    f.write(record)
+                    recovered += 1
+            os.remove(journalFilePath)
+
+    return recovered
+
+
+def readResultsFile(resultsFilePath):
+    """
+    :return: (dict con la cabecera, numpy structured array con dtype RECORD_DTYPE)
+    """
+    with open(resultsFilePath, "rb") as f:
+        metadata, dataOffset = _readHeader(f)
+        data = f.read()
+    return metadata, np.frombuffer(data[:len(data) - len(data) % RECORD.size], dtype=RECORD_DTYPE)
+
+
+def convertToDat(resultsFilePath, datFilePath=None):
+    """
+    Convierte un fichero .ivb al formato .dat de siempre (el mismo que escribe DatResultsWriter).\n
+    :return: str con la ruta del fichero .dat
+    """
+    if datFilePath is None:
+        datFilePath = os.path.splitext(resultsFilePath)[0] + ".dat"
+
+    metadata, records = readResultsFile(resultsFilePath)
+    writer = DatResultsWriter(datFilePath)
+    try:
+        for record in records:
+            currents = None
+            if record["readings"] > 1:
+                currents = _Statistics(record)
+            writer.append(float(record["setpoint"]), float(record["voltage"]), float(record["current"]), currents)
+    finally:
+        writer.close()
+
+    return datFilePath
+
+
+class _Statistics:
+    """
+    Estadisticos guardados en un registro con la interfaz de numpy.ndarray que usa DatResultsWriter.
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    def std(self, ddof=1):
+        return self.record["currentStd"]
+
+    def min(self):
+        return self.record["currentMin"]
+
+    def max(self):
+        return self.record["currentMax"]
+
+
+if __name__ == '__main__':
+    binaryFilePath = sys.argv[1]
+    if os.path.exists(binaryFilePath + JOURNAL_SUFFIX):
+        print("Recovered " + str(recoverResultsFile(binaryFilePath)) + " points from the journal")
+    print(convertToDat(binaryFilePath, sys.argv[2] if len(sys.argv) > 2 else None))
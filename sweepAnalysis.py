@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Analisis en bloque de los sweeps del archivo (sweepArchive.py).
+
+Todos los sweeps se cargan en matrices (sweeps x puntos, rellenadas con NaN) y las metricas se calculan de una vez
+con operaciones de NumPy sobre las filas, sin bucles por curva:
+    - corriente en tensiones fijas (interpolacion en log10(I) sobre la lectura de tension de la fuente)
+    - suelo de ruido: mediana de |I| en los puntos de baja tension
+    - tension de onset: primera tension de la malla comun en la que I supera onsetFactor veces el suelo de ruido
+    - tension de ruptura: primer punto en el que I salta mas de breakdownFactor veces respecto al anterior (el mismo
+      criterio que el overflow de start_process) y si el sweep quedo cortado antes de nominalFinalVoltage
+    - resistencia de aislamiento: ajuste lineal I = V / R + I0 por minimos cuadrados en la zona ohmica
+Las tensiones leidas de la fuente (2001.9999999999998, 5601.0...) se redondean a voltageResolution y los puntos
+pueden estar a distancias distintas en cada sweep: todo se remuestrea sobre una malla de tension comun.
+
+Con archivos grandes los sweeps se reparten por bloques en un pool de procesos; cada proceso abre los .npy de la
+cache con memory-map.
+
+Uso:
+    python sweepAnalysis.py [carpeta] [--voltages 1000 2000 5000] [--processes N] [--csv metricas.csv]
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sweepArchive import SweepArchive
+
+
+class AnalysisParameters:
+    """
+    Args:
+        fixedVoltages (tuple): Tensiones a las que se da la corriente. Volts
+        gridStep (float): Paso de la malla comun de tension. Volts
+        gridMaxVoltage (float): Ultima tension de la malla comun (None --> la mayor del archivo). Volts
+        voltageResolution (float): Resolucion a la que se redondean las lecturas de tension. Volts
+        noiseMaxVoltage (float): Los puntos hasta esta tension se usan para el suelo de ruido. Volts
+        onsetFactor (float): Veces el suelo de ruido a partir de las cuales se considera onset
+        breakdownFactor (float): Salto de corriente entre puntos consecutivos que se considera ruptura
+        nominalFinalVoltage (float): Tension final del sweep; si no se llega, el sweep se marca como cortado. Volts
+        fitMinVoltage (float): Inicio de la zona ohmica para el ajuste de resistencia de aislamiento. Volts
+        fitMaxVoltage (float): Fin de la zona ohmica. Volts
+        currentFloor (float): Corrientes por debajo de este valor se toman como este valor al pasar a log. Amps
+    """
+
+    def __init__(self, fixedVoltages=(1000, 2000, 5000, 10000), gridStep=100.0, gridMaxVoltage=None,
+                 voltageResolution=1e-3, noiseMaxVoltage=600.0, onsetFactor=10.0, breakdownFactor=100.0,
+                 nominalFinalVoltage=10000.0, fitMinVoltage=0.0, fitMaxVoltage=1000.0, currentFloor=1e-15):
+        self.fixedVoltages = tuple(float(voltage) for voltage in fixedVoltages)
+        self.gridStep = gridStep
+        self.gridMaxVoltage = gridMaxVoltage
+        self.voltageResolution = voltageResolution
+        self.noiseMaxVoltage = noiseMaxVoltage
+        self.onsetFactor = onsetFactor
+        self.breakdownFactor = breakdownFactor
+        self.nominalFinalVoltage = nominalFinalVoltage
+        self.fitMinVoltage = fitMinVoltage
+        self.fitMaxVoltage = fitMaxVoltage
+        self.currentFloor = currentFloor
+
+    def grid(self, maxVoltage):
+        if self.gridMaxVoltage is not None:
+            maxVoltage = self.gridMaxVoltage
+        return np.arange(0.0, maxVoltage + self.gridStep / 2, self.gridStep)
+
+
+def padSweeps(sweeps, voltageResolution):
+    """
+    :param sweeps: lista de arrays (puntos x columnas) con voltage en la columna 0 y |corriente| en la 1
+    :return: (voltage, current) matrices (sweeps x max puntos) ordenadas por tension en cada fila, NaN al final
+    """
+    maxPoints = max([len(sweep) for sweep in sweeps] + [1])
+    voltage = np.full((len(sweeps), maxPoints), np.nan)
+    current = np.full((len(sweeps), maxPoints), np.nan)
+    for row, sweep in enumerate(sweeps):
+        voltage[row, :len(sweep)] = sweep[:, 0]
+        current[row, :len(sweep)] = sweep[:, 1]
+
+    voltage = np.round(voltage / voltageResolution) * voltageResolution
+    current[~np.isfinite(voltage)] = np.nan
+    order = np.argsort(voltage, axis=1)  # los NaN quedan al final
+    return np.take_along_axis(voltage, order, axis=1), np.take_along_axis(current, order, axis=1)
+
+
+def resample(voltage, current, targetVoltages, currentFloor=1e-15):
+    """
+    Interpolacion en log10(|I|) de todas las filas a la vez sobre targetVoltages. Fuera del rango medido de cada
+    fila el resultado es NaN.\n
+    Las filas se colocan una detras de otra desplazadas en tension para que un solo searchsorted sirva para todas.\n
+    :return: matriz (filas x len(targetVoltages)) con la corriente interpolada. Amps
+    """
+    rows, points = voltage.shape
+    targetVoltages = np.asarray(targetVoltages, dtype=np.float64)
+    valid = np.isfinite(voltage) & np.isfinite(current)
+    counts = valid.sum(axis=1)
+    result = np.full((rows, len(targetVoltages)), np.nan)
+    if rows == 0 or not np.any(counts):
+        return result
+
+    logCurrent = np.log10(np.maximum(np.abs(np.where(valid, current, 1.0)), currentFloor))
+
+    # relleno del final de cada fila con su ultimo valor --> cada fila es no decreciente
+    lastIndex = np.maximum(counts - 1, 0)
+    columns = np.arange(points)
+    filledIndex = np.minimum(columns[None, :], lastIndex[:, None])
+    filledVoltage = np.take_along_axis(np.where(valid, voltage, 0.0), filledIndex, axis=1)
+    filledLogCurrent = np.take_along_axis(logCurrent, filledIndex, axis=1)
+
+    low = np.nanmin(np.where(valid, voltage, np.nan))
+    span = max(np.nanmax(np.where(valid, voltage, np.nan)), targetVoltages.max()) - \
+        min(low, targetVoltages.min()) + 1.0
+    offsets = np.arange(rows)[:, None] * span
+    flatVoltage = (filledVoltage - low + offsets).ravel()
+    flatTarget = (targetVoltages[None, :] - low + offsets)
+
+    upper = np.searchsorted(flatVoltage, flatTarget.ravel(), side="left").reshape(rows, -1)
+    upper = np.clip(upper - (np.arange(rows) * points)[:, None], 1, np.maximum(lastIndex, 1)[:, None])
+    lower = upper - 1
+
+    v0 = np.take_along_axis(filledVoltage, lower, axis=1)
+    v1 = np.take_along_axis(filledVoltage, upper, axis=1)
+    i0 = np.take_along_axis(filledLogCurrent, lower, axis=1)
+    i1 = np.take_along_axis(filledLogCurrent, upper, axis=1)
+    dv = v1 - v0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(dv > 0, (targetVoltages[None, :] - v0) / dv, 0.0)
+    interpolated = i0 + np.clip(fraction, 0.0, 1.0) * (i1 - i0)
+
+    firstVoltage = filledVoltage[:, 0:1]
+    lastVoltage = np.take_along_axis(filledVoltage, lastIndex[:, None], axis=1)
+    inRange = (targetVoltages[None, :] >= firstVoltage) & (targetVoltages[None, :] <= lastVoltage) & \
+        (counts[:, None] >= 2)
+    result[inRange] = 10 ** interpolated[inRange]
+    return result
+
+
+def firstVoltageWhere(condition, voltages):
+    """
+    :return: para cada fila, la tension de la primera columna en la que condition es True (NaN si ninguna)
+    """
+    voltages = np.broadcast_to(voltages, condition.shape)
+    first = np.argmax(condition, axis=1)
+    return np.where(condition.any(axis=1), voltages[np.arange(len(condition)), first], np.nan)
+
+
+def computeMetrics(sweeps, parameters, grid):
+    """
+    Metricas de un bloque de sweeps (ver cabecera del modulo).\n
+    :return: dict de arrays, una fila por sweep
+    """
+    voltage, current = padSweeps(sweeps, parameters.voltageResolution)
+    current = np.abs(current)
+    valid = np.isfinite(voltage) & np.isfinite(current)
+    points = valid.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore", all="ignore"):
+        maxVoltage = np.nanmax(np.where(valid, voltage, -np.inf), axis=1)
+        maxVoltage[points == 0] = np.nan
+
+        # suelo de ruido
+        lowVoltage = valid & (voltage <= parameters.noiseMaxVoltage)
+        noiseFloor = np.nanmedian(np.where(lowVoltage, current, np.nan), axis=1) \
+            if voltage.shape[1] else np.full(len(sweeps), np.nan)
+
+        # onset sobre la malla comun
+        gridCurrent = resample(voltage, current, grid, parameters.currentFloor)
+        onsetVoltage = firstVoltageWhere(gridCurrent > parameters.onsetFactor * noiseFloor[:, None], grid)
+
+        # ruptura: salto entre puntos consecutivos medidos
+        previous = np.maximum(current[:, :-1], parameters.currentFloor)
+        jump = valid[:, 1:] & valid[:, :-1] & (current[:, 1:] > parameters.breakdownFactor * previous)
+        breakdownVoltage = firstVoltageWhere(jump, voltage[:, 1:])
+        truncated = maxVoltage < parameters.nominalFinalVoltage * (1 - 1e-3)
+
+        # resistencia de aislamiento: I = V / R + I0 en la zona ohmica
+        fit = valid & (voltage >= parameters.fitMinVoltage) & (voltage <= parameters.fitMaxVoltage)
+        n = fit.sum(axis=1)
+        v = np.where(fit, voltage, 0.0)
+        i = np.where(fit, current, 0.0)
+        sv, si, svv, svi = v.sum(axis=1), i.sum(axis=1), (v * v).sum(axis=1), (v * i).sum(axis=1)
+        denominator = n * svv - sv * sv
+        slope = np.where((n >= 2) & (denominator > 0), (n * svi - sv * si) / denominator, np.nan)
+        fitOffset = np.where(n >= 2, (si - slope * sv) / n, np.nan)
+        insulationResistance = np.where(slope > 0, 1.0 / slope, np.inf)
+        insulationResistance[np.isnan(slope)] = np.nan
+
+    return {"points": points,
+            "maxVoltage": maxVoltage,
+            "noiseFloor": noiseFloor,
+            "onsetVoltage": onsetVoltage,
+            "breakdownVoltage": breakdownVoltage,
+            "truncated": truncated,
+            "insulationResistance": insulationResistance,
+            "fitOffset": fitOffset,
+            "currentAt": resample(voltage, current, parameters.fixedVoltages, parameters.currentFloor),
+            "gridCurrent": gridCurrent}
+
+
+def _analyzeChunk(cacheFilePaths, parameters, grid):
+    # cuerpo de cada proceso del pool: abre los .npy de la cache con memory-map
+    return computeMetrics([np.load(path, mmap_mode="r") for path in cacheFilePaths], parameters, grid)
+
+
+def analyzeSweeps(sweepFiles, parameters=None, processes=None, parallelThreshold=256, chunkSize=128):
+    """
+    Metricas de todos los sweeps dados.
+
+    Args:
+        sweepFiles (list): Lista de sweepArchive.SweepFile
+        parameters (AnalysisParameters): Parametros del analisis (None --> valores por defecto)
+        processes (int): Procesos del pool (None --> os.cpu_count(), 1 --> sin pool)
+        parallelThreshold (int): Por debajo de este numero de sweeps no se usa el pool
+        chunkSize (int): Sweeps por tarea del pool
+    Returns:
+        dict de arrays con una fila por sweep en el orden de sweepFiles, mas "grid" (malla comun), "voltages"
+        (tensiones de currentAt) y "files"
+    """
+    if parameters is None:
+        parameters = AnalysisParameters()
+
+    maxVoltage = max([float(np.max(sweepFile.voltage)) for sweepFile in sweepFiles if sweepFile.points] +
+                     [parameters.nominalFinalVoltage])
+    grid = parameters.grid(maxVoltage)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1 and len(sweepFiles) >= parallelThreshold:
+        cacheFilePaths = [os.path.join(sweepFile.archive.cacheDirectory, sweepFile.cacheFile)
+                          for sweepFile in sweepFiles]
+        chunks = [cacheFilePaths[start:start + chunkSize] for start in range(0, len(cacheFilePaths), chunkSize)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_analyzeChunk, chunks, [parameters] * len(chunks), [grid] * len(chunks)))
+        metrics = {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+    else:
+        metrics = computeMetrics([sweepFile.data for sweepFile in sweepFiles], parameters, grid)
+
+    metrics["grid"] = grid
+    metrics["voltages"] = np.array(parameters.fixedVoltages)
+    metrics["files"] = list(sweepFiles)
+    return metrics
+
+
+def agingTrends(metrics):
+    """
+    Evolucion de cada muestra con las horas de envejecimiento (usando, para medidas repetidas, el ultimo run).\n
+    :param metrics: resultado de analyzeSweeps
+    :return: dict muestra --> dict con hours, temperature, currentAt (horas x tensiones), ratioToInitial
+        (currentAt / currentAt de la primera medida), insulationResistance y decadesPer1000h (pendiente de
+        log10(I) frente a las horas para cada tension fija)
+    """
+    lastRuns = {}
+    for row, sweepFile in enumerate(metrics["files"]):
+        key = (sweepFile.sample, sweepFile.hours)
+        if key not in lastRuns or sweepFile.run > metrics["files"][lastRuns[key]].run:
+            lastRuns[key] = row
+
+    trends = {}
+    for sample in sorted({sample for sample, hours in lastRuns}):
+        rows = sorted((row for (s, hours), row in lastRuns.items() if s == sample),
+                      key=lambda row: metrics["files"][row].hours)
+        hours = np.array([metrics["files"][row].hours for row in rows])
+        currentAt = metrics["currentAt"][rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ratioToInitial = currentAt / currentAt[0:1]
+            logCurrent = np.log10(currentAt)
+
+        decadesPer1000h = np.full(currentAt.shape[1], np.nan)
+        for column in range(currentAt.shape[1]):
+            known = np.isfinite(logCurrent[:, column])
+            if known.sum() >= 2 and np.ptp(hours[known]) > 0:
+                decadesPer1000h[column] = 1000 * np.polyfit(hours[known], logCurrent[known, column], 1)[0]
+
+        trends[sample] = {"hours": hours,
+                          "temperature": np.array([metrics["files"][row].temperature for row in rows]),
+                          "currentAt": currentAt,
+                          "ratioToInitial": ratioToInitial,
+                          "insulationResistance": metrics["insulationResistance"][rows],
+                          "decadesPer1000h": decadesPer1000h}
+    return trends
+
+
+def metricsTable(metrics, sep="\t"):
+    header = ["file", "sample", "temperature_C", "hours", "run", "points", "maxVoltage_V", "noiseFloor_A",
+              "onsetVoltage_V", "breakdownVoltage_V", "truncated", "insulationResistance_ohm"] + \
+             ["I@%gV_A" % voltage for voltage in metrics["voltages"]]
+    lines = [sep.join(header)]
+    for row, sweepFile in enumerate(metrics["files"]):
+        values = [sweepFile.path, sweepFile.sample, "%g" % sweepFile.temperature, "%g" % sweepFile.hours,
+                  str(sweepFile.run), str(metrics["points"][row]), "%g" % metrics["maxVoltage"][row],
+                  "%.4e" % metrics["noiseFloor"][row], "%g" % metrics["onsetVoltage"][row],
+                  "%g" % metrics["breakdownVoltage"][row], str(bool(metrics["truncated"][row])),
+                  "%.4e" % metrics["insulationResistance"][row]] + \
+                 ["%.4e" % current for current in metrics["currentAt"][row]]
+        lines.append(sep.join(values))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk metrics and aging trends of the sweep archive")
+    parser.add_argument("root", nargs="?", default=".", help="archive folder")
+    parser.add_argument("--voltages", type=float, nargs="+", default=[1000, 2000, 5000, 10000],
+                        help="fixed voltages for the current table (V)")
+    parser.add_argument("--processes", type=int, default=None, help="process pool size (1 = no pool)")
+    parser.add_argument("--csv", help="write the per-file metrics to this file")
+    args = parser.parse_args()
+
+    archive = SweepArchive(args.root)
+    sweepFiles = archive.query(sortBy=("sample", "hours"))
+    metrics = analyzeSweeps(sweepFiles, AnalysisParameters(fixedVoltages=args.voltages), args.processes)
+
+    table = metricsTable(metrics)
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(table.replace("\t", ","))
+    print(table)
+
+    print("%-8s %s" % ("sample", "hours --> I@%gV (x initial)  |  decades/1000h" % metrics["voltages"][0]))
+    for sample, trend in agingTrends(metrics).items():
+        evolution = "  ".join("%gh:%.3e(x%.2f)" % (hours, current, ratio) for hours, current, ratio in
+                              zip(trend["hours"], trend["currentAt"][:, 0], trend["ratioToInitial"][:, 0]))
+        print("%-8s %s  |  %.3f" % (sample, evolution, trend["decadesPer1000h"][0]))
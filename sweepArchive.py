@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Indice y cache del archivo de sweeps (ficheros de resultados de start_process).
+
+Los ficheros siguen el convenio <muestra>@<temperatura>_<horas>h.dat (p.ej. s10@225_2002h.dat) y las repeticiones
+de una misma medida llevan un numero de run, antes o despues de las horas: s1@250_28h_2.dat, s5@250_2_748h.dat.
+Se buscan recursivamente bajo la carpeta raiz (p.ej. tambien "medidas iniciales/s1@250_0h.dat"). Tambien se
+indexan los ficheros binarios .ivb de resultsWriter.py.
+
+Cada fichero se parsea una sola vez: sus columnas se guardan como .npy en <raiz>/.sweepcache y se abren con
+memory-map. El indice (cache.json) guarda mtime y tamaño de cada fichero de texto; si cambian, el fichero se vuelve
+a parsear. Las consultas (SweepArchive.query) se responden solo con el indice, sin abrir los ficheros de texto.
+
+Uso:
+    python sweepArchive.py [carpeta] [--sample s5] [--temperature 250] [--hours 748]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from resultsWriter import readResultsFile
+
+CACHE_DIRECTORY = ".sweepcache"
+INDEX_FILE = "cache.json"
+INDEX_VERSION = 1
+SWEEP_EXTENSIONS = (".dat", ".ivb")
+
+# muestra@temperatura[_run]_horas h[_run]
+SWEEP_FILE_NAME = re.compile(r"^(?P<sample>[^@]+)@(?P<temperature>\d+(?:\.\d+)?)"
+                             r"(?:_(?P<runBefore>\d+))?_(?P<hours>\d+(?:\.\d+)?)h"
+                             r"(?:_(?P<runAfter>\d+))?$")
+
+
+def parseSweepFileName(fileName):
+    """
+    :return: dict con sample, temperature (ºC), hours y run (1 para la primera medida) o None si el nombre no
+        sigue el convenio
+    """
+    match = SWEEP_FILE_NAME.match(os.path.splitext(os.path.basename(fileName))[0])
+    if match is None:
+        return None
+
+    run = match.group("runBefore") or match.group("runAfter") or "1"
+    return {"sample": match.group("sample"),
+            "temperature": float(match.group("temperature")),
+            "hours": float(match.group("hours")),
+            "run": int(run)}
+
+
+def loadSweepFile(filePath):
+    """
+    Lee un fichero de resultados (.dat de texto o .ivb binario).\n
+    :return: numpy.ndarray (puntos x columnas) float64: voltage, |corriente| y, si el sweep se hizo con varias
+        lecturas por punto, desviacion estandar, minimo y maximo (en el convenio de |corriente| del .dat, ver
+        resultsWriter)
+    """
+    if filePath.endswith(".ivb"):
+        metadata, records = readResultsFile(filePath)
+        if np.all(records["readings"] <= 1):
+            return np.column_stack((records["voltage"], np.abs(records["current"])))
+        negative = records["current"] < 0
+        return np.column_stack((records["voltage"], np.abs(records["current"]), records["currentStd"],
+                                np.where(negative, -records["currentMax"], records["currentMin"]),
+                                np.where(negative, -records["currentMin"], records["currentMax"])))
+
+    if os.path.getsize(filePath) == 0:
+        return np.empty((0, 2))
+    return np.loadtxt(filePath, dtype=np.float64, ndmin=2)
+
+
+class SweepFile:
+    """
+    Una entrada del indice. Los datos se abren (memory-map del .npy de la cache) la primera vez que se piden.
+
+    Args:
+        archive (SweepArchive): Archivo al que pertenece
+        path (str): Ruta relativa a la raiz del archivo
+        entry (dict): Entrada del indice
+    """
+
+    def __init__(self, archive, path, entry):
+        self.archive = archive
+        self.path = path
+        self.sample = entry["sample"]
+        self.temperature = entry["temperature"]
+        self.hours = entry["hours"]
+        self.run = entry["run"]
+        self.points = entry["points"]
+        self.columns = entry["columns"]
+        self.cacheFile = entry["cacheFile"]
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(os.path.join(self.archive.cacheDirectory, self.cacheFile), mmap_mode="r")
+        return self._data
+
+    @property
+    def voltage(self):
+        return self.data[:, 0]
+
+    @property
+    def current(self):
+        return self.data[:, 1]
+
+    def __repr__(self):
+        return "SweepFile(%s, sample=%s, temperature=%g, hours=%g, run=%d, points=%d)" % (
+            self.path, self.sample, self.temperature, self.hours, self.run, self.points)
+
+
+class SweepArchive:
+    """
+    Indice de todos los sweeps bajo una carpeta, con cache memory-mapped de sus datos.
+
+    Args:
+        rootDirectory (str): Carpeta raiz del archivo
+        refresh (bool): Si True se revisa la carpeta al crear el objeto (ver refresh())
+    """
+
+    def __init__(self, rootDirectory=".", refresh=True):
+        self.rootDirectory = os.path.abspath(rootDirectory)
+        self.cacheDirectory = os.path.join(self.rootDirectory, CACHE_DIRECTORY)
+        self.indexFilePath = os.path.join(self.cacheDirectory, INDEX_FILE)
+        self.entries = {}
+        self.unmatched = []  # ficheros de resultados cuyo nombre no sigue el convenio (p.ej. empty.dat)
+        self.loadIndex()
+        if refresh:
+            self.refresh()
+
+    def loadIndex(self):
+        self.entries = {}
+        if not os.path.exists(self.indexFilePath):
+            return
+        try:
+            with open(self.indexFilePath) as f:
+                index = json.load(f)
+        except ValueError:
+            return
+        if index.get("version") == INDEX_VERSION:
+            self.entries = index["entries"]
+
+    def saveIndex(self):
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+        temporaryFilePath = self.indexFilePath + ".tmp"
+        with open(temporaryFilePath, "w") as f:
+            json.dump({"version": INDEX_VERSION, "entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(temporaryFilePath, self.indexFilePath)
+
+    def findSweepFiles(self):
+        for directory, directories, files in os.walk(self.rootDirectory):
+            directories[:] = sorted(d for d in directories if not d.startswith("."))
+            for fileName in sorted(files):
+                if fileName.endswith(SWEEP_EXTENSIONS):
+                    yield os.path.relpath(os.path.join(directory, fileName), self.rootDirectory)
+
+    def refresh(self):
+        """
+        Revisa la carpeta: parsea los ficheros nuevos o modificados (mtime o tamaño distintos a los del indice) y
+        quita del indice los que ya no existen.\n
+        :return: int con el numero de ficheros (re)parseados
+        """
+        parsed = 0
+        found = set()
+        self.unmatched = []
+
+        for path in self.findSweepFiles():
+            nameFields = parseSweepFileName(path)
+            if nameFields is None:
+                self.unmatched.append(path)
+                continue
+            found.add(path)
+
+            stat = os.stat(os.path.join(self.rootDirectory, path))
+            entry = self.entries.get(path)
+            if entry is not None and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size and \
+                    os.path.exists(os.path.join(self.cacheDirectory, entry["cacheFile"])):
+                continue
+
+            self.entries[path] = self.cacheSweepFile(path, nameFields, stat)
+            parsed += 1
+
+        removed = set(self.entries) - found
+        for path in removed:
+            self.removeCacheFile(self.entries.pop(path)["cacheFile"])
+
+        if parsed or removed or not os.path.exists(self.indexFilePath):
+            self.saveIndex()
+        return parsed
+
+    def cacheSweepFile(self, path, nameFields, stat):
+        data = loadSweepFile(os.path.join(self.rootDirectory, path))
+
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+        cacheFile = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16] + ".npy"
+        temporaryFilePath = os.path.join(self.cacheDirectory, cacheFile + ".tmp")
+        with open(temporaryFilePath, "wb") as f:
+            np.save(f, np.ascontiguousarray(data, dtype=np.float64))
+        os.replace(temporaryFilePath, os.path.join(self.cacheDirectory, cacheFile))
+
+        entry = dict(nameFields)
+        entry.update({"mtime_ns": stat.st_mtime_ns,
+                      "size": stat.st_size,
+                      "points": int(data.shape[0]),
+                      "columns": int(data.shape[1]),
+                      "cacheFile": cacheFile})
+        return entry
+
+    def removeCacheFile(self, cacheFile):
+        try:
+            os.remove(os.path.join(self.cacheDirectory, cacheFile))
+        except FileNotFoundError:
+            pass
+
+    def files(self):
+        return [SweepFile(self, path, entry) for path, entry in self.entries.items()]
+
+    def query(self, sample=None, temperature=None, hours=None, run=None, minPoints=0, sortBy="hours"):
+        """
+        Sweeps del indice que cumplen todos los filtros dados (None --> sin filtro).\n
+        p.ej. query(sample="s5", temperature=250) --> todos los sweeps de s5 a 250ºC ordenados por horas\n
+        :param run: numero de run o "last" para quedarse solo con la ultima repeticion de cada medida
+        :param minPoints: descarta los sweeps con menos puntos (medidas parciales)
+        :param sortBy: campo (o tupla de campos) por el que se ordena el resultado
+        :return: lista de SweepFile
+        """
+        result = []
+        for sweepFile in self.files():
+            if sample is not None and sweepFile.sample != sample:
+                continue
+            if temperature is not None and sweepFile.temperature != temperature:
+                continue
+            if hours is not None and sweepFile.hours != hours:
+                continue
+            if run is not None and run != "last" and sweepFile.run != run:
+                continue
+            if sweepFile.points < minPoints:
+                continue
+            result.append(sweepFile)
+
+        if run == "last":
+            lastRuns = {}
+            for sweepFile in result:
+                key = (sweepFile.sample, sweepFile.temperature, sweepFile.hours)
+                if key not in lastRuns or sweepFile.run > lastRuns[key].run:
+                    lastRuns[key] = sweepFile
+            result = list(lastRuns.values())
+
+        sortFields = (sortBy,) if isinstance(sortBy, str) else tuple(sortBy)
+        result.sort(key=lambda sweepFile: tuple(getattr(sweepFile, field) for field in sortFields) +
+                    (sweepFile.sample, sweepFile.hours, sweepFile.run, sweepFile.path))
+        return result
+
+    def samples(self):
+        return sorted({entry["sample"] for entry in self.entries.values()},
+                      key=lambda sample: (re.sub(r"\d+", "", sample), int(re.sub(r"\D", "", sample) or 0)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index and cache of the sweep results archive")
+    parser.add_argument("root", nargs="?", default=".", help="archive folder")
+    parser.add_argument("--sample", help="e.g. s5")
+    parser.add_argument("--temperature", type=float, help="ºC")
+    parser.add_argument("--hours", type=float, help="aging hours")
+    parser.add_argument("--last-run", action="store_true", help="only the last run of repeated measurements")
+    args = parser.parse_args()
+
+    archive = SweepArchive(args.root)
+    sweepFiles = archive.query(sample=args.sample, temperature=args.temperature, hours=args.hours,
+                               run="last" if args.last_run else None, sortBy=("sample", "hours"))
+
+    print("%-8s %8s %8s %4s %7s %10s  %s" % ("sample", "temp_C", "hours", "run", "points", "Vmax_V", "file"))
+    for sweepFile in sweepFiles:
+        print("%-8s %8g %8g %4d %7d %10.1f  %s" % (
+            sweepFile.sample, sweepFile.temperature, sweepFile.hours, sweepFile.run, sweepFile.points,
+            float(sweepFile.voltage.max()) if sweepFile.points else float("nan"), sweepFile.path))
+    if archive.unmatched:
+        print("Not indexed (name does not follow sample@temperature_hoursh): " + ", ".join(archive.unmatched))
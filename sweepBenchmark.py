@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark del ritmo del sweep. Ejecuta main.start_process completo contra el banco simulado (instrumentSimulator.py)
+para una o varias latencias GPIB y muestra, para cada ejecucion: segundos por punto, tiempo total del sweep y tiempo
+muerto (tiempo en el que ni el bus ni ningun instrumento hacian trabajo real: transferencia GPIB, integracion del
+K2400 o rampa de la fuente HV).
+
+Uso:
+    python sweepBenchmark.py [--config process_config_file.json] [--points 5] [--final-voltage 1000]
+                             [--ramp 500] [--measure-delay MS] [--nplc N]
+                             [--latency 0 0.005 0.02] [--sync delay opc srq] [--sequential]
+                             [--json bench_output.txt] [--verbose]
+                             [--replay Capture.nitrace [--replay-time-scale 1.0]]
+
+Con --replay los instrumentos y comandos grabados en la captura de NI Spy responden con las respuestas y tiempos
+grabados (niSpyCapture.ReplayResourceManager); todo lo demas sigue yendo al banco simulado.
+
+--sequential compara con el sweep sin E/S concurrente de la fuente HV y el K2400. En cada punto solo se solapan la
+lectura de la fuente HV (~0.5s) y la integracion del K2400, y se ahorra la mas corta de las dos; la estabilizacion y
+el measure delay se esperan igual en los dos modos (ver concurrentInstrumentIO.py). Ejemplo (3 puntos hasta 600V,
+rampa 500V/s, sin latencia, opc; 8 promedios por lectura):
+    --measure-delay 0    --nplc 1:   15.88s sequential, 15.26s concurrent (integracion 0.16s por punto)
+    --measure-delay 1500 --nplc 10:  27.64s sequential, 25.63s concurrent (lectura HV 0.5s por punto)
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from instrumentSimulator import SimulatedBench
+from niSpyCapture import ReplayResourceManager, parseCapture
+from sweepConfig import SweepConfig
+import main
+
+
+def runSweepBenchmark(sweepParameters, transactionLatency=0.0, leakageCurve=None, verbose=False,
+                      synchronizationMode=None, concurrentInstrumentIO=None, replayCalls=None, replayTimeScale=1.0):
+    """
+    Ejecuta un sweep completo contra un banco simulado nuevo.
+
+    Args:
+        sweepParameters (dict): Argumentos de main.start_process (sin resultsFilePath / resourceManager)
+        transactionLatency (float): Latencia simulada de cada transaccion GPIB. Seconds
+        leakageCurve (instrumentSimulator.LeakageCurve): Modelo de corriente de la muestra simulada
+        verbose (bool): Si False se descarta la salida por consola de start_process
+        synchronizationMode (str): main.SYNC_DELAY, main.SYNC_OPC o main.SYNC_SRQ (None --> el valor de main)
+        concurrentInstrumentIO (bool): Solapar la E/S de la fuente HV y el K2400 en cada punto (None --> el valor de
+            main)
+        replayCalls (list): Llamadas VISA de una captura de NI Spy (niSpyCapture.parseCapture) a reproducir encima
+            del banco
+        replayTimeScale (float): Factor de las duraciones grabadas (1 original, 0 sin esperas)
+    Returns:
+        dict con las medidas de la ejecucion
+    """
+    bench = SimulatedBench(sweepParameters["K2400_gpibAddress"], sweepParameters["HVSource_gpibAddress"],
+                           transactionLatency=transactionLatency, leakageCurve=leakageCurve)
+    resourceManager = bench.resourceManager()
+    if replayCalls is not None:
+        resourceManager = ReplayResourceManager(replayCalls, replayTimeScale, fallbackResourceManager=resourceManager)
+    # instrumentos nuevos: lo que main recuerde de sweeps anteriores no les aplica
+    main.appliedInstrumentSettings.clear()
+
+    # los puntos se cuentan con progressCallback (vale para cualquier resultsFormat)
+    pointCount = [0]
+    sweepProgressCallback = sweepParameters.get("progressCallback")
+
+    def progress(points, voltage, current):
+        pointCount[0] = points
+        if sweepProgressCallback is not None:
+            sweepProgressCallback(points, voltage, current)
+
+    parameters = dict(sweepParameters, progressCallback=progress)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        extension = "ivb" if parameters.get("resultsFormat") == "binary" else "dat"
+        resultsFilePath = os.path.join(tmpDir, "benchmark." + extension)
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+        previousSynchronizationMode = main.synchronizationMode
+        previousConcurrentInstrumentIO = main.concurrentInstrumentIO
+        if synchronizationMode is not None:
+            main.synchronizationMode = synchronizationMode
+        if concurrentInstrumentIO is not None:
+            main.concurrentInstrumentIO = concurrentInstrumentIO
+        startTime = time.time()
+        try:
+            with output:
+                main.start_process(resultsFilePath=resultsFilePath, resourceManager=resourceManager, **parameters)
+        finally:
+            endTime = time.time()
+            main.synchronizationMode = previousSynchronizationMode
+            main.concurrentInstrumentIO = previousConcurrentInstrumentIO
+
+    points = pointCount[0]
+    totalTime = endTime - startTime
+    busyTime = bench.busyTime(startTime, endTime)
+    deadTime = totalTime - busyTime
+
+    return {"synchronizationMode": main.synchronizationMode if synchronizationMode is None else synchronizationMode,
+            "concurrentInstrumentIO": main.concurrentInstrumentIO if concurrentInstrumentIO is None
+            else concurrentInstrumentIO,
+            "transactionLatency": transactionLatency,
+            "points": points,
+            "totalTime": totalTime,
+            "secondsPerPoint": totalTime / points if points else float("nan"),
+            "busyTime": busyTime,
+            "deadTime": deadTime,
+            "deadTimePercent": 100 * deadTime / totalTime if totalTime > 0 else 0.0,
+            "transactions": bench.transactionCount}
+
+
+def printBenchmarkReport(results):
+    header = "%6s %5s %10s %8s %12s %12s %12s %12s %8s %8s" % ("sync", "conc", "latency_s", "points", "total_s",
+                                                               "s/point", "busy_s", "dead_s", "dead_%", "xfers")
+    print(header)
+    print(len(header) * "-")
+    for r in results:
+        print("%6s %5s %10.4f %8d %12.2f %12.3f %12.2f %12.2f %8.1f %8d" % (r["synchronizationMode"],
+                                                                        "yes" if r["concurrentInstrumentIO"]
+                                                                        else "no",
+                                                                        r["transactionLatency"], r["points"],
+                                                                        r["totalTime"], r["secondsPerPoint"],
+                                                                        r["busyTime"], r["deadTime"],
+                                                                        r["deadTimePercent"], r["transactions"]))
+
+
+def sweepParametersFromConfig(configFilePath, finalVoltage=None, pointsVoltage=None, rampVoltage=None,
+                              measureDelay_ms=None, ammeterNPLCs=None):
+    """
+    Argumentos de main.start_process a partir de la configuracion validada (sweepConfig.SweepConfig) con los valores
+    del benchmark encima (None --> el valor configurado). Sin resultsFilePath, resume ni livePort: cada ejecucion es
+    un sweep nuevo en un directorio temporal.
+    """
+    overrides = {"finalVoltage": finalVoltage, "pointsVoltage": pointsVoltage, "rampVoltage": rampVoltage,
+                 "measureDelay_ms": measureDelay_ms, "ammeterNPLCs": ammeterNPLCs}
+    config = SweepConfig.fromConfigFile(configFilePath).replace(
+        **{name: value for name, value in overrides.items() if value is not None})
+    parameters = config.startProcessParameters()
+    for name in ("resultsFilePath", "resume", "livePort"):
+        parameters.pop(name)
+    return parameters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep throughput benchmark against the simulated bench")
+    parser.add_argument("--config", default="process_config_file.json")
+    parser.add_argument("--points", type=int, default=5, help="pointsVoltage override")
+    parser.add_argument("--final-voltage", type=float, default=1000, help="finalVoltage override (V)")
+    parser.add_argument("--ramp", type=float, default=500, help="rampVoltage override (V/s)")
+    parser.add_argument("--measure-delay", type=float, default=None, help="measureDelay_ms override (ms)")
+    parser.add_argument("--nplc", type=float, default=None, help="ammeterNPLCs override")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0, 0.005, 0.02],
+                        help="GPIB transaction latencies to benchmark (s)")
+    parser.add_argument("--sync", nargs="+", default=[main.synchronizationMode],
+                        choices=[main.SYNC_DELAY, main.SYNC_OPC, main.SYNC_SRQ],
+                        help="K2400 synchronization modes to benchmark")
+    parser.add_argument("--sequential", action="store_true",
+                        help="also benchmark without concurrent HV / K2400 I/O")
+    parser.add_argument("--json", default=None, help="also write the results as json to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the console output of the sweeps")
+    parser.add_argument("--replay", default=None, help="NI Spy capture (.nitrace) to replay on top of the bench")
+    parser.add_argument("--replay-time-scale", type=float, default=1.0,
+                        help="factor applied to the recorded VISA call durations")
+    args = parser.parse_args()
+
+    replayCalls = parseCapture(args.replay) if args.replay is not None else None
+
+    parameters = sweepParametersFromConfig(args.config, args.final_voltage, args.points, args.ramp,
+                                           args.measure_delay, args.nplc)
+
+    concurrencyModes = [False, True] if args.sequential else [True]
+    results = [runSweepBenchmark(parameters, latency, verbose=args.verbose, synchronizationMode=sync,
+                                 concurrentInstrumentIO=concurrent, replayCalls=replayCalls,
+                                 replayTimeScale=args.replay_time_scale)
+               for sync in args.sync for concurrent in concurrencyModes for latency in args.latency]
+    printBenchmarkReport(results)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
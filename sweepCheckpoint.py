@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint de un sweep para poder reanudarlo despues de una interrupcion (start_process(..., resume=True)).
+
+Junto al fichero de resultados se guarda <resultados>.checkpoint (JSON) con el estado del sweep despues del ultimo
+punto escrito: puntos escritos, pasos, ultimo setpoint completado, siguiente setpoint pendiente, previous_current y
+estado del controlador adaptativo. Tambien guarda el hash de la configuracion del sweep, la identificacion de los
+instrumentos y la configuracion aplicada a cada uno. Lo escribe el hilo del fichero de resultados
+(livePoints.ResultsFileConsumer) justo despues de escribir cada punto, asi nunca va por delante del fichero.
+
+Al reanudar se comprueba que la configuracion, los instrumentos y su configuracion son los mismos, el fichero de
+resultados se recorta al ultimo punto del checkpoint y la fuente va directamente (con su rampa) al setpoint
+pendiente.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+CHECKPOINT_VERSION = 1
+
+# parametros que no cambian la medida: pueden ser distintos al reanudar (p.ej. la estacion se ha recableado)
+RESUME_IGNORED_CONFIG_KEYS = ("gpibBoard", "K2400_gpibAddress", "HVSource_gpibAddress")
+
+
+class SweepResumeError(RuntimeError):
+    """
+    El sweep interrumpido no se puede reanudar con la configuracion o los instrumentos actuales.
+    """
+    pass
+
+
+def checkpointFilePath(resultsFilePath):
+    return resultsFilePath + CHECKPOINT_SUFFIX
+
+
+def sweepConfigHash(config):
+    """
+    :param config: dict con los parametros del sweep (la "config" de la cabecera del fichero de resultados)
+    :return: str sha1 de los parametros que afectan a la medida
+    """
+    relevantConfig = {key: value for key, value in config.items() if key not in RESUME_IGNORED_CONFIG_KEYS}
+    return hashlib.sha1(json.dumps(relevantConfig, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def loadCheckpoint(resultsFilePath):
+    """
+    :return: dict con el checkpoint o None si no hay (o no es de esta version)
+    """
+    filePath = checkpointFilePath(resultsFilePath)
+    if not os.path.exists(filePath):
+        return None
+    with open(filePath) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        return None
+    return checkpoint
+
+
+class SweepCheckpoint:
+    """
+    Fichero de checkpoint de un sweep.
+
+    Args:
+        resultsFilePath (str): Fichero de resultados del sweep
+        configHash (str): sweepConfigHash de la configuracion del sweep
+        resultsFormat (str): Formato del fichero de resultados ("dat" o "binary")
+        instruments (dict): Identificacion de los instrumentos (*IDN? / ID)
+    """
+
+    def __init__(self, resultsFilePath, configHash, resultsFormat, instruments):
+        self.filePath = checkpointFilePath(resultsFilePath)
+        self.checkpoint = {"version": CHECKPOINT_VERSION,
+                           "configHash": configHash,
+                           "resultsFormat": resultsFormat,
+                           "instruments": instruments,
+                           "instrumentSettings": None,
+                           "complete": False,
+                           "state": None}
+
+    def setInstrumentSettings(self, instrumentSettings):
+        """
+        :param instrumentSettings: dict con la configuracion aplicada a cada instrumento al inicializarlo
+        """
+        self.checkpoint["instrumentSettings"] = instrumentSettings
+
+    def save(self, state):
+        """
+        Guarda el estado del sweep (reemplazo atomico: un corte deja el checkpoint anterior o el nuevo).
+        """
+        self.checkpoint["state"] = state
+        self.checkpoint["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        temporaryFilePath = self.filePath + ".tmp"
+        with open(temporaryFilePath, "w") as f:
+            json.dump(self.checkpoint, f, indent=1, default=float)
+        os.replace(temporaryFilePath, self.filePath)
+
+    def markComplete(self):
+        self.checkpoint["complete"] = True
+        self.save(self.checkpoint["state"])
+
+    def restore(self, checkpoint):
+        """
+        Sigue con el checkpoint de un sweep interrumpido (conserva instrumentSettings y el ultimo estado).
+        """
+        self.checkpoint["instrumentSettings"] = checkpoint["instrumentSettings"]
+        self.checkpoint["state"] = checkpoint["state"]
+
+
+def validateResume(checkpoint, configHash, resultsFormat, instruments=None):
+    """
+    Comprueba que el sweep interrumpido se hizo con la misma configuracion, formato de resultados e instrumentos.
+    La identificacion de un instrumento solo se compara si se conoce en los dos lados.
+    """
+    if checkpoint["configHash"] != configHash:
+        raise SweepResumeError("The sweep configuration has changed since the sweep was interrupted")
+    if checkpoint["resultsFormat"] != resultsFormat:
+        raise SweepResumeError("The interrupted sweep was written as '" + str(checkpoint["resultsFormat"]) +
+                               "', not '" + str(resultsFormat) + "'")
+    if instruments is not None:
+        for name, identification in instruments.items():
+            previousIdentification = checkpoint["instruments"].get(name)
+            if identification is not None and previousIdentification is not None and \
+                    identification != previousIdentification:
+                raise SweepResumeError("Instrument " + name + " is not the one used in the interrupted sweep: " +
+                                       str(identification) + " != " + str(previousIdentification))
+
+
+def validateInstrumentSettings(checkpoint, instrumentSettings):
+    """
+    Comprueba que la configuracion aplicada ahora a cada instrumento es la del sweep interrumpido.
+    """
+    previousSettings = checkpoint["instrumentSettings"]
+    if previousSettings is None:
+        return
+    for name, settings in instrumentSettings.items():
+        previous = previousSettings.get(name)
+        if previous is None:
+            continue
+        changed = sorted(key for key in set(settings) | set(previous) if settings.get(key) != previous.get(key))
+        if changed:
+            raise SweepResumeError("Instrument " + name + " settings differ from the interrupted sweep: " +
+                                   ", ".join(changed))
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Configuracion validada de un sweep y plan del sweep con estimacion de su duracion.
+
+SweepConfig lee process_config_file.json, convierte cada valor a su tipo (p.ej. enableKill: "True" / "False" /
+true / false --> bool) y comprueba rangos y limites de seguridad antes de tocar ningun instrumento: todos los
+errores se dan a la vez en un ConfigError.
+
+SweepPlan compila la configuracion en el plan explicito del sweep: todos los setpoints, el tiempo de rampa de cada
+salto segun rampVoltage, la espera measureDelay_ms, el tiempo de integracion del K2400 (NPLC x promedios x
+lecturas) y los limites de seguridad. estimate() predice la duracion del sweep por fases con el mismo modelo de
+tiempos que start_process (ver TimingModel). En modo adaptativo los setpoints dependen de la corriente medida: el
+plan usa maxPoints puntos equiespaciados (cota superior).
+
+Uso (dry-run, no abre ningun instrumento):
+    python sweepConfig.py [process_config_file.json] [--setpoints] [--line-frequency 50]
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+
+from adaptiveStepping import SWEEP_ADAPTIVE, SWEEP_LINEAR
+
+RESULTS_FORMATS = ("dat", "binary")
+
+HV_SOURCE_MAX_VOLTAGE = 12000.0  # HPP-120, Volts
+GPIB_ADDRESSES = range(0, 31)
+
+# fases de la estimacion
+PHASE_INIT = "init"
+PHASE_RAMP = "ramp"
+PHASE_SETTLE = "settle"
+PHASE_DWELL = "dwell"
+PHASE_ACQUIRE = "acquire"
+PHASE_SHUTDOWN = "shutdown"
+ESTIMATE_PHASES = (PHASE_INIT, PHASE_RAMP, PHASE_SETTLE, PHASE_DWELL, PHASE_ACQUIRE, PHASE_SHUTDOWN)
+
+
+class ConfigError(ValueError):
+    """
+    Configuracion de sweep no valida. problems: lista con todos los errores encontrados.
+    """
+
+    def __init__(self, problems):
+        ValueError.__init__(self, "Invalid sweep configuration:\n  " + "\n  ".join(problems))
+        self.problems = problems
+
+
+def parseBoolean(value):
+    """
+    true / false / "True" / "False" / "1" / "0" / "on" / "off" --> bool
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "1", "yes", "on", "en"):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ("false", "0", "no", "off", "dis"):
+        return False
+    raise ValueError("not a boolean: " + repr(value))
+
+
+def parseInteger(value):
+    """
+    25 / 25.0 / "25" --> 25. Los bool y los valores no enteros (25.5, "25.5") no son validos (int() los truncaria)
+    """
+    if isinstance(value, bool):
+        raise ValueError("not an integer: " + repr(value))
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("not an integer: " + repr(value))
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())
+    if isinstance(value, int):
+        return value
+    raise TypeError("not an integer: " + repr(value))
+
+
+def parseFloat(value):
+    """
+    2.5 / 25 / "2.5e3" --> float. Los bool, NaN e infinito no son validos
+    """
+    if isinstance(value, bool):
+        raise ValueError("not a float: " + repr(value))
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("not a float: " + repr(value))
+    return value
+
+
+def linearSetpoints(initialVoltage, finalVoltage, pointsVoltage):
+    """
+    :return: numpy.ndarray con los pointsVoltage + 1 setpoints del sweep lineal (extremos exactos). Volts
+    """
+    return np.linspace(float(initialVoltage), float(finalVoltage), int(pointsVoltage) + 1)
+
+
+# nombre, tipo, valor por defecto (REQUIRED --> obligatorio)
+REQUIRED = object()
+CONFIG_FIELDS = (("K2400_gpibAddress", parseInteger, REQUIRED),
+                 ("HVSource_gpibAddress", parseInteger, REQUIRED),
+                 ("gpibBoard", parseInteger, 0),
+                 ("initialVoltage", parseFloat, REQUIRED),
+                 ("finalVoltage", parseFloat, REQUIRED),
+                 ("pointsVoltage", parseInteger, REQUIRED),
+                 ("measureDelay_ms", parseFloat, REQUIRED),
+                 ("rampVoltage", parseFloat, REQUIRED),
+                 ("outputCurrentLimit", parseFloat, REQUIRED),
+                 ("enableKill", parseBoolean, REQUIRED),
+                 ("ammeterRange", parseFloat, REQUIRED),
+                 ("ammeterCompliance", parseFloat, REQUIRED),
+                 ("ammeterNPLCs", parseFloat, REQUIRED),
+                 ("readingsPerPoint", parseInteger, 1),
+                 ("sweepMode", str, SWEEP_LINEAR),
+                 ("minStepVoltage", parseFloat, None),
+                 ("maxStepVoltage", parseFloat, None),
+                 ("maxPoints", parseInteger, None),
+                 ("breakdownCurrentFloor", parseFloat, None),
+                 ("resultsFormat", str, "dat"),
+                 ("trace", parseBoolean, False),
+                 ("livePort", parseInteger, None),
+                 ("resume", parseBoolean, False),
+                 ("instrumentDaemon", str, None),
+                 ("resultsFileName", str, REQUIRED),
+                 ("resultsFileExtension", str, REQUIRED))
+
+# parametros de start_process (el resto de campos son del fichero de resultados o del resourceManager)
+START_PROCESS_FIELDS = ("K2400_gpibAddress", "HVSource_gpibAddress", "gpibBoard", "initialVoltage", "finalVoltage",
+                        "pointsVoltage", "measureDelay_ms", "rampVoltage", "outputCurrentLimit", "enableKill",
+                        "ammeterRange", "ammeterCompliance", "ammeterNPLCs", "readingsPerPoint", "sweepMode",
+                        "minStepVoltage", "maxStepVoltage", "maxPoints", "breakdownCurrentFloor", "resultsFormat",
+                        "trace", "livePort", "resume")
+
+
+class SweepConfig:
+    """
+    Configuracion de un sweep, con los valores ya convertidos y validados (un atributo por campo de
+    CONFIG_FIELDS).
+
+    Args:
+        values (dict): Valores tal y como vienen del json
+    """
+
+    def __init__(self, values):
+        problems = []
+        for name, fieldType, default in CONFIG_FIELDS:
+            value = values.get(name, default)
+            if value is REQUIRED:
+                problems.append(name + " is missing")
+                value = None
+            elif value is not None:
+                try:
+                    value = fieldType(value)
+                except (TypeError, ValueError):
+                    problems.append(name + " is not a valid " + fieldType.__name__.replace("parse", "").lower() +
+                                    ": " + repr(value))
+                    value = None
+            setattr(self, name, value)
+
+        unknown = sorted(set(values) - {name for name, fieldType, default in CONFIG_FIELDS})
+        if unknown:
+            problems.append("unknown keys: " + ", ".join(unknown))
+
+        if not problems:
+            problems = self.validate()
+        if problems:
+            raise ConfigError(problems)
+
+    @classmethod
+    def fromConfigFile(cls, configFilePath):
+        with open(configFilePath) as f:
+            return cls(json.load(f))
+
+    def validate(self):
+        """
+        :return: lista de problemas (vacia si la configuracion es valida)
+        """
+        problems = []
+        for name in ("K2400_gpibAddress", "HVSource_gpibAddress"):
+            if getattr(self, name) not in GPIB_ADDRESSES:
+                problems.append(name + " must be a GPIB primary address (0-30)")
+        if self.K2400_gpibAddress == self.HVSource_gpibAddress:
+            problems.append("K2400_gpibAddress and HVSource_gpibAddress must be different")
+        for name in ("initialVoltage", "finalVoltage"):
+            if not 0 <= getattr(self, name) <= HV_SOURCE_MAX_VOLTAGE:
+                problems.append(name + " must be between 0 and " + str(HV_SOURCE_MAX_VOLTAGE) + "V")
+        if self.initialVoltage == self.finalVoltage:
+            problems.append("initialVoltage and finalVoltage must be different")
+        if self.pointsVoltage < 1:
+            problems.append("pointsVoltage must be at least 1")
+        if self.measureDelay_ms < 0:
+            problems.append("measureDelay_ms must not be negative")
+        for name in ("rampVoltage", "outputCurrentLimit", "ammeterRange", "ammeterCompliance"):
+            if getattr(self, name) <= 0:
+                problems.append(name + " must be positive")
+        if not 0.01 <= self.ammeterNPLCs <= 10:
+            problems.append("ammeterNPLCs must be between 0.01 and 10")
+        if not 1 <= self.readingsPerPoint <= 2500:
+            problems.append("readingsPerPoint must be between 1 and 2500 (K2400 buffer)")
+        if self.sweepMode not in (SWEEP_LINEAR, SWEEP_ADAPTIVE):
+            problems.append("sweepMode must be '" + SWEEP_LINEAR + "' or '" + SWEEP_ADAPTIVE + "'")
+        for name in ("minStepVoltage", "maxStepVoltage"):
+            if getattr(self, name) is not None and getattr(self, name) <= 0:
+                problems.append(name + " must be positive")
+        if self.minStepVoltage is not None and self.maxStepVoltage is not None and \
+                self.minStepVoltage > self.maxStepVoltage:
+            problems.append("minStepVoltage must not be larger than maxStepVoltage")
+        if self.maxPoints is not None and self.maxPoints < 2:
+            problems.append("maxPoints must be at least 2")
+        if self.breakdownCurrentFloor is not None and self.breakdownCurrentFloor <= 0:
+            problems.append("breakdownCurrentFloor must be positive")
+        if self.resultsFormat not in RESULTS_FORMATS:
+            problems.append("resultsFormat must be one of " + ", ".join(RESULTS_FORMATS))
+        if self.livePort is not None and not 0 < self.livePort < 65536:
+            problems.append("livePort must be a TCP port")
+        return problems
+
+    def values(self):
+        """
+        :return: dict campo --> valor (ya convertido) de todos los campos de CONFIG_FIELDS
+        """
+        return {name: getattr(self, name) for name, fieldType, default in CONFIG_FIELDS}
+
+    def replace(self, **overrides):
+        """
+        :return: nueva SweepConfig con overrides sobre estos valores, validada igual que la del fichero
+        """
+        values = self.values()
+        values.update(overrides)
+        return SweepConfig(values)
+
+    @property
+    def resultsFilePath(self):
+        return self.resultsFileName + "." + self.resultsFileExtension
+
+    def startProcessParameters(self):
+        """
+        :return: dict con los argumentos de main.start_process (sin resourceManager)
+        """
+        parameters = {name: getattr(self, name) for name in START_PROCESS_FIELDS}
+        parameters["resultsFilePath"] = self.resultsFilePath
+        return parameters
+
+    def plan(self, timing=None):
+        return SweepPlan(self, timing)
+
+
+class TimingModel:
+    """
+    Tiempos de start_process que no dependen de la configuracion (los valores por defecto son las esperas fijas de
+    main.py con synchronizationMode = SYNC_OPC y concurrentInstrumentIO).
+
+    Args:
+        hvCommandDelay (float): Espera despues de cada comando a la fuente HV (sendHVOutputVoltage, STATUS,MU). Seconds
+        readbackTTL (float): Edad maxima de la lectura de la fuente que se reutiliza como lectura del punto
+            (hvSourceDriver.HPP120.readbackTTL). Seconds
+        settleOverhead (float): Overhead de llegada al setpoint sobre |salto| / rampa (RampSettlingPredictor). Seconds
+        settleLastDelay (float): Espera de seguridad con la salida en rango (predictiveSettlingLastDelay). Seconds
+        averageCount (int): Promedios del filtro del K2400 (":SENS:AVER:COUN 8")
+        lineFrequency (float): Frecuencia de red (1 NPLC = 1 / lineFrequency). Hz
+        initializationTime (float): getInstruments + initializeHVSource + initializeK2400 + HV,ON. Seconds
+    """
+
+    def __init__(self, hvCommandDelay=0.5, readbackTTL=1.0, settleOverhead=0.2, settleLastDelay=0.2, averageCount=8,
+                 lineFrequency=50.0, initializationTime=5.0):
+        self.hvCommandDelay = hvCommandDelay
+        self.readbackTTL = readbackTTL
+        self.settleOverhead = settleOverhead
+        self.settleLastDelay = settleLastDelay
+        self.averageCount = averageCount
+        self.lineFrequency = lineFrequency
+        self.initializationTime = initializationTime
+
+
+class SweepPlan:
+    """
+    Plan explicito de un sweep (ver cabecera del modulo).
+
+    Args:
+        config (SweepConfig): Configuracion del sweep
+        timing (TimingModel): Modelo de tiempos (None --> valores por defecto)
+    """
+
+    def __init__(self, config, timing=None):
+        self.config = config
+        self.timing = timing if timing is not None else TimingModel()
+        self.adaptive = config.sweepMode == SWEEP_ADAPTIVE
+
+        points = config.pointsVoltage
+        if self.adaptive:
+            points = (config.maxPoints if config.maxPoints is not None else config.pointsVoltage + 1) - 1
+        self.setpoints = linearSetpoints(config.initialVoltage, config.finalVoltage, points)
+        self.stepVoltages = np.abs(np.diff(self.setpoints))
+        self.rampTimes = self.stepVoltages / config.rampVoltage
+        self.dwellTime = config.measureDelay_ms / 1000
+        self.integrationTime = config.ammeterNPLCs / self.timing.lineFrequency * self.timing.averageCount * \
+            config.readingsPerPoint
+        self.limits = {"maxVoltage": float(np.max(self.setpoints)),
+                       "outputCurrentLimit": config.outputCurrentLimit,
+                       "ammeterCompliance": config.ammeterCompliance,
+                       "ammeterRange": config.ammeterRange,
+                       "killEnabled": config.enableKill}
+
+    @property
+    def points(self):
+        return len(self.setpoints)
+
+    def estimate(self, fromVoltage=0.0, initialize=True, rampDown=True):
+        """
+        Duracion prevista del sweep por fases.
+
+        Args:
+            fromVoltage (float): Tension de la fuente al empezar (sweep encadenado, ver sweepJobQueue). Volts
+            initialize (bool): Si se inicializan los instrumentos (False en un sweep encadenado)
+            rampDown (bool): Si al terminar se baja la fuente a 0V
+        Returns:
+            dict fase --> Seconds (ESTIMATE_PHASES)
+        """
+        timing = self.timing
+        rampVoltage = self.config.rampVoltage
+        # cada punto: el setpoint se envia (hvCommandDelay), la fuente llega segun la rampa, se confirma con una
+        # lectura (hvCommandDelay) y la espera de seguridad; despues measureDelay y la medida del K2400. La lectura
+        # que ha confirmado la llegada se reutiliza como lectura del punto si no es mas antigua que readbackTTL; si
+        # no, la fuente se vuelve a leer a la vez que mide el K2400
+        pointReadback = self.dwellTime + timing.settleLastDelay > timing.readbackTTL
+        acquireTime = max(self.integrationTime, timing.hvCommandDelay) if pointReadback else self.integrationTime
+        rampTimes = np.concatenate(([abs(self.setpoints[0] - fromVoltage) / rampVoltage], self.rampTimes))
+        arrivalTimes = np.maximum(rampTimes + timing.settleOverhead, timing.hvCommandDelay)
+        estimate = {PHASE_INIT: timing.initializationTime if initialize else 0.0,
+                    PHASE_RAMP: float(np.sum(rampTimes)),
+                    PHASE_SETTLE: float(np.sum(arrivalTimes - rampTimes)) +
+                                  self.points * (timing.hvCommandDelay + timing.settleLastDelay),
+                    PHASE_DWELL: self.points * self.dwellTime,
+                    PHASE_ACQUIRE: self.points * acquireTime,
+                    PHASE_SHUTDOWN: 0.0}
+        if rampDown:
+            estimate[PHASE_SHUTDOWN] = abs(self.setpoints[-1]) / rampVoltage + timing.settleOverhead + \
+                2 * timing.hvCommandDelay + timing.settleLastDelay
+        return estimate
+
+    def estimatedTime(self, fromVoltage=0.0, initialize=True, rampDown=True):
+        return sum(self.estimate(fromVoltage, initialize, rampDown).values())
+
+
+def printPlan(plan, showSetpoints=False):
+    config = plan.config
+    print("Sweep %s: %gV --> %gV, %d points (%s%s)" % (config.resultsFilePath, config.initialVoltage,
+                                                     config.finalVoltage, plan.points, config.sweepMode,
+                                                     ", upper bound" if plan.adaptive else ""))
+    if len(plan.stepVoltages):
+        print("Step: %gV (%.2fs of ramp at %gV/s)" % (plan.stepVoltages.max(), plan.rampTimes.max(),
+                                                    config.rampVoltage))
+    print("Dwell: %.3fs   K2400 integration: %.3fs (%g NPLC x %d averages x %d readings)" % (
+        plan.dwellTime, plan.integrationTime, config.ammeterNPLCs, plan.timing.averageCount, config.readingsPerPoint))
+    print("Safety limits: " + ", ".join("%s=%s" % (key, value) for key, value in plan.limits.items()))
+    if showSetpoints:
+        print("Setpoints (V): " + " ".join("%g" % setpoint for setpoint in plan.setpoints))
+
+    estimate = plan.estimate()
+    total = sum(estimate.values())
+    print("%-10s %10s %7s" % ("phase", "seconds", "%"))
+    for phase in ESTIMATE_PHASES:
+        print("%-10s %10.1f %7.1f" % (phase, estimate[phase], 100.0 * estimate[phase] / total if total else 0.0))
+    print("%-10s %10.1f   (%.1f min, %.2fs/point)" % ("total", total, total / 60, total / plan.points))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate a sweep configuration and estimate its duration "
+                                                 "(no instrument is touched)")
+    parser.add_argument("config", nargs="?", default="process_config_file.json")
+    parser.add_argument("--setpoints", action="store_true", help="also print every setpoint")
+    parser.add_argument("--line-frequency", type=float, default=50.0, help="Hz")
+    args = parser.parse_args()
+
+    try:
+        sweepConfig = SweepConfig.fromConfigFile(args.config)
+    except ConfigError as e:
+        print(e)
+        raise SystemExit(1)
+    printPlan(sweepConfig.plan(TimingModel(lineFrequency=args.line_frequency)), args.setpoints)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cola de sweeps sobre un mismo banco (K2400 + fuente HV) ordenada para minimizar el recorrido de la fuente HV.
+
+Cada start_process sube la fuente desde 0V y al terminar la vuelve a bajar a 0V: a 100V/s son minutos de rampa por
+sweep. La cola acepta sweeps de subida, de bajada, bidireccionales (subida y despues bajada) y repetidos, y:
+    - los ordena (greedy, respetando el orden subida --> bajada y el de las repeticiones) para que cada sweep
+      empiece lo mas cerca posible de donde termino el anterior;
+    - encadena sweeps sin volver a 0V (start_process(rampDown=False) + hvSourceVoltage) cuando las reglas de
+      seguridad lo permiten: misma estacion y misma muestra, y la misma configuracion de los dos instrumentos (ni la
+      fuente ni el K2400 necesitan reinicializarse con tension aplicada). Un sweep con "chain": false nunca se
+      encadena;
+    - estima la duracion de cada sweep y de la campaña y la compara con la real.
+
+Uso:
+    python sweepJobQueue.py jobs.json [--config process_config_file.json] [--simulate] [--dry-run]
+
+Formato de jobs.json (cualquier parametro de start_process sustituye al de process_config_file.json):
+    {"jobs": [{"resultsFile": "s1@250_28h.dat", "direction": "bidirectional", "repeat": 2}, ...]}
+    direction: "up" (initialVoltage --> finalVoltage, por defecto), "down" (finalVoltage --> initialVoltage) o
+    "bidirectional" (las dos, <fichero>_down.dat para la bajada). Las repeticiones se guardan como <fichero>_2.dat...
+"""
+
+import argparse
+import json
+import os
+import time
+
+from termcolor import colored
+
+import main
+from sweepArchive import parseSweepFileName
+from sweepConfig import SweepConfig
+
+DIRECTION_UP = "up"
+DIRECTION_DOWN = "down"
+DIRECTION_BIDIRECTIONAL = "bidirectional"
+
+# si alguno cambia entre dos sweeps hay que reinicializar un instrumento: no se encadenan
+CHAIN_SETTINGS_KEYS = ("gpibBoard", "K2400_gpibAddress", "HVSource_gpibAddress", "rampVoltage", "outputCurrentLimit",
+                       "enableKill", "ammeterRange", "ammeterCompliance", "ammeterNPLCs", "readingsPerPoint")
+
+
+class SweepJob:
+    """
+    Un sweep de la cola.
+
+    Args:
+        name (str): Nombre en los informes
+        resultsFilePath (str): Fichero de resultados
+        parameters (dict): Parametros de start_process (initialVoltage, finalVoltage... ya en el sentido del sweep)
+        predecessors (list): SweepJob que tienen que hacerse antes
+        chain (bool): False --> nunca se encadena con el anterior ni con el siguiente
+        sample (str): Muestra (None --> la del nombre del fichero de resultados, ver sweepArchive)
+    """
+
+    def __init__(self, name, resultsFilePath, parameters, predecessors=None, chain=True, sample=None):
+        self.name = name
+        self.resultsFilePath = resultsFilePath
+        if sample is None:
+            nameFields = parseSweepFileName(resultsFilePath)
+            sample = nameFields["sample"] if nameFields is not None else resultsFilePath
+        self.sample = sample
+        self.parameters = parameters
+        self.predecessors = list(predecessors or [])
+        self.chain = chain
+        self.estimatedTime = None
+        self.actualTime = None
+        self.chainedFromPrevious = False
+        self.rampDown = True
+        self.error = None
+
+    @property
+    def startVoltage(self):
+        return float(self.parameters["initialVoltage"])
+
+    @property
+    def endVoltage(self):
+        return float(self.parameters["finalVoltage"])
+
+    def __repr__(self):
+        return "SweepJob(%s, %g --> %gV)" % (self.name, self.startVoltage, self.endVoltage)
+
+
+def _suffixedFilePath(filePath, suffix):
+    root, extension = os.path.splitext(filePath)
+    return root + suffix + extension
+
+
+def expandJobs(jobDefinitions, commonParameters):
+    """
+    Convierte las definiciones de jobs.json en la lista de SweepJob (una por sweep: las bidireccionales y las
+    repeticiones dan varios).
+    """
+    jobs = []
+    for definition in jobDefinitions:
+        definition = dict(definition)
+        resultsFilePath = definition.pop("resultsFile")
+        direction = definition.pop("direction", DIRECTION_UP)
+        repeat = int(definition.pop("repeat", 1))
+        chain = definition.pop("chain", True)
+        sample = SweepJob("", resultsFilePath, {}, sample=definition.pop("sample", None)).sample
+        parameters = dict(commonParameters)
+        parameters.update(definition)
+
+        low, high = parameters["initialVoltage"], parameters["finalVoltage"]
+        if direction == DIRECTION_UP:
+            sweeps = [("", low, high)]
+        elif direction == DIRECTION_DOWN:
+            sweeps = [("", high, low)]
+        elif direction == DIRECTION_BIDIRECTIONAL:
+            sweeps = [("", low, high), ("_down", high, low)]
+        else:
+            raise ValueError("Unknown sweep direction: " + str(direction))
+
+        previous = None
+        for run in range(1, repeat + 1):
+            for suffix, initialVoltage, finalVoltage in sweeps:
+                filePath = _suffixedFilePath(resultsFilePath, suffix + ("_" + str(run) if run > 1 else ""))
+                jobParameters = dict(parameters, initialVoltage=initialVoltage, finalVoltage=finalVoltage)
+                job = SweepJob(os.path.splitext(os.path.basename(filePath))[0], filePath, jobParameters,
+                               [previous] if previous is not None else [], chain, sample)
+                jobs.append(job)
+                previous = job
+    return jobs
+
+
+def canChain(previous, job):
+    """
+    Reglas de seguridad para pasar de previous a job sin bajar la fuente a 0V.
+    """
+    if previous is None or not previous.chain or not job.chain:
+        return False
+    if previous.sample != job.sample or previous.parameters.get("resume") or job.parameters.get("resume"):
+        return False
+    return all(previous.parameters.get(key) == job.parameters.get(key) for key in CHAIN_SETTINGS_KEYS)
+
+
+def transitionTravel(previous, job, allowChain=True):
+    """
+    Recorrido de la fuente (V) para ir del final de previous (None --> fuente en 0V) al principio de job.
+    """
+    if previous is None:
+        return abs(job.startVoltage)
+    if allowChain and canChain(previous, job):
+        return abs(job.startVoltage - previous.endVoltage)
+    return abs(previous.endVoltage) + abs(job.startVoltage)
+
+
+def campaignTravel(jobs, allowChain=True):
+    """
+    Recorrido total de la fuente (V): transiciones, sweeps y bajada final a 0V.
+    """
+    travel = 0.0
+    previous = None
+    for job in jobs:
+        travel += transitionTravel(previous, job, allowChain) + abs(job.endVoltage - job.startVoltage)
+        previous = job
+    return travel + (abs(previous.endVoltage) if previous is not None else 0.0)
+
+
+def scheduleJobs(jobs):
+    """
+    Orden de ejecucion: en cada paso, de los sweeps cuyos predecesores ya estan hechos, el que necesita menos
+    recorrido de la fuente desde el final del anterior (a igualdad, el primero de la lista). Marca en cada job si se
+    encadena con el anterior y si tiene que bajar a 0V al terminar.
+    """
+    pending = list(jobs)
+    done = set()
+    ordered = []
+    previous = None
+    while pending:
+        ready = [job for job in pending if all(predecessor in done for predecessor in job.predecessors)]
+        job = min(ready, key=lambda candidate: transitionTravel(previous, candidate))
+        pending.remove(job)
+        done.add(job)
+        job.chainedFromPrevious = canChain(previous, job)
+        if previous is not None:
+            previous.rampDown = not job.chainedFromPrevious
+        ordered.append(job)
+        previous = job
+    if previous is not None:
+        previous.rampDown = True
+    return ordered
+
+
+def estimateJobTime(job, fromVoltage, timing=None):
+    """
+    Duracion estimada (s) de un sweep con el plan del sweep (sweepConfig.SweepPlan): sin inicializacion si va
+    encadenado y sin la bajada a 0V si no es job.rampDown.
+
+    Args:
+        job (SweepJob): Sweep
+        fromVoltage (float): Tension de la fuente al empezar. Volts
+        timing (TimingModel): Modelo de tiempos (None --> el de por defecto)
+    """
+    resultsFileName, resultsFileExtension = os.path.splitext(job.resultsFilePath)
+    values = dict(job.parameters, resultsFileName=resultsFileName, resultsFileExtension=resultsFileExtension[1:])
+    return SweepConfig(values).plan(timing).estimatedTime(fromVoltage, initialize=not job.chainedFromPrevious,
+                                                          rampDown=job.rampDown)
+
+
+def estimateCampaign(orderedJobs):
+    """
+    Rellena job.estimatedTime de cada sweep (en el orden de ejecucion).\n
+    :return: float con la duracion estimada de la campaña. Seconds
+    """
+    voltage = 0.0
+    total = 0.0
+    for job in orderedJobs:
+        job.estimatedTime = estimateJobTime(job, voltage if job.chainedFromPrevious else 0.0)
+        total += job.estimatedTime
+        voltage = job.endVoltage if not job.rampDown else 0.0
+    return total
+
+
+def runJobs(orderedJobs, resourceManager=None):
+    """
+    Ejecuta los sweeps en orden. Si un sweep falla o para por ruptura / overflow (start_process devuelve None),
+    start_process deja la fuente a 0V y el siguiente no se encadena.\n
+    :return: float con la duracion real de la campaña. Seconds
+    """
+    campaignStart = time.time()
+    hvSourceVoltage = None
+    for job in orderedJobs:
+        print(colored("Sweep " + job.name + ": " + str(job.startVoltage) + "V --> " + str(job.endVoltage) + "V" +
+                      (" (chained)" if job.chainedFromPrevious and hvSourceVoltage is not None else ""), "green"))
+        parameters = dict(job.parameters)
+        K2400_gpibAddress = parameters.pop("K2400_gpibAddress")
+        HVSource_gpibAddress = parameters.pop("HVSource_gpibAddress")
+        jobStart = time.time()
+        try:
+            hvSourceVoltage = main.start_process(K2400_gpibAddress, HVSource_gpibAddress,
+                                                 resultsFilePath=job.resultsFilePath,
+                                                 resourceManager=resourceManager,
+                                                 hvSourceVoltage=hvSourceVoltage if job.chainedFromPrevious else None,
+                                                 rampDown=job.rampDown,
+                                                 **parameters)
+            if job.rampDown:
+                hvSourceVoltage = None
+        except Exception as e:
+            job.error = repr(e)
+            hvSourceVoltage = None
+            print(colored("Sweep " + job.name + " failed: " + job.error, "red"))
+        job.actualTime = time.time() - jobStart
+    return time.time() - campaignStart
+
+
+def printCampaign(orderedJobs, estimatedTotal, actualTotal=None, unscheduledTravel=None):
+    print("%-24s %9s %9s %6s %6s %12s %10s" % ("sweep", "from_V", "to_V", "chain", "0V", "estimated_s", "actual_s"))
+    for job in orderedJobs:
+        line = "%-24s %9g %9g %6s %6s %12.1f %10s" % (
+            job.name, job.startVoltage, job.endVoltage, "yes" if job.chainedFromPrevious else "no",
+            "yes" if job.rampDown else "no", job.estimatedTime,
+            "-" if job.actualTime is None else "%.1f" % job.actualTime)
+        if job.error is not None:
+            line += "  " + job.error
+        print(colored(line, "red") if job.error is not None else line)
+
+    print("HV travel: %.0fV" % campaignTravel(orderedJobs) +
+          ("" if unscheduledTravel is None else " (%.0fV in the given order without chaining)" % unscheduledTravel))
+    print("Campaign time: estimated %.1fs" % estimatedTotal +
+          ("" if actualTotal is None else ", actual %.1fs (%+.1f%%)" % (
+              actualTotal, 100.0 * (actualTotal - estimatedTotal) / estimatedTotal if estimatedTotal else 0.0)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep job queue ordered to minimize the HV source travel")
+    parser.add_argument("jobs", help="jobs json file")
+    parser.add_argument("--config", default="process_config_file.json", help="common sweep configuration")
+    parser.add_argument("--simulate", action="store_true", help="run the queue against a simulated bench")
+    parser.add_argument("--dry-run", action="store_true", help="only print the schedule and the estimated time")
+    args = parser.parse_args()
+
+    commonParameters = SweepConfig.fromConfigFile(args.config).startProcessParameters()
+    # cada sweep de la cola tiene su propio fichero de resultados
+    commonParameters.pop("resultsFilePath")
+    with open(args.jobs) as f:
+        jobs = expandJobs(json.load(f)["jobs"], commonParameters)
+
+    # recorrido en el orden dado y sin encadenar, como referencia
+    unscheduledTravel = campaignTravel(jobs, allowChain=False)
+    orderedJobs = scheduleJobs(jobs)
+    estimatedTotal = estimateCampaign(orderedJobs)
+    actualTotal = None
+    if not args.dry_run:
+        queueResourceManager = None
+        if args.simulate:
+            from instrumentSimulator import SimulatedBench
+            queueResourceManager = SimulatedBench(commonParameters["K2400_gpibAddress"],
+                                                  commonParameters["HVSource_gpibAddress"],
+                                                  commonParameters["gpibBoard"]).resourceManager()
+        actualTotal = runJobs(orderedJobs, queueResourceManager)
+    printCampaign(orderedJobs, estimatedTotal, actualTotal, unscheduledTravel)
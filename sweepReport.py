@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Informe de la campaña de envejecimiento: graficas de todos los sweeps del archivo (sweepArchive.py).
+
+Se generan, en <carpeta>/report:
+    - curves/<sweep>.png: la curva I-V de cada sweep (|I| en escala logaritmica)
+    - overlays/<muestra>.png: las curvas de una muestra superpuestas, coloreadas por horas de envejecimiento (ultimo
+      run de cada medida)
+    - trends/*.png: evolucion con las horas de la corriente a cada tension fija y de la resistencia de aislamiento
+      de todas las muestras (sweepAnalysis.agingTrends)
+    - index.html con todas las graficas y la tabla de metricas
+
+Cada grafica tiene una clave: el hash del contenido de los datos que dibuja (los .npy de la cache del archivo o los
+valores de la tendencia) y de su aspecto (titulo, ejes, RENDER_VERSION). report.json guarda la clave con la que se
+dibujo cada grafica y solo se vuelven a dibujar las que han cambiado: despues de una medida nueva se redibujan su
+curva, el overlay de su muestra y las tendencias. Las graficas pendientes se reparten en un pool de procesos.
+
+matplotlib solo hace falta para dibujar (pip install matplotlib).
+
+Uso:
+    python sweepReport.py [carpeta] [--output report] [--processes N] [--force] [--voltages 1000 2000 5000]
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sweepAnalysis import AnalysisParameters, analyzeSweeps, agingTrends, metricsTable
+from sweepArchive import SweepArchive
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    matplotlib = None
+
+REPORT_DIRECTORY = "report"
+MANIFEST_FILE = "report.json"
+MANIFEST_VERSION = 1
+# cambiar al modificar el aspecto de las graficas: invalida todas las claves
+RENDER_VERSION = 1
+
+VOLTAGE_LABEL = "Voltage (V)"
+CURRENT_LABEL = "|I| (A)"
+HOURS_LABEL = "Aging (h)"
+
+
+class RenderJob:
+    """
+    Una grafica del informe.
+
+    Args:
+        fileName (str): Ruta de la imagen relativa a la carpeta del informe
+        title (str): Titulo
+        xLabel (str): Etiqueta del eje x
+        yLabel (str): Etiqueta del eje y (siempre en escala logaritmica)
+        series (list): (etiqueta, fichero .npy de la cache del archivo) o (etiqueta, x, y) de cada serie
+        dataHashes (list): Hash del contenido de cada serie
+        colormap (str): Mapa de colores para las series en orden (None --> colores por defecto)
+    """
+
+    def __init__(self, fileName, title, xLabel, yLabel, series, dataHashes, colormap=None):
+        self.fileName = fileName
+        self.title = title
+        self.xLabel = xLabel
+        self.yLabel = yLabel
+        self.series = series
+        self.colormap = colormap
+        self.key = hashlib.sha1(json.dumps([RENDER_VERSION, fileName, title, xLabel, yLabel, colormap,
+                                            [serie[0] for serie in series], dataHashes]).encode("utf-8")).hexdigest()
+
+
+def fileContentHash(filePath):
+    with open(filePath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def arrayContentHash(*arrays):
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def sweepLabel(sweepFile):
+    return "%gh" % sweepFile.hours + ("" if sweepFile.run == 1 else " (run %d)" % sweepFile.run)
+
+
+def planReport(archive, parameters=None):
+    """
+    Graficas del informe del archivo.\n
+    :return: (lista de RenderJob, metricas de sweepAnalysis.analyzeSweeps)
+    """
+    sweepFiles = archive.query(sortBy=("sample", "hours", "run"))
+    cacheFilePaths = {sweepFile.path: os.path.join(archive.cacheDirectory, sweepFile.cacheFile)
+                      for sweepFile in sweepFiles}
+    dataHashes = {path: fileContentHash(cacheFilePath) for path, cacheFilePath in cacheFilePaths.items()}
+
+    jobs = []
+    for sweepFile in sweepFiles:
+        name = os.path.splitext(os.path.basename(sweepFile.path))[0]
+        jobs.append(RenderJob("curves/" + name + ".png",
+                              "%s @ %gºC, %s" % (sweepFile.sample, sweepFile.temperature, sweepLabel(sweepFile)),
+                              VOLTAGE_LABEL, CURRENT_LABEL,
+                              [(sweepLabel(sweepFile), cacheFilePaths[sweepFile.path])],
+                              [dataHashes[sweepFile.path]]))
+
+    for sample in archive.samples():
+        lastRuns = archive.query(sample=sample, run="last", sortBy="hours")
+        jobs.append(RenderJob("overlays/" + sample + ".png", sample + ": I-V vs aging",
+                              VOLTAGE_LABEL, CURRENT_LABEL,
+                              [("%gºC, %gh" % (sweepFile.temperature, sweepFile.hours), cacheFilePaths[sweepFile.path])
+                               for sweepFile in lastRuns],
+                              [dataHashes[sweepFile.path] for sweepFile in lastRuns], colormap="viridis"))
+
+    if parameters is None:
+        parameters = AnalysisParameters()
+    metrics = analyzeSweeps(sweepFiles, parameters, processes=1) if sweepFiles else None
+    if metrics is not None:
+        trends = agingTrends(metrics)
+        for column, voltage in enumerate(metrics["voltages"]):
+            series = [(sample, trend["hours"], trend["currentAt"][:, column]) for sample, trend in trends.items()]
+            jobs.append(RenderJob("trends/current_at_%gV.png" % voltage, "Current at %gV" % voltage, HOURS_LABEL,
+                                  "I (A)", series, [arrayContentHash(x, y) for label, x, y in series],
+                                  colormap="tab20"))
+        series = [(sample, trend["hours"], trend["insulationResistance"]) for sample, trend in trends.items()]
+        jobs.append(RenderJob("trends/insulation_resistance.png", "Insulation resistance", HOURS_LABEL,
+                              "R (ohm)", series, [arrayContentHash(x, y) for label, x, y in series],
+                              colormap="tab20"))
+    return jobs, metrics
+
+
+def renderJob(job, outputDirectory):
+    """
+    Dibuja una grafica (cuerpo de cada tarea del pool).\n
+    :return: str con la ruta de la imagen relativa al informe
+    """
+    figure, axes = plt.subplots(figsize=(8, 5))
+    colors = None
+    if job.colormap is not None and len(job.series) > 1:
+        colormap = plt.get_cmap(job.colormap)
+        # mapa continuo (viridis...) --> gradiente en el orden de las series, cualitativo (tab20...) --> un color
+        # distinto para cada una
+        colors = colormap(np.linspace(0.0, 0.9, len(job.series))) if colormap.N >= 256 else \
+            [colormap(i % colormap.N) for i in range(len(job.series))]
+
+    for i, serie in enumerate(job.series):
+        if len(serie) == 2:
+            data = np.load(serie[1], mmap_mode="r")
+            x, y = data[:, 0], data[:, 1]
+        else:
+            x, y = np.asarray(serie[1]), np.asarray(serie[2])
+        # escala logaritmica: se dibuja |I| y los ceros no se dibujan
+        y = np.where(np.abs(y) > 0, np.abs(y), np.nan)
+        axes.plot(x, y, marker=".", linewidth=1, label=serie[0], color=None if colors is None else colors[i])
+
+    axes.set_yscale("log")
+    axes.set_title(job.title)
+    axes.set_xlabel(job.xLabel)
+    axes.set_ylabel(job.yLabel)
+    axes.grid(True, which="both", alpha=0.3)
+    if len(job.series) > 1:
+        axes.legend(fontsize="small", ncol=2 if len(job.series) > 8 else 1)
+
+    outputPath = os.path.join(outputDirectory, job.fileName)
+    os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+    temporaryPath = outputPath + ".tmp.png"
+    figure.savefig(temporaryPath, dpi=100)
+    plt.close(figure)
+    os.replace(temporaryPath, outputPath)
+    return job.fileName
+
+
+def loadManifest(manifestPath):
+    if not os.path.exists(manifestPath):
+        return {}
+    try:
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+    except ValueError:
+        return {}
+    return manifest["images"] if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def saveManifest(manifestPath, images):
+    temporaryPath = manifestPath + ".tmp"
+    with open(temporaryPath, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "images": images}, f, indent=1, sort_keys=True)
+    os.replace(temporaryPath, manifestPath)
+
+
+def writeIndex(outputDirectory, jobs, metrics):
+    sections = {"trends": [], "overlays": [], "curves": []}
+    for job in jobs:
+        sections[job.fileName.split("/")[0]].append(job)
+
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\"><title>Aging campaign report</title>",
+             "<style>img{width:32%;min-width:400px}</style></head><body>",
+             "<h1>Aging campaign report</h1><p>" + time.strftime("%Y-%m-%d %H:%M:%S") + "</p>"]
+    for section, title in (("trends", "Trends"), ("overlays", "Samples"), ("curves", "Sweeps")):
+        lines.append("<h2>" + title + "</h2>")
+        for job in sections[section]:
+            lines.append("<a href=\"%s\"><img src=\"%s\" alt=\"%s\"></a>" % (
+                html.escape(job.fileName), html.escape(job.fileName), html.escape(job.title)))
+    if metrics is not None:
+        lines.append("<h2>Metrics</h2><pre>" + html.escape(metricsTable(metrics)) + "</pre>")
+    lines.append("</body></html>")
+
+    with open(os.path.join(outputDirectory, "index.html"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def generateReport(rootDirectory=".", outputDirectory=None, parameters=None, processes=None, force=False):
+    """
+    Genera (o actualiza) el informe del archivo de sweeps de rootDirectory.
+
+    Args:
+        rootDirectory (str): Carpeta raiz del archivo
+        outputDirectory (str): Carpeta del informe (None --> <rootDirectory>/report)
+        parameters (sweepAnalysis.AnalysisParameters): Parametros de las tendencias
+        processes (int): Procesos del pool (None --> os.cpu_count(), 1 --> sin pool)
+        force (bool): Redibuja todas las graficas aunque no hayan cambiado
+    Returns:
+        dict con rendered, cached, removed (numero de graficas) y seconds
+    """
+    if matplotlib is None:
+        raise ImportError("matplotlib is required to render the report (pip install matplotlib)")
+
+    start = time.time()
+    if outputDirectory is None:
+        outputDirectory = os.path.join(rootDirectory, REPORT_DIRECTORY)
+    os.makedirs(outputDirectory, exist_ok=True)
+    manifestPath = os.path.join(outputDirectory, MANIFEST_FILE)
+    images = loadManifest(manifestPath)
+
+    jobs, metrics = planReport(SweepArchive(rootDirectory), parameters)
+    pending = [job for job in jobs if force or images.get(job.fileName) != job.key or
+               not os.path.exists(os.path.join(outputDirectory, job.fileName))]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending))) as executor:
+            list(executor.map(renderJob, pending, [outputDirectory] * len(pending)))
+    else:
+        for job in pending:
+            renderJob(job, outputDirectory)
+    for job in pending:
+        images[job.fileName] = job.key
+
+    # graficas de sweeps o muestras que ya no estan en el archivo
+    current = {job.fileName for job in jobs}
+    removed = [fileName for fileName in images if fileName not in current]
+    for fileName in removed:
+        images.pop(fileName)
+        try:
+            os.remove(os.path.join(outputDirectory, fileName))
+        except FileNotFoundError:
+            pass
+
+    writeIndex(outputDirectory, jobs, metrics)
+    saveManifest(manifestPath, images)
+    return {"rendered": len(pending), "cached": len(jobs) - len(pending), "removed": len(removed),
+            "seconds": time.time() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incremental plot report of the sweep archive")
+    parser.add_argument("root", nargs="?", default=".", help="archive folder")
+    parser.add_argument("--output", default=None, help="report folder (default <root>/report)")
+    parser.add_argument("--processes", type=int, default=None, help="process pool size (1 = no pool)")
+    parser.add_argument("--force", action="store_true", help="render every plot again")
+    parser.add_argument("--voltages", type=float, nargs="+", default=[1000, 2000, 5000, 10000],
+                        help="fixed voltages of the trend charts (V)")
+    args = parser.parse_args()
+
+    result = generateReport(args.root, args.output, AnalysisParameters(fixedVoltages=args.voltages), args.processes,
+                            args.force)
+    print("%d plots rendered, %d unchanged, %d removed in %.1fs" % (result["rendered"], result["cached"],
+                                                                   result["removed"], result["seconds"]))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+"""
+Configuracion comun de los tests: los modulos del proyecto estan en la raiz del repositorio.
+
+Uso:
+    python -m pytest -q
+"""
+
+import os
+import sys
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY_PATH not in sys.path:
+    sys.path.insert(0, REPOSITORY_PATH)
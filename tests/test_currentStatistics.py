@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Estadistica en linea y deteccion de ruptura (BreakdownDetector / CusumDetector).
+"""
+
+import math
+import random
+
+import pytest
+
+from currentStatistics import (DEFAULT_CURRENT_FLOOR, STOP_COMPLIANCE, STOP_OVERFLOW, STOP_RUNAWAY,
+                               BreakdownDetector, CusumDetector, RunningSlope, RunningStatistics)
+
+
+def ohmicCurrents(points, resistance=1e12, step=100.0, noise=0.01, seed=1, absoluteNoise=0.0):
+    # I = V/R con un 1% de ruido relativo (mas absoluteNoise Amps de ruido de la medida)
+    generator = random.Random(seed)
+    return [(i * step, i * step / resistance * (1 + generator.gauss(0.0, noise)) + generator.gauss(0.0, absoluteNoise))
+            for i in range(1, points + 1)]
+
+
+def feed(detector, points):
+    for voltage, current in points:
+        stopReason = detector.update(voltage, current)
+        if stopReason is not None:
+            return voltage, stopReason
+    return None, None
+
+
+def testRunningStatistics():
+    values = [1.0, 2.0, 4.0, 8.0]
+    statistics = RunningStatistics()
+    for value in values:
+        statistics.add(value)
+
+    mean = sum(values) / len(values)
+    assert statistics.mean == pytest.approx(mean)
+    assert statistics.std == pytest.approx(math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1)))
+
+
+def testRunningSlopeWindow():
+    slope = RunningSlope(window=3)
+    for x, y in [(0, 100.0), (1, 0.0), (2, 2.0), (3, 4.0)]:
+        slope.add(x, y)
+
+    assert slope.slope == pytest.approx(2.0)  # solo los tres ultimos puntos
+
+
+def testCusumNeedsASustainedDeviation():
+    cusum = CusumDetector(drift=0.5, threshold=5.0, maxPointScore=4.0)
+
+    assert not cusum.add(100.0)  # un punto aporta como mucho maxPointScore
+    assert cusum.add(100.0)
+
+    cusum = CusumDetector()
+    assert not any(cusum.add(0.4) for i in range(100))  # por debajo del drift no se acumula
+    assert cusum.value == 0.0
+
+
+def testNoStopOnAnOhmicSample():
+    detector = BreakdownDetector()
+
+    assert feed(detector, ohmicCurrents(100)) == (None, None)
+    assert detector.slope > 0
+
+
+def testSingleNoisyPointDoesNotStop():
+    points = ohmicCurrents(30)
+    voltage, current = points[15]
+    points[15] = (voltage, current * 5)
+
+    assert feed(BreakdownDetector(), points) == (None, None)
+
+
+def testRunaway():
+    # fuga que se dispara en 2000V: x3 por paso, nunca el salto de x100 de la comprobacion original
+    points = [(voltage, current * (3 ** max(0, (voltage - 2000) / 100))) for voltage, current in ohmicCurrents(40)]
+
+    voltage, stopReason = feed(BreakdownDetector(), points)
+
+    assert stopReason == STOP_RUNAWAY
+    assert 2000 < voltage <= 2300
+
+
+def testCurrentFloor():
+    assert BreakdownDetector().currentFloor == DEFAULT_CURRENT_FLOOR
+    assert BreakdownDetector(currentRange=1e-7).currentFloor == pytest.approx(1e-12)
+    assert BreakdownDetector(currentFloor=3e-13, currentRange=1e-7).currentFloor == 3e-13
+
+
+def testRunawayAtLowCurrent():
+    # fuga de 1e-11 A a 1000V que se dispara en 2000V (2e-11 A) con 0.2 pA de ruido, medida en el rango de 100 nA
+    # (currentFloor 1 pA): la ruptura se detecta en cuanto empieza y el ruido solo no para el sweep
+    points = [(voltage, current * (3 ** max(0, (voltage - 2000) / 100)))
+              for voltage, current in ohmicCurrents(40, resistance=1e14, absoluteNoise=2e-13)]
+
+    voltage, stopReason = feed(BreakdownDetector(currentRange=1e-7), points)
+
+    assert stopReason == STOP_RUNAWAY
+    assert 2000 < voltage <= 2300
+    assert feed(BreakdownDetector(currentRange=1e-7), ohmicCurrents(100, resistance=1e14, absoluteNoise=2e-13)) == \
+        (None, None)
+
+
+def testOverflow():
+    points = ohmicCurrents(10) + [(1100.0, 1e-9 * 200)]
+
+    assert feed(BreakdownDetector(), points) == (1100.0, STOP_OVERFLOW)
+
+
+def testCompliance():
+    detector = BreakdownDetector(complianceCurrent=1e-8)
+
+    assert feed(detector, ohmicCurrents(10) + [(1100.0, 0.96e-8)]) == (1100.0, STOP_COMPLIANCE)
+
+
+def testStateRoundTrip():
+    points = ohmicCurrents(40)
+    detector = BreakdownDetector()
+    feed(detector, points[:20])
+
+    resumed = BreakdownDetector()
+    resumed.setState(detector.getState())
+    for voltage, current in points[20:]:
+        assert resumed.update(voltage, current) == detector.update(voltage, current)
+    assert resumed.summary() == pytest.approx(detector.summary())
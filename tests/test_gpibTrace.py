@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Traza de la E/S GPIB: buffer circular acotado, fichero compacto y exportacion al Trace Event Format.
+"""
+
+import contextvars
+import json
+import threading
+
+from gpibTrace import (EVENT_SLEEP, PHASE_ACQUIRE, Tracer, loadTrace, saveChromeTrace, saveTrace, sleep, startTracing,
+                       stopTracing, traceArrays, tracePhase, traceReport)
+
+
+def testTracerKeepsTheLastEvents(tmp_path):
+    tracer, token = startTracing(Tracer(maxEvents=10))
+    try:
+        with tracePhase(PHASE_ACQUIRE):
+            for i in range(25):
+                sleep(1e-5)
+    finally:
+        stopTracing(token)
+
+    assert len(tracer.events) == 10
+    assert tracer.dropped == 16  # 25 esperas + el evento de la fase
+    arrays = loadTrace(saveTrace(traceArrays(tracer), str(tmp_path / "sweep.trace.npz")))
+    assert len(arrays["start"]) == 10
+    assert arrays["dropped"] == 16
+    assert arrays["tables"]["kind"][arrays["kind"][0]] == EVENT_SLEEP
+    assert "16 oldest events were dropped" in traceReport(arrays)
+
+
+def testNothingIsRecordedWithoutATracer():
+    tracer = Tracer()
+    sleep(1e-5)
+
+    assert len(tracer.events) == 0 and tracer.dropped == 0
+
+
+def testChromeTraceThreadIds(tmp_path):
+    tracer, token = startTracing(Tracer())
+    try:
+        sleep(1e-5)
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(sleep, 1e-5), name="io-worker")
+        worker.start()
+        worker.join()
+    finally:
+        stopTracing(token)
+
+    with open(saveChromeTrace(traceArrays(tracer), str(tmp_path / "sweep.trace.json"))) as f:
+        traceEvents = json.load(f)["traceEvents"]
+    threadNames = {(event["pid"], event["tid"]): event["args"]["name"] for event in traceEvents
+                   if event["name"] == "thread_name"}
+    sleeps = [event for event in traceEvents if event.get("cat") == EVENT_SLEEP]
+    assert all(isinstance(event["tid"], int) for event in sleeps)
+    assert sorted(threadNames[(event["pid"], event["tid"])] for event in sleeps) == \
+        sorted([threading.current_thread().name, "io-worker"])
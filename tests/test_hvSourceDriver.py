@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Respuestas de la fuente HPP-120 (parseMeasurement, parseStatus) y driver HPP120: reensamblado de respuestas,
+reintentos acotados y cache de ajustes.
+"""
+
+import pytest
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+
+from hvSourceDriver import (HPP120, HVSourceResponseError, HV_ON, KILL_ENABLED, decodeStatus, parseMeasurement,
+                            parseStatus)
+
+
+class ScriptedInstrument:
+    """
+    Instrumento que devuelve en cada read_raw la siguiente respuesta de la lista (una excepcion se lanza).
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.written = []
+
+    def write_raw(self, message):
+        self.written.append(message)
+        return len(message)
+
+    def read_raw(self, size=None):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def driver(responses=(), retries=2):
+    return HPP120(ScriptedInstrument(responses), queryDelay=0.0, retries=retries, retryDelay=0.0)
+
+
+@pytest.mark.parametrize("frame, voltage, voltageRange", [
+    ("UM, RANGE=3000V, VALUE=2.458kV", 2458.0, 3000.0),
+    ("UM,RANGE=12kV,VALUE=150mV", 0.15, 12000.0),
+    (" UM, RANGE=3000V, VALUE=-1.5e3V ", -1500.0, 3000.0),
+    ("UM, RANGE=3000V, VALUE=.5kV", 500.0, 3000.0),
+])
+def testParseMeasurement(frame, voltage, voltageRange):
+    assert parseMeasurement(frame) == pytest.approx((voltage, voltageRange))
+
+
+@pytest.mark.parametrize("frame", ["", "UM, RANGE=3000V", "UM, RANGE=3000V, VALUE=2.4.5kV",
+                                   "UM, RANGE=3000V, VALUE=2kA", "ID, EURO TEST HPP-120-256-IEEE"])
+def testParseMeasurementRejectsMalformedFrames(frame):
+    with pytest.raises(ValueError):
+        parseMeasurement(frame)
+
+
+def testParseStatus():
+    assert parseStatus("DI, STATUS=0x0009") == HV_ON | KILL_ENABLED
+    assert parseStatus("DI,STATUS=9") == 9
+    assert decodeStatus(parseStatus("DI, STATUS=0x0009")) == ["HV_ON", "KILL_ENABLED"]
+    with pytest.raises(ValueError):
+        parseStatus("DI, STATUS=")
+
+
+def testFrameSplitAcrossReads():
+    hpp = driver([b"UM, RANGE=30", b"00V, VALUE=1.2", b"kV\x00"])
+
+    assert hpp.readVoltage(maxAge=0) == pytest.approx(1200.0)
+    assert hpp.instrument.written == ["STATUS,MU"]
+
+
+def testBytesAfterTheTerminatorAreNotReused():
+    # lo que llega despues del terminador es de una respuesta vieja: la siguiente query empieza de cero
+    hpp = driver([b"UM, RANGE=3000V, VALUE=1kV\x00UM, RANGE=3000V, VALUE=9kV\x00",
+                  b"UM, RANGE=3000V, VALUE=2kV\x00"])
+
+    assert hpp.readVoltage(maxAge=0) == pytest.approx(1000.0)
+    assert hpp.readVoltage(maxAge=0) == pytest.approx(2000.0)
+
+
+def testRetriesMalformedResponsesAndTimeouts():
+    hpp = driver([b"UM, RANGE=3000V, VAL\x00", VisaIOError(constants.StatusCode.error_timeout),
+                  b"UM, RANGE=3000V, VALUE=500V\x00"])
+
+    assert hpp.readVoltage(maxAge=0) == pytest.approx(500.0)
+    assert hpp.instrument.written == ["STATUS,MU"] * 3
+
+
+def testGivesUpAfterRetries():
+    hpp = driver([b"garbage\x00"] * 3, retries=2)
+
+    with pytest.raises(HVSourceResponseError):
+        hpp.readVoltage(maxAge=0)
+
+
+def testOtherVisaErrorsAreNotRetried():
+    hpp = driver([VisaIOError(constants.StatusCode.error_connection_lost)])
+
+    with pytest.raises(VisaIOError):
+        hpp.readVoltage(maxAge=0)
+    assert hpp.instrument.written == ["STATUS,MU"]
+
+
+def testReadbackCache():
+    hpp = driver([b"UM, RANGE=3000V, VALUE=1kV\x00", b"UM, RANGE=3000V, VALUE=2kV\x00"])
+
+    assert hpp.readVoltage() == pytest.approx(1000.0)
+    assert hpp.readVoltage() == pytest.approx(1000.0)  # dentro de readbackTTL: no se pregunta
+    hpp.write("U,2.000kV")  # un setpoint invalida la lectura
+    assert hpp.readVoltage() == pytest.approx(2000.0)
+    assert hpp.instrument.written == ["STATUS,MU", "U,2.000kV", "STATUS,MU"]
+
+
+def testRedundantSettingsAreSkipped():
+    hpp = driver()
+
+    assert hpp.write("RAMP,500V/s")
+    assert not hpp.write("RAMP,500V/s")
+    assert hpp.write("RAMP,500V/s", force=True)
+    assert hpp.write("U,1.000kV") and hpp.write("U,1.000kV")  # los setpoints se envian siempre
+    hpp.write("*RST")
+    assert hpp.write("RAMP,500V/s")
+    assert hpp.instrument.written == ["RAMP,500V/s", "RAMP,500V/s", "U,1.000kV", "U,1.000kV", "*RST",
+                                      "RAMP,500V/s"]
+
+
+def testStatusDoesNotChangeTheKnownState():
+    # un STATUS,DI que dice HV_ON no puede hacer que se salte un HV,ON que la fuente no ha recibido
+    hpp = driver([b"DI, STATUS=0x0009\x00"])
+
+    assert hpp.readStatus(maxAge=0) == HV_ON | KILL_ENABLED
+    assert hpp.write("HV,ON")
+    assert hpp.write("KILL,EN")
+
+
+def testQueryDelayPerCall():
+    hpp = driver([b"UM, RANGE=3000V, VALUE=1kV\x00"])
+
+    hpp.readVoltage(maxAge=0, queryDelay=0.01)
+    assert hpp.queryDelay == 0.0
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+Daemon de sesiones GPIB con el banco simulado: authkey por instalacion, solo loopback y clientes que se conectan
+con la authkey por defecto.
+"""
+
+import os
+
+import pytest
+
+import instrumentDaemon
+from instrumentDaemon import (AUTHKEY_ENVIRONMENT_VARIABLE, InstrumentSessionDaemon, InstrumentSessionError,
+                              RemoteResourceManager, createAuthkeyFile, loadAuthkey)
+from instrumentSimulator import K2400_IDN, SimulatedBench
+
+AUTHKEY = "0123456789abcdef0123456789abcdef"
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    monkeypatch.setenv(AUTHKEY_ENVIRONMENT_VARIABLE, AUTHKEY)
+    daemon = InstrumentSessionDaemon("127.0.0.1:0", SimulatedBench().resourceManager(), healthCheckPeriod=3600).start()
+    yield "%s:%d" % daemon.address
+    daemon.close()
+
+
+def testClientWithTheDefaultAuthkey(daemon):
+    remoteResourceManager = RemoteResourceManager(daemon)
+    try:
+        k2400 = remoteResourceManager.open_resource("GPIB0::25::INSTR")
+        k2400.write_raw("*IDN?")
+        assert k2400.read_raw().decode("ascii").strip() == K2400_IDN
+        assert "GPIB0::25::INSTR" in remoteResourceManager.list_resources()
+    finally:
+        remoteResourceManager.close()
+
+
+def testClientWithAnotherAuthkeyIsRefused(daemon):
+    with pytest.raises(Exception):
+        RemoteResourceManager(daemon, authkey=b"fedcba9876543210fedcba9876543210")
+
+
+def testOnlyLoopback(monkeypatch):
+    monkeypatch.setenv(AUTHKEY_ENVIRONMENT_VARIABLE, AUTHKEY)
+
+    with pytest.raises(InstrumentSessionError):
+        InstrumentSessionDaemon("0.0.0.0:0", SimulatedBench().resourceManager())
+
+
+def testAuthkeyFile(tmp_path, monkeypatch):
+    monkeypatch.delenv(AUTHKEY_ENVIRONMENT_VARIABLE, raising=False)
+    authkeyFile = str(tmp_path / "authkey")
+    monkeypatch.setattr(instrumentDaemon, "DEFAULT_AUTHKEY_FILE", authkeyFile)
+
+    with pytest.raises(InstrumentSessionError):
+        loadAuthkey()
+    authkey = createAuthkeyFile(authkeyFile)
+    assert loadAuthkey() == authkey
+    if os.name == "posix":
+        os.chmod(authkeyFile, 0o644)
+        with pytest.raises(InstrumentSessionError):
+            loadAuthkey()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+decodeBinaryBlock: bloques IEEE 488.2 de floats SREAL (:FORM:DATA SREAL, :FORM:BORD SWAP) del K2400.
+"""
+
+import struct
+
+import numpy as np
+import pytest
+
+from main import decodeBinaryBlock
+
+READINGS = [(1.5, -2.5e-12, 0.01), (3.0, 4.25e-9, 0.02)]  # :FORM:ELEM VOLT, CURR, TIME
+
+
+def sreal(readings):
+    return b"".join(struct.pack("<3f", *reading) for reading in readings)
+
+
+def testIndefiniteLengthBlock():
+    readings = decodeBinaryBlock(b"#0" + sreal(READINGS) + b"\n", 3)
+
+    assert readings.shape == (2, 3)
+    assert np.allclose(readings, np.array(READINGS, dtype=np.float32))
+
+
+def testDefiniteLengthBlock():
+    data = sreal(READINGS)
+    header = str(len(data)).encode("ascii")
+    readings = decodeBinaryBlock(b"#" + str(len(header)).encode("ascii") + header + data + b"\n", 3)
+
+    assert readings.shape == (2, 3)
+    assert readings[1, 1] == np.float32(4.25e-9)
+
+
+def testIncompleteReadingIsDropped():
+    # una lectura a medias al final (bloque cortado) no se devuelve
+    readings = decodeBinaryBlock(b"#0" + sreal(READINGS) + struct.pack("<f", 7.0), 3)
+
+    assert readings.shape == (2, 3)
+
+
+def testNotABinaryBlock():
+    with pytest.raises(ValueError):
+        decodeBinaryBlock(b"+1.500000E+00,-2.500000E-12", 3)
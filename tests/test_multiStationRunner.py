@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+Validacion de las estaciones del runner multi-estacion: configuracion por estacion y recursos compartidos.
+"""
+
+import pytest
+
+from multiStationRunner import Station, validateStations
+from sweepConfig import ConfigError, SweepConfig
+
+CONFIG = {"K2400_gpibAddress": 25, "HVSource_gpibAddress": 20, "initialVoltage": 0, "finalVoltage": 1000,
+          "pointsVoltage": 10, "measureDelay_ms": 0, "rampVoltage": 100, "outputCurrentLimit": 0.001,
+          "enableKill": "True", "ammeterRange": 1e-6, "ammeterCompliance": 1e-5, "ammeterNPLCs": 1,
+          "resultsFileName": "sweep", "resultsFileExtension": "dat"}
+
+
+def testIndependentStations(tmp_path):
+    stations = [Station("A", 0, 25, 20, str(tmp_path / "a.dat"), {"livePort": 5001}),
+                Station("B", 0, 24, 21, str(tmp_path / "b.dat"), {"livePort": 5002}),
+                Station("C", 1, 25, 20, str(tmp_path / "c.dat"), {"pointsVoltage": "20"})]
+
+    validateStations(stations, SweepConfig(CONFIG))
+
+    assert stations[2].sweepParameters == {"pointsVoltage": 20}
+
+
+@pytest.mark.parametrize("second, shared", [(Station("B", 0, 25, 21, "b.dat"), "GPIB0::25::INSTR"),
+                                            (Station("B", 0, 20, 24, "b.dat"), "GPIB0::20::INSTR"),
+                                            (Station("B", 0, 24, 21, "a.dat"), "a.dat"),
+                                            (Station("B", 0, 24, 21, "b.dat", {"livePort": 5001}), "5001")])
+def testSharedResourcesAreRejected(second, shared):
+    first = Station("A", 0, 25, 20, "a.dat", {"livePort": 5001})
+
+    with pytest.raises(ConfigError, match="B: .*" + shared + " is already used by A"):
+        validateStations([first, second], SweepConfig(CONFIG))
+
+
+def testCommonLivePortNeedsOneStation():
+    config = SweepConfig(dict(CONFIG, livePort=5000))
+    validateStations([Station("A", 0, 25, 20, "a.dat")], config)
+
+    with pytest.raises(ConfigError, match="livePort 5000"):
+        validateStations([Station("A", 0, 25, 20, "a.dat"), Station("B", 0, 24, 21, "b.dat")], config)
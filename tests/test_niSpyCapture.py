@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lectura de la captura de NI Spy del repositorio (Capture.nitrace) y replay de sus respuestas.
+"""
+
+import os
+
+import pytest
+from pyvisa.errors import VisaIOError
+
+import niSpyCapture
+from niSpyCapture import (ReplayResourceManager, captureSetupDurations, captureTransactions, normalizeResourceName,
+                          parseCapture, sessionTimeBreakdown)
+
+CAPTURE_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Capture.nitrace")
+HPP_ID_RESPONSE = b"ID, iseg Spezialelektronik r3.01 sn.680075  Typ HPp 120 256\x00"
+
+
+@pytest.fixture(scope="module")
+def calls():
+    return parseCapture(CAPTURE_FILE_PATH)
+
+
+def testParseCapture(calls):
+    assert len(calls) == 29
+    assert [call.startTime for call in calls] == sorted(call.startTime for call in calls)
+    assert all(call.endTime >= call.startTime for call in calls)
+
+    writes = [call for call in calls if call.function == "viWrite"]
+    assert [call.payload for call in writes] == [b"ID\r\n", b"ID"]
+    assert {call.resource for call in writes} == {"GPIB0::20::INSTR"}
+    reads = [call for call in calls if call.function == "viRead"]
+    assert [call.payload for call in reads] == [HPP_ID_RESPONSE] * 2
+
+
+def testCaptureTransactions(calls):
+    transactions = captureTransactions(calls)
+
+    assert list(transactions) == ["GPIB0::20::INSTR"]
+    assert [response for writeDuration, response, readDuration in transactions["GPIB0::20::INSTR"][b"ID"]] == \
+        [HPP_ID_RESPONSE] * 2
+
+
+def testSessionTimeBreakdown(calls):
+    breakdown = sessionTimeBreakdown(calls)
+
+    assert len(breakdown) == 2
+    for session in breakdown.values():
+        assert 0 < session["busTime"] <= session["visaTime"] <= session["span"]
+        assert session["outsideVisaTime"] == pytest.approx(session["span"] - session["visaTime"])
+        assert sum(count for count, total in session["functions"].values()) == session["calls"]
+
+
+def testNotACapture(tmp_path):
+    notACapture = tmp_path / "capture.nitrace"
+    notACapture.write_bytes(b"\x05hello" + bytes(64))
+
+    with pytest.raises(ValueError):
+        parseCapture(str(notACapture))
+
+
+def testNormalizeResourceName():
+    assert normalizeResourceName("GPIB0::20::0::INSTR") == "GPIB0::20::INSTR"
+    assert normalizeResourceName("gpib::20::instr") == "GPIB0::20::INSTR"
+    assert normalizeResourceName("TCPIP0::1.2.3.4::INSTR") == "TCPIP0::1.2.3.4::INSTR"
+
+
+def testReplay(calls):
+    resourceManager = ReplayResourceManager(calls, timeScale=0, strict=True)
+    hvSource = resourceManager.open_resource("GPIB0::20::0::INSTR")
+
+    hvSource.write_raw("id")
+    assert hvSource.read_raw() == HPP_ID_RESPONSE
+    with pytest.raises(VisaIOError):
+        hvSource.write_raw("STATUS,MU")
+    with pytest.raises(VisaIOError):
+        resourceManager.open_resource("GPIB0::25::INSTR")
+
+
+def testReplaySetupDurations(calls, monkeypatch):
+    findDurations, openDurations = captureSetupDurations(calls)
+    assert findDurations == [pytest.approx(1.477636)]
+    assert openDurations == {"GPIB0::20::INSTR": [pytest.approx(0.719304), pytest.approx(0.596811)]}
+
+    waits = []
+    monkeypatch.setattr(niSpyCapture.time, "sleep", waits.append)
+    resourceManager = ReplayResourceManager(calls, timeScale=0.5, strict=True)
+    assert "GPIB0::20::INSTR" in resourceManager.list_resources()
+    resourceManager.open_resource("GPIB0::20::INSTR")
+    resourceManager.open_resource("GPIB0::20::INSTR")
+    resourceManager.open_resource("GPIB0::20::INSTR")
+
+    assert waits == pytest.approx([1.477636 / 2, 0.719304 / 2, 0.596811 / 2, 0.719304 / 2])
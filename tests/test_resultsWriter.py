@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fichero binario de resultados (.ivb): journal, recuperacion despues de un cierre inesperado y reanudacion.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from livePoints import PointBus, ResultsFileConsumer, SweepPoint
+from resultsWriter import (JOURNAL_SUFFIX, RECORD, BinaryResultsWriter, DatResultsWriter, convertToDat,
+                           readResultsFile, recoverResultsFile)
+
+
+def writePoints(writer, points, start=0):
+    for i in range(start, start + points):
+        writer.append(100.0 * i, 100.0 * i + 0.5, 1e-12 * (i + 1), timestamp=1000.0 + i)
+
+
+def crash(writer):
+    # el proceso muere: nada de close(), lo que esta en el lote en memoria se pierde
+    writer.f.close()
+    os.close(writer.journal)
+
+
+def testCloseWritesEverything(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, {"config": {"finalVoltage": 500}}, batchSize=4)
+    writePoints(writer, 10)
+    writer.close()
+
+    metadata, records = readResultsFile(resultsFilePath)
+    assert metadata == {"config": {"finalVoltage": 500}}
+    assert list(records["index"]) == list(range(10))
+    assert records["current"][3] == pytest.approx(4e-12)
+    assert np.isnan(records["currentStd"][0])
+    assert not os.path.exists(resultsFilePath + JOURNAL_SUFFIX)
+
+
+def testRecoverPointsFromTheJournal(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, batchSize=4)
+    writePoints(writer, 10)  # 8 en el fichero, 2 solo en el journal
+    crash(writer)
+
+    assert len(readResultsFile(resultsFilePath)[1]) == 8
+    assert recoverResultsFile(resultsFilePath) == 2
+    assert list(readResultsFile(resultsFilePath)[1]["index"]) == list(range(10))
+    assert not os.path.exists(resultsFilePath + JOURNAL_SUFFIX)
+
+
+def testRecoverDropsTornRecords(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, batchSize=4)
+    writePoints(writer, 6)
+    crash(writer)
+    fileSize = os.path.getsize(resultsFilePath)
+    # registro a medio escribir al final del fichero y del journal
+    with open(resultsFilePath, "ab") as f:
+        f.write(b"\x01" * (RECORD.size // 2))
+    with open(resultsFilePath + JOURNAL_SUFFIX, "ab") as f:
+        f.write(b"\x02" * 10)
+
+    assert recoverResultsFile(resultsFilePath) == 2
+    records = readResultsFile(resultsFilePath)[1]
+    assert list(records["index"]) == list(range(6))
+    assert os.path.getsize(resultsFilePath) == fileSize + 2 * RECORD.size
+
+
+def testRecoverIgnoresJournalRecordsAlreadyInTheFile(tmp_path):
+    # muerte entre la escritura del lote y el vaciado del journal: los registros estan en los dos sitios
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, batchSize=100)
+    writePoints(writer, 5)
+    writer.f.write(b"".join(writer.batch))
+    crash(writer)
+
+    assert recoverResultsFile(resultsFilePath) == 0
+    assert list(readResultsFile(resultsFilePath)[1]["index"]) == list(range(5))
+
+
+def testResumeAfterCrash(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, {"config": {}}, batchSize=4)
+    writePoints(writer, 7)
+    crash(writer)
+
+    # el checkpoint dice 6 puntos: el septimo se vuelve a medir
+    writer = BinaryResultsWriter(resultsFilePath, resumePoints=6)
+    writePoints(writer, 3, start=6)
+    writer.close()
+
+    metadata, records = readResultsFile(resultsFilePath)
+    assert metadata == {"config": {}}
+    assert list(records["index"]) == list(range(9))
+
+
+def testResumeNeedsThePoints(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath)
+    writePoints(writer, 3)
+    writer.close()
+
+    with pytest.raises(ValueError):
+        BinaryResultsWriter(resultsFilePath, resumePoints=5)
+
+
+def testConvertToDat(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath)
+    writer.append(0.0, 0.2, -1e-12)
+    writer.append(100.0, 99.8, 2e-12, currents=np.array([1e-12, 2e-12, 3e-12]))
+    writer.close()
+
+    datFilePath = convertToDat(resultsFilePath)
+    expectedFilePath = str(tmp_path / "expected.dat")
+    expected = DatResultsWriter(expectedFilePath)
+    expected.append(0.0, 0.2, -1e-12)
+    expected.append(100.0, 99.8, 2e-12, currents=np.array([1e-12, 2e-12, 3e-12]))
+    expected.close()
+
+    with open(datFilePath) as f, open(expectedFilePath) as e:
+        assert f.read() == e.read()
+
+
+def testDatStatisticsFollowTheMagnitude(tmp_path):
+    datFilePath = str(tmp_path / "sweep.dat")
+    writer = DatResultsWriter(datFilePath)
+    writer.append(100.0, 99.8, -2e-12, currents=np.array([-1e-12, -2e-12, -3e-12]))
+    writer.close()
+
+    with open(datFilePath) as f:
+        voltage, current, std, minimum, maximum = [float(value) for value in f.read().split("\t")]
+    assert (current, minimum, maximum) == (2e-12, 1e-12, 3e-12)
+    assert std == pytest.approx(1e-12)
+
+
+def testPublishedPointIsInTheJournal(tmp_path):
+    # el fichero de resultados se escribe dentro de publish: si el proceso muere justo despues no se pierde nada
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    writer = BinaryResultsWriter(resultsFilePath, batchSize=32)
+    consumer = ResultsFileConsumer(writer)
+    pointBus = PointBus([consumer]).start()
+    for i in range(3):
+        pointBus.publish(SweepPoint(i, 1000.0 + i, 100.0 * i, 100.0 * i, 1e-12, 0.0, 1e-12, 1e-9))
+
+    assert consumer.thread is None
+    crash(writer)
+    recoverResultsFile(resultsFilePath)
+    metadata, records = readResultsFile(resultsFilePath)
+    assert list(records["index"]) == [0, 1, 2]
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+start_process de principio a fin contra el banco simulado (instrumentSimulator.py): sweep completo, parada con
+stopEvent y reanudacion desde el checkpoint. Pocos puntos y rampa rapida, pero con las esperas reales del sweep
+(unos 10 s por sweep).
+"""
+
+import threading
+
+import pytest
+
+import main
+from instrumentSimulator import SimulatedBench
+from resultsWriter import readResultsFile
+from sweepBenchmark import runSweepBenchmark
+from sweepCheckpoint import SweepResumeError, loadCheckpoint
+
+K2400_ADDRESS = 25
+HV_SOURCE_ADDRESS = 20
+
+SWEEP = {"K2400_gpibAddress": K2400_ADDRESS,
+         "HVSource_gpibAddress": HV_SOURCE_ADDRESS,
+         "initialVoltage": 0,
+         "finalVoltage": 300,
+         "pointsVoltage": 3,
+         "measureDelay_ms": 0,
+         "rampVoltage": 1000,
+         "outputCurrentLimit": 1,
+         "enableKill": False,
+         "ammeterRange": 1e-6,
+         "ammeterCompliance": 1e-5,
+         "ammeterNPLCs": 1}
+
+
+@pytest.fixture
+def bench():
+    return SimulatedBench(K2400_ADDRESS, HV_SOURCE_ADDRESS)
+
+
+def readDatFile(resultsFilePath):
+    with open(resultsFilePath) as f:
+        return [[float(value) for value in line.split("\t")] for line in f]
+
+
+def assertHVSourceIsOff(bench):
+    assert not bench.hvSource.hvOn
+    assert bench.hvSource.setpoint == 0.0
+
+
+def testSweep(bench, tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.dat")
+    progress = []
+
+    finalVoltage = main.start_process(resultsFilePath=resultsFilePath, resourceManager=bench.resourceManager(),
+                                      progressCallback=lambda *point: progress.append(point), **SWEEP)
+
+    points = readDatFile(resultsFilePath)
+    assert [round(voltage, -2) for voltage, current in points] == [0.0, 100.0, 200.0, 300.0]
+    assert all(0 <= current < 1e-10 for voltage, current in points)
+    assert [points for points, voltage, current in progress] == [1, 2, 3, 4]
+    assert finalVoltage == 0.0
+    assertHVSourceIsOff(bench)
+    assert loadCheckpoint(resultsFilePath)["complete"]
+    assert bench.unknownCommands == []
+
+
+def testStopAndResume(bench, tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.ivb")
+    stopEvent = threading.Event()
+
+    def stopAfterTwoPoints(points, voltage, current):
+        if points == 2:
+            stopEvent.set()
+
+    with pytest.raises(main.SweepAbortedError):
+        main.start_process(resultsFilePath=resultsFilePath, resourceManager=bench.resourceManager(),
+                           resultsFormat="binary", progressCallback=stopAfterTwoPoints, stopEvent=stopEvent, **SWEEP)
+    assertHVSourceIsOff(bench)
+    checkpoint = loadCheckpoint(resultsFilePath)
+    assert not checkpoint["complete"]
+    assert len(readResultsFile(resultsFilePath)[1]) == 2
+
+    main.start_process(resultsFilePath=resultsFilePath, resourceManager=bench.resourceManager(),
+                       resultsFormat="binary", resume=True, **SWEEP)
+
+    metadata, records = readResultsFile(resultsFilePath)
+    assert list(records["index"]) == [0, 1, 2, 3]
+    assert list(records["setpoint"]) == [0.0, 100.0, 200.0, 300.0]
+    assert loadCheckpoint(resultsFilePath)["complete"]
+    assertHVSourceIsOff(bench)
+
+
+def testResumeWithAnotherConfiguration(bench, tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.dat")
+    stopEvent = threading.Event()
+    stopEvent.set()
+
+    with pytest.raises(main.SweepAbortedError):
+        main.start_process(resultsFilePath=resultsFilePath, resourceManager=bench.resourceManager(),
+                           stopEvent=stopEvent, **SWEEP)
+
+    with pytest.raises(SweepResumeError):
+        main.start_process(resultsFilePath=resultsFilePath, resourceManager=bench.resourceManager(), resume=True,
+                           **dict(SWEEP, finalVoltage=400))
+    assertHVSourceIsOff(bench)
+
+
+def testBenchmarkCountsBinaryPoints():
+    result = runSweepBenchmark(dict(SWEEP, resultsFormat="binary"))
+
+    assert result["points"] == 4
+    assert 0 < result["busyTime"] <= result["totalTime"]
+
+
+def testPointReadsTheHVSourceAfterSettling(bench, tmp_path):
+    # la tension de cada punto se lee a la vez que la corriente, no se reutiliza la lectura de la estabilizacion
+    events = []
+    handleScpiCommand = bench.k2400.handleScpiCommand
+    hvSourceReadRaw = bench.hvSource.read_raw
+
+    def k2400Command(command):
+        if command.strip().upper().startswith((":READ?", "READ?", ":INIT", "INIT")):
+            events.append("measure")
+        return handleScpiCommand(command)
+
+    def hvSourceRead(size=None):
+        events.append("hvRead")
+        return hvSourceReadRaw(size)
+
+    bench.k2400.handleScpiCommand = k2400Command
+    bench.hvSource.read_raw = hvSourceRead
+    main.start_process(resultsFilePath=str(tmp_path / "sweep.dat"), resourceManager=bench.resourceManager(),
+                       progressCallback=lambda *point: events.append("point"), **SWEEP)
+
+    segments = [segment.split() for segment in " ".join(events).split("point")[:-1]]
+    assert len(segments) == 4
+    for segment in segments:
+        lastMeasure = len(segment) - 1 - segment[::-1].index("measure")
+        assert "hvRead" in segment[lastMeasure:]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+padSweeps y resample: matrices de sweeps con distinto numero de puntos e interpolacion en log10|I|.
+"""
+
+import numpy as np
+import pytest
+
+from sweepAnalysis import padSweeps, resample
+
+
+def testPadSweeps():
+    sweeps = [np.array([[200.0, 3e-12], [0.0, 1e-12], [100.0, 2e-12]]),
+              np.array([[0.0, 5e-12]])]
+
+    voltage, current = padSweeps(sweeps, 1.0)
+
+    assert voltage.shape == current.shape == (2, 3)
+    assert list(voltage[0]) == [0.0, 100.0, 200.0]
+    assert list(current[0]) == [1e-12, 2e-12, 3e-12]
+    assert voltage[1, 0] == 0.0 and current[1, 0] == 5e-12
+    assert np.isnan(voltage[1, 1:]).all() and np.isnan(current[1, 1:]).all()
+
+
+def testPadSweepsRoundsToTheVoltageResolution():
+    voltage, current = padSweeps([np.array([[99.6, 1e-12], [-0.3, 2e-12]])], 1.0)
+
+    assert list(voltage[0]) == [0.0, 100.0]
+    assert list(current[0]) == [2e-12, 1e-12]
+
+
+def testResampleInterpolatesInLogCurrent():
+    voltage = np.array([[0.0, 100.0, 200.0]])
+    current = np.array([[1e-12, 1e-10, 1e-8]])
+
+    result = resample(voltage, current, [0.0, 50.0, 150.0, 200.0])
+
+    assert result[0] == pytest.approx([1e-12, 1e-11, 1e-9, 1e-8])
+
+
+def testResampleRowsIndependently():
+    voltage, current = padSweeps([np.array([[0.0, 1e-12], [100.0, 1e-10]]),
+                                  np.array([[0.0, 1e-9], [50.0, 1e-9], [300.0, 1e-6]])], 1.0)
+
+    result = resample(voltage, current, [50.0, 200.0])
+
+    assert result[0, 0] == pytest.approx(1e-11)
+    assert np.isnan(result[0, 1])  # fuera del rango medido
+    assert result[1] == pytest.approx([1e-9, 1e-9 * 10 ** (3 * 150.0 / 250.0)])
+
+
+def testResampleNeedsTwoPoints():
+    voltage, current = padSweeps([np.array([[0.0, 1e-12]]), np.array([[0.0, 1e-12], [100.0, 1e-12]])], 1.0)
+
+    result = resample(voltage, current, [0.0, 50.0])
+
+    assert np.isnan(result[0]).all()
+    assert result[1] == pytest.approx([1e-12, 1e-12])
+
+
+def testResampleUsesTheCurrentFloor():
+    result = resample(np.array([[0.0, 100.0]]), np.array([[0.0, 1e-12]]), [0.0, 50.0], currentFloor=1e-14)
+
+    assert result[0] == pytest.approx([1e-14, 1e-13])
+
+
+def testResampleEmpty():
+    result = resample(np.full((2, 3), np.nan), np.full((2, 3), np.nan), [0.0, 100.0])
+
+    assert result.shape == (2, 2) and np.isnan(result).all()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint de un sweep: guardado, carga y comprobaciones al reanudar.
+"""
+
+import json
+
+import pytest
+
+from sweepCheckpoint import (CHECKPOINT_VERSION, SweepCheckpoint, SweepResumeError, checkpointFilePath,
+                             loadCheckpoint, sweepConfigHash, validateInstrumentSettings, validateResume)
+
+CONFIG = {"gpibBoard": 0, "K2400_gpibAddress": 25, "HVSource_gpibAddress": 20, "finalVoltage": 1000,
+          "pointsVoltage": 10}
+INSTRUMENTS = {"K2400": "KEITHLEY INSTRUMENTS INC.,MODEL 2400,1234567", "HVSource": "ID, HPP-120 SN 0001"}
+
+
+def testConfigHashIgnoresTheStationWiring():
+    moved = dict(CONFIG, gpibBoard=1, K2400_gpibAddress=24)
+
+    assert sweepConfigHash(moved) == sweepConfigHash(CONFIG)
+    assert sweepConfigHash(dict(CONFIG, finalVoltage=2000)) != sweepConfigHash(CONFIG)
+
+
+def testSaveAndLoad(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.dat")
+    assert loadCheckpoint(resultsFilePath) is None
+
+    checkpoint = SweepCheckpoint(resultsFilePath, sweepConfigHash(CONFIG), "dat", INSTRUMENTS)
+    checkpoint.setInstrumentSettings({"K2400": {"nplcs": 1}})
+    checkpoint.save({"points": 3, "nextSetpoint": 300.0})
+
+    loaded = loadCheckpoint(resultsFilePath)
+    assert loaded["state"] == {"points": 3, "nextSetpoint": 300.0}
+    assert loaded["instrumentSettings"] == {"K2400": {"nplcs": 1}}
+    assert not loaded["complete"]
+
+    checkpoint.markComplete()
+    assert loadCheckpoint(resultsFilePath)["complete"]
+    assert loadCheckpoint(resultsFilePath)["state"] == {"points": 3, "nextSetpoint": 300.0}
+
+
+def testOtherVersionsAreIgnored(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.dat")
+    with open(checkpointFilePath(resultsFilePath), "w") as f:
+        json.dump({"version": CHECKPOINT_VERSION + 1}, f)
+
+    assert loadCheckpoint(resultsFilePath) is None
+
+
+def testRestoreKeepsTheInterruptedState(tmp_path):
+    resultsFilePath = str(tmp_path / "sweep.dat")
+    interrupted = SweepCheckpoint(resultsFilePath, "hash", "dat", INSTRUMENTS)
+    interrupted.setInstrumentSettings({"K2400": {"nplcs": 1}})
+    interrupted.save({"points": 5})
+
+    resumed = SweepCheckpoint(resultsFilePath, "hash", "dat", INSTRUMENTS)
+    resumed.restore(loadCheckpoint(resultsFilePath))
+    assert resumed.checkpoint["state"] == {"points": 5}
+    assert resumed.checkpoint["instrumentSettings"] == {"K2400": {"nplcs": 1}}
+
+
+def testValidateResume():
+    checkpoint = SweepCheckpoint("sweep.dat", "hash", "binary", INSTRUMENTS).checkpoint
+
+    validateResume(checkpoint, "hash", "binary", INSTRUMENTS)
+    validateResume(checkpoint, "hash", "binary", {"K2400": None, "HVSource": INSTRUMENTS["HVSource"]})
+    with pytest.raises(SweepResumeError):
+        validateResume(checkpoint, "otherHash", "binary", INSTRUMENTS)
+    with pytest.raises(SweepResumeError):
+        validateResume(checkpoint, "hash", "dat", INSTRUMENTS)
+    with pytest.raises(SweepResumeError):
+        validateResume(checkpoint, "hash", "binary", dict(INSTRUMENTS, K2400="KEITHLEY,MODEL 2400,7654321"))
+
+
+def testValidateInstrumentSettings():
+    checkpoint = {"instrumentSettings": {"K2400": {"nplcs": 1, "range": 1e-6}}}
+
+    validateInstrumentSettings(checkpoint, {"K2400": {"nplcs": 1, "range": 1e-6}, "HVSource": {"ramp": 100}})
+    validateInstrumentSettings({"instrumentSettings": None}, {"K2400": {"nplcs": 10}})
+    with pytest.raises(SweepResumeError, match="nplcs"):
+        validateInstrumentSettings(checkpoint, {"K2400": {"nplcs": 10, "range": 1e-6}})
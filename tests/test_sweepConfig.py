@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+Configuracion tipada del sweep: conversion y validacion de los campos, y el K2400 configurado con esos valores.
+"""
+
+import json
+import math
+
+import pytest
+
+import main
+from concurrentInstrumentIO import getOutputInterlock
+from fileUtilities import readConfigFile, readOptionalConfigValue
+from instrumentSimulator import SimulatedBench
+from sweepConfig import ConfigError, SweepConfig
+
+CONFIG = {"K2400_gpibAddress": 25, "HVSource_gpibAddress": 20, "initialVoltage": 0, "finalVoltage": 1000,
+          "pointsVoltage": 10, "measureDelay_ms": 0, "rampVoltage": 100, "outputCurrentLimit": 0.001,
+          "enableKill": "True", "ammeterRange": 1e-6, "ammeterCompliance": 1e-5, "ammeterNPLCs": 0.5,
+          "resultsFileName": "sweep", "resultsFileExtension": "dat"}
+
+
+def testValidConfig():
+    config = SweepConfig(CONFIG)
+
+    assert config.ammeterNPLCs == 0.5
+    assert config.enableKill is True
+    assert config.pointsVoltage == 10 and isinstance(config.pointsVoltage, int)
+    assert config.replace(pointsVoltage="20").pointsVoltage == 20
+
+
+@pytest.mark.parametrize("name, value", [("pointsVoltage", 2.5), ("pointsVoltage", "2.5"), ("pointsVoltage", True),
+                                         ("finalVoltage", float("nan")), ("finalVoltage", "nan"),
+                                         ("ammeterNPLCs", True), ("rampVoltage", math.inf), ("rampVoltage", [1]),
+                                         ("ammeterNPLCs", 0.001)])
+def testInvalidValues(name, value):
+    with pytest.raises(ConfigError, match=name):
+        SweepConfig(dict(CONFIG, **{name: value}))
+
+
+def testFileUtilitiesReadTheValidatedConfig(tmp_path):
+    configFilePath = str(tmp_path / "process_config_file.json")
+    with open(configFilePath, "w") as f:
+        json.dump(CONFIG, f)
+
+    values = readConfigFile(configFilePath)
+    assert len(values) == 14
+    assert values[8] is True and values[11] == 0.5
+    assert readOptionalConfigValue(configFilePath, "ammeterNPLCs", 1) == 0.5
+    assert readOptionalConfigValue(configFilePath, "readingsPerPoint", 4) == 4
+
+
+def testFractionalNPLC():
+    bench = SimulatedBench()
+    k2400, hv_source = main.getInstruments(25, 20, bench.resourceManager())
+
+    # la fuente del banco simulado esta apagada: confirmada en 0V para el *RST del K2400
+    getOutputInterlock(k2400).hvSourceSettledAt(0.0)
+    main.initializeK2400(k2400, 1e-5, 0.5, 1e-6, forceReset=True)
+
+    assert bench.k2400.nplc == 0.5
+    assert main.appliedInstrumentSettings[k2400.resource_name]["nplc"] == "0.5"
+    assert bench.unknownCommands == []
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Modelo de llegada de la fuente HV a su setpoint. Se usa desde main.waitForVoltageStabilization para no hacer
+polling a ciegas: se duerme hasta la llegada prevista con la rampa configurada ("RAMP,xxxV/s") y despues se
+consulta con periodos cada vez mas cortos. El modelo aprende durante el sweep el tiempo extra observado
+(latencias, arranque de la rampa, etc.) para cada tamaño de salto.
+"""
+
+import math
+
+
+class RampSettlingPredictor:
+    """
+    Predice cuanto tarda la fuente en llegar a un nuevo setpoint:
+        tiempo = |salto| / rampVoltage + overhead aprendido para ese tamaño de salto
+
+    Args:
+        rampVoltage (float): Rampa configurada en la fuente. V/s
+        minPollPeriod (float): Periodo minimo entre lecturas una vez pasada la llegada prevista. Seconds
+        maxPollPeriod (float): Periodo de la primera lectura despues de la llegada prevista. Seconds
+        pollBackoff (float): Factor (< 1) por el que se multiplica el periodo de polling en cada lectura fallida
+        learningRate (float): Peso de la ultima observacion en la media movil del overhead
+        initialOverhead (float): Overhead supuesto para saltos que aun no se han observado. Seconds
+    """
+
+    def __init__(self, rampVoltage, minPollPeriod=0.05, maxPollPeriod=0.5, pollBackoff=0.5, learningRate=0.5,
+                 initialOverhead=0.2):
+        self.rampVoltage = float(rampVoltage)
+        self.minPollPeriod = minPollPeriod
+        self.maxPollPeriod = maxPollPeriod
+        self.pollBackoff = pollBackoff
+        self.learningRate = learningRate
+        self.initialOverhead = initialOverhead
+        self.learnedOverhead = {}  # bucket del tamaño de salto --> overhead (s)
+        self.lastSetpoint = None  # V, None si no se conoce la tension de partida
+
+    @staticmethod
+    def stepBucket(stepVoltage):
+        # saltos agrupados por medias octavas: 100V y 120V comparten bucket, 100V y 200V no
+        return int(round(2 * math.log2(max(abs(stepVoltage), 1.0))))
+
+    def rampTime(self, fromVoltage, toVoltage):
+        return abs(toVoltage - fromVoltage) / self.rampVoltage
+
+    def predictSettleTime(self, fromVoltage, toVoltage):
+        """
+        Tiempo previsto (s) desde que se envia el setpoint hasta que la salida esta en toVoltage.
+        """
+        overhead = self.learnedOverhead.get(self.stepBucket(toVoltage - fromVoltage), self.initialOverhead)
+        return self.rampTime(fromVoltage, toVoltage) + overhead
+
+    def remainingTime(self, readVoltage, toVoltage):
+        """
+        Tiempo (s) que le queda a la rampa segun la ultima lectura de la fuente.
+        """
+        return self.rampTime(readVoltage, toVoltage)
+
+    def pollPeriods(self):
+        """
+        Periodos de espera entre lecturas despues de la llegada prevista, cada vez mas cortos hasta minPollPeriod.
+        """
+        period = self.maxPollPeriod
+        while True:
+            yield period
+            period = max(period * self.pollBackoff, self.minPollPeriod)
+
+    def learn(self, fromVoltage, toVoltage, observedSettleTime, arrivedAtFirstCheck):
+        """
+        Actualiza el overhead del bucket del salto con el tiempo observado.\n
+        Si la salida ya estaba en rango en la primera lectura solo sabemos que llego antes de lo previsto,
+        asi que reducimos el overhead para comprobar antes la proxima vez.
+        """
+        bucket = self.stepBucket(toVoltage - fromVoltage)
+        overhead = self.learnedOverhead.get(bucket, self.initialOverhead)
+
+        if arrivedAtFirstCheck:
+            overhead = overhead * (1 - self.learningRate)
+        else:
+            observedOverhead = max(observedSettleTime - self.rampTime(fromVoltage, toVoltage), 0.0)
+            overhead = (1 - self.learningRate) * overhead + self.learningRate * observedOverhead
+
+        self.learnedOverhead[bucket] = overhead
+        self.lastSetpoint = toVoltage